@@ -0,0 +1,310 @@
+#
+# Copyright 2018-2019 IBM Corp. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+"""Micro-benchmarks of ``maxfw.utils.image_functions`` and of representative ``ImageProcessor`` pipelines.
+
+The inputs are synthetic images generated from a fixed seed, so the results only depend on the code and the
+machine. Run from the root of the repository:
+
+    $ python -m benchmarks.bench_image run --quick -o baseline.json
+    $ python -m benchmarks.bench_image run --quick -o current.json
+    $ python -m benchmarks.bench_image compare baseline.json current.json --threshold 0.1
+"""
+import functools
+import io
+import sys
+
+import numpy as np
+from PIL import Image
+
+from maxfw.utils import image_functions as F
+from maxfw.utils.buffers import BufferPool
+from maxfw.utils.image_utils import ImageProcessor, ToPILImage, Resize, Rotate, Grayscale, PILtoarray, Normalize, \
+    Standardize, ToTensor, AdjustBrightness, AdjustContrast, AdjustGamma, AdjustHue
+
+from .harness import Case, main
+
+SEED = 1234
+
+# (width, height) of the synthetic images; the first size is the only one used by quick runs
+SIZES = ((640, 480), (256, 256), (1920, 1080))
+MODES = ('RGB', 'L', 'RGBA')
+FORMATS = ('JPEG', 'PNG')
+
+MEAN = [123.7, 116.3, 103.5]
+STD = [58.4, 57.1, 57.4]
+
+
+@functools.lru_cache(maxsize=None)
+def synthetic_array(size, mode='RGB'):
+    """A deterministic image with smooth gradients, edges and noise, so that it compresses like a photograph."""
+    width, height = size
+    rng = np.random.RandomState(SEED)
+    y, x = np.mgrid[0:height, 0:width].astype(np.float32)
+    channels = []
+    for c in range(3):
+        phase = rng.uniform(0, 2 * np.pi)
+        wave = np.sin(x / width * (3 + c) * np.pi + phase) * np.cos(y / height * (2 + c) * np.pi)
+        channels.append(127.5 + 80 * wave)
+    img = np.stack(channels, axis=-1)
+    # a few hard edges
+    for _ in range(8):
+        x0, y0 = rng.randint(0, width), rng.randint(0, height)
+        img[y0:y0 + height // 6, x0:x0 + width // 6] = rng.uniform(0, 255, 3)
+    img += rng.normal(0, 8, img.shape)
+    arr = np.clip(img, 0, 255).astype(np.uint8)
+    return np.asarray(Image.fromarray(arr, 'RGB').convert(mode))
+
+
+@functools.lru_cache(maxsize=None)
+def synthetic_image(size, mode='RGB'):
+    return Image.fromarray(synthetic_array(size, mode), mode)
+
+
+@functools.lru_cache(maxsize=None)
+def synthetic_bytes(size, mode='RGB', format='JPEG'):
+    stream = io.BytesIO()
+    img = synthetic_image(size, mode)
+    if format == 'JPEG' and mode == 'RGBA':
+        img = img.convert('RGB')
+    img.save(stream, format, **({'quality': 90} if format == 'JPEG' else {}))
+    return stream.getvalue()
+
+
+def _label(size, mode=None, format=None):
+    parts = [format, mode, '{}x{}'.format(*size)]
+    return '-'.join(p for p in parts if p)
+
+
+def _cases():
+    cases = []
+
+    def add(name, setup, quick):
+        cases.append(Case(name, setup, quick))
+
+    for k, size in enumerate(SIZES):
+        quick = k == 0
+        for mode in MODES:
+            label = _label(size, mode)
+            quick_mode = quick and mode == 'RGB'
+
+            def pil(size=size, mode=mode):
+                return synthetic_image(size, mode)
+
+            def arr(size=size, mode=mode):
+                return synthetic_array(size, mode)
+
+            for format in FORMATS:
+                def setup(size=size, mode=mode, format=format):
+                    data = synthetic_bytes(size, mode, format)
+                    return lambda: F.to_pil_image(data, mode)
+                add('to_pil_image/bytes-' + _label(size, mode, format), setup, quick and mode != 'RGBA')
+
+                def setup(size=size, mode=mode, format=format):
+                    data = synthetic_bytes(size, mode, format)
+                    return lambda: F.probe_image(data)
+                add('probe_image/' + _label(size, mode, format), setup, quick_mode)
+
+            def setup(size=size, mode=mode):
+                data = synthetic_bytes(size, mode, 'JPEG')
+                return lambda: F.to_pil_image(data, mode, draft_size=(224, 224))
+            add('to_pil_image/bytes-draft-' + _label(size, mode, 'JPEG'), setup, quick_mode)
+
+            def setup(arr=arr, mode=mode):
+                a = arr()
+                return lambda: F.to_pil_image(a, mode)
+            add('to_pil_image/array-' + label, setup, quick_mode)
+
+            def setup(pil=pil):
+                img = pil()
+                return lambda: F.pil_to_array(img)
+            add('pil_to_array/' + label, setup, quick_mode)
+
+            def setup(arr=arr):
+                a = arr()
+                return lambda: F.normalize(a)
+            add('normalize/' + label, setup, quick_mode)
+
+            if mode != 'RGBA':
+                mean, std = (MEAN, STD) if mode == 'RGB' else (MEAN[0], STD[0])
+
+                def setup(arr=arr, mean=mean, std=std):
+                    a = arr()
+                    return lambda: F.standardize(a, mean, std)
+                add('standardize/' + label, setup, quick)
+
+                def setup(arr=arr, mean=mean, std=std):
+                    a = arr()
+                    return lambda: F.standardize(a, mean, std, dtype=np.float32)
+                add('standardize/float32-' + label, setup, quick_mode)
+
+                def setup(arr=arr, mean=mean, std=std):
+                    a = arr()
+                    return lambda: F.standardize_params(a, mean, std)
+                add('standardize_params/' + label, setup, quick_mode)
+
+                def setup(arr=arr, mean=mean, std=std):
+                    a = arr()
+                    scale, offset = F.standardize_params(a, mean, std)
+                    out = np.empty(a.shape, dtype=np.float32)
+                    return lambda: F.scale_offset(a, scale, offset, out=out)
+                add('scale_offset/out-' + label, setup, quick_mode)
+
+            def setup(pil=pil):
+                img = pil()
+                return lambda: F.resize(img, (224, 224))
+            add('resize/' + label, setup, quick)
+
+            def setup(pil=pil):
+                img = pil()
+                return lambda: F.resize(img, 256)
+            add('resize/shorter-edge-' + label, setup, quick_mode)
+
+            def setup(pil=pil):
+                img = pil()
+                w, h = img.size
+                return lambda: F.crop(img, h // 4, w // 4, h // 2, w // 2)
+            add('crop/' + label, setup, quick_mode)
+
+            def setup(pil=pil):
+                img = pil()
+                return lambda: F.center_crop(img, 224)
+            add('center_crop/' + label, setup, quick_mode)
+
+            def setup(pil=pil):
+                img = pil()
+                w, h = img.size
+                return lambda: F.resized_crop(img, h // 4, w // 4, h // 2, w // 2, (224, 224))
+            add('resized_crop/' + label, setup, quick_mode)
+
+            def setup(pil=pil):
+                img = pil()
+                return lambda: F.hflip(img)
+            add('hflip/' + label, setup, quick_mode)
+
+            def setup(pil=pil):
+                img = pil()
+                return lambda: F.vflip(img)
+            add('vflip/' + label, setup, quick_mode)
+
+            def setup(pil=pil):
+                img = pil()
+                return lambda: F.adjust_brightness(img, 1.3)
+            add('adjust_brightness/' + label, setup, quick_mode)
+
+            def setup(pil=pil):
+                img = pil()
+                return lambda: F.adjust_contrast(img, 0.7)
+            add('adjust_contrast/' + label, setup, quick_mode)
+
+            def setup(pil=pil):
+                img = pil()
+                return lambda: F.adjust_gamma(img, 0.8, 1.1)
+            add('adjust_gamma/' + label, setup, quick_mode)
+
+            def setup(pil=pil):
+                img = pil()
+                return lambda: F.adjust_points(img, [('brightness', 1.3), ('contrast', 0.7), ('gamma', 0.8, 1.1)])
+            add('adjust_points/' + label, setup, quick_mode)
+
+            def setup(pil=pil):
+                img = pil()
+                return lambda: F.rotate(img, 30)
+            add('rotate/' + label, setup, quick_mode)
+
+            def setup(pil=pil):
+                img = pil()
+                return lambda: F.to_grayscale(img, 3 if img.mode == 'L' else 1)
+            add('to_grayscale/' + label, setup, quick_mode)
+
+            if mode != 'L':
+                def setup(pil=pil):
+                    img = pil()
+                    return lambda: F.adjust_saturation(img, 1.5)
+                add('adjust_saturation/' + label, setup, quick_mode)
+
+                def setup(pil=pil):
+                    img = pil()
+                    return lambda: F.adjust_hue(img, 0.1)
+                add('adjust_hue/' + label, setup, quick_mode)
+
+                def setup(pil=pil):
+                    img = pil()
+                    return lambda: F.adjust_hue(img, 0.1, approximate=True)
+                add('adjust_hue/approximate-' + label, setup, quick_mode)
+
+    # functions that do not depend on the image size
+    add('resize_output_size/shorter-edge', lambda: (lambda: F.resize_output_size((1920, 1080), 256)), True)
+    add('rotation_matrix/30', lambda: (lambda: F.rotation_matrix((1920, 1080), 30)), True)
+
+    cases.extend(_pipeline_cases())
+    return cases
+
+
+def _pipelines():
+    """Representative pipelines of MAX models, by name."""
+    return {
+        'classify': lambda: [ToPILImage('RGB'), Resize((224, 224)), PILtoarray(), Standardize(MEAN, STD)],
+        'classify-tensor': lambda: [ToPILImage('RGB'), Resize((224, 224)),
+                                    ToTensor('CHW', np.float32, mean=MEAN, std=STD)],
+        'grayscale': lambda: [ToPILImage('RGB'), Resize((64, 64)), Grayscale(), PILtoarray(), Normalize()],
+        'augment': lambda: [ToPILImage('RGB'), Rotate(15), AdjustBrightness(1.2), AdjustContrast(0.9),
+                            AdjustGamma(0.9), AdjustHue(0.05), Resize((224, 224)), PILtoarray(), Normalize()],
+    }
+
+
+def _pipeline_cases():
+    cases = []
+    for name, transforms in sorted(_pipelines().items()):
+        for k, size in enumerate(SIZES):
+            for format in FORMATS:
+                label = _label(size, None, format)
+                quick = k == 0 and format == 'JPEG'
+                for compile in (False, True):
+                    def setup(transforms=transforms, size=size, format=format, compile=compile):
+                        p = ImageProcessor(transforms(), compile=compile)
+                        data = synthetic_bytes(size, 'RGB', format)
+                        return lambda: p.apply_transforms(data)
+                    cases.append(Case('pipeline/{}{}/{}'.format(name, '-compiled' if compile else '', label),
+                                      setup, quick))
+
+    # a batch of 8 images, straight into a pooled batch array
+    def setup():
+        pool = BufferPool()
+        p = ImageProcessor(_pipelines()['classify-tensor'](), compile=True, pool=pool)
+        images = [synthetic_bytes(SIZES[0], 'RGB', 'JPEG')] * 8
+
+        def fn():
+            pool.release(p.apply_batch(images))
+        return fn
+    cases.append(Case('pipeline/classify-tensor-batch8/' + _label(SIZES[0], None, 'JPEG'), setup, True))
+    return cases
+
+
+def uncovered(cases):
+    """Return the public functions of ``image_functions`` that no benchmark is named after."""
+    covered = {case.name.split('/', 1)[0] for case in cases}
+    return sorted(name for name, value in vars(F).items()
+                  if callable(value) and getattr(value, '__module__', None) == F.__name__ and
+                  not name.startswith('_') and not isinstance(value, type) and name not in covered)
+
+
+CASES = _cases()
+
+if __name__ == '__main__':
+    missing = uncovered(CASES)
+    if missing:
+        print('Warning: no benchmarks for {}.'.format(', '.join(missing)), file=sys.stderr)
+    sys.exit(main(CASES))
@@ -0,0 +1,89 @@
+#
+# Copyright 2018-2019 IBM Corp. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+"""Cold start benchmarks: the time a fresh Python process takes to import the maxfw modules, and to answer its
+first requests.
+
+Every benchmark starts a new interpreter, so the times include the interpreter startup, which is measured on its
+own by `startup/python`. The results use the format of ``benchmarks.harness``:
+
+    $ python -m benchmarks.bench_startup run -o startup.json
+    $ python -m benchmarks.bench_startup compare baseline.json startup.json --threshold 0.1
+"""
+import os
+import subprocess  # nosec - only used to run this interpreter on fixed snippets
+import sys
+import tempfile
+
+from .bench_image import synthetic_bytes
+from .harness import Case, main
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# the first requests of a freshly started stub model, served with the Flask test client (the path of the uploaded
+# image is the first argument)
+FIRST_REQUESTS = '''
+import io, sys
+from benchmarks.stub_model import StubModelWrapper, create_app
+client = create_app(StubModelWrapper(sleep_ms=0)).app.test_client()
+assert client.get('/model/metadata').status_code == 200
+{predict}
+'''
+
+PREDICT = '''
+with open(sys.argv[1], 'rb') as f:
+    data = {'image': (io.BytesIO(f.read()), 'image.jpg')}
+assert client.post('/model/predict', data=data, content_type='multipart/form-data').status_code == 200
+'''
+
+SNIPPETS = {
+    'startup/python': 'pass',
+    'import/maxfw.core': 'import maxfw.core',
+    'import/maxfw.model': 'import maxfw.model',
+    'import/maxfw.utils.image_functions': 'import maxfw.utils.image_functions',
+    'import/maxfw.utils.image_utils': 'import maxfw.utils.image_utils',
+    'import/maxfw.core.MAXApp': 'from maxfw.core import MAXApp, MAX_API, PredictAPI',
+    'first-request/metadata': FIRST_REQUESTS.format(predict=''),
+    'first-request/predict': FIRST_REQUESTS.format(predict=PREDICT),
+}
+
+
+def _python(code, *args):
+    def fn():
+        subprocess.run([sys.executable, '-c', code] + list(args), cwd=ROOT, check=True)  # nosec - fixed snippets
+    return fn
+
+
+def _image_file():
+    path = os.path.join(tempfile.gettempdir(), 'maxfw-bench-startup.jpg')
+    with open(path, 'wb') as f:
+        f.write(synthetic_bytes((640, 480), 'RGB', 'JPEG'))
+    return path
+
+
+def _cases():
+    cases = []
+    for name, code in SNIPPETS.items():
+        if name == 'first-request/predict':
+            cases.append(Case(name, lambda code=code: _python(code, _image_file())))
+        else:
+            cases.append(Case(name, lambda code=code: _python(code)))
+    return cases
+
+
+CASES = _cases()
+
+if __name__ == '__main__':
+    sys.exit(main(CASES))
@@ -0,0 +1,217 @@
+#
+# Copyright 2018-2019 IBM Corp. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+"""Timing, result files and regression checks shared by the benchmark suites.
+
+A suite is a list of ``Case`` objects. ``main(cases)`` gives it a command line interface:
+
+    $ python -m benchmarks.bench_image run -o results.json
+    $ python -m benchmarks.bench_image compare baseline.json results.json --threshold 0.1
+
+`compare` exits with status 1 when a benchmark got slower than the baseline by more than the threshold.
+"""
+import argparse
+import datetime
+import gc
+import json
+import os
+import platform
+import re
+import statistics
+import sys
+import time
+
+RESULTS_VERSION = 1
+
+
+class Case(object):
+    """A benchmark: `setup()` prepares the inputs (untimed) and returns the function that is timed.
+
+    Args:
+        name (str): the unique name of the benchmark, e.g. `'resize/RGB-1024x768'`.
+        setup (callable): returns a function without arguments that runs the code under test once.
+        quick (bool): include the benchmark in quick runs.
+    """
+
+    def __init__(self, name, setup, quick=True):
+        self.name = name
+        self.setup = setup
+        self.quick = quick
+
+
+def measure(fn, repeats=5, min_time=0.05):
+    """Time `fn` and return a dictionary with the statistics of its duration in seconds per call.
+
+    The number of calls per repeat is calibrated so that a repeat lasts at least `min_time` seconds, which keeps
+    the timer resolution out of the results of fast functions. The garbage collector is disabled while timing.
+    """
+    fn()  # warm up caches and lazy initialization
+
+    number = 1
+    while True:
+        elapsed = _time(fn, number)
+        if elapsed >= min_time or number >= 1 << 20:
+            break
+        number *= 2 if elapsed <= 0 else max(2, min(10, int(min_time / elapsed * 1.2) + 1))
+
+    times = [elapsed / number] + [_time(fn, number) / number for _ in range(repeats - 1)]
+    return {
+        'seconds': {
+            'min': min(times),
+            'median': statistics.median(times),
+            'mean': statistics.mean(times),
+            'stdev': statistics.stdev(times) if len(times) > 1 else 0.0,
+        },
+        'number': number,
+        'repeats': repeats,
+    }
+
+
+def _time(fn, number):
+    gc_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        start = time.perf_counter()
+        for _ in range(number):
+            fn()
+        return time.perf_counter() - start
+    finally:
+        if gc_enabled:
+            gc.enable()
+
+
+def environment():
+    """Describe the interpreter, machine and library versions the results were measured with."""
+    env = {
+        'python': platform.python_version(),
+        'implementation': platform.python_implementation(),
+        'platform': platform.platform(),
+        'machine': platform.machine(),
+        'processor': platform.processor(),
+        'cpu_count': os.cpu_count(),
+    }
+    for module in ('numpy', 'PIL', 'flask'):
+        try:
+            env[module] = __import__(module).__version__
+        except (ImportError, AttributeError):
+            env[module] = None
+    return env
+
+
+def run(cases, pattern=None, quick=False, repeats=5, min_time=0.05, log=sys.stderr):
+    """Run the benchmarks whose name matches the regular expression `pattern` and return the results file."""
+    results = {}
+    for case in cases:
+        if (quick and not case.quick) or (pattern is not None and not re.search(pattern, case.name)):
+            continue
+        fn = case.setup()
+        results[case.name] = measure(fn, repeats, min_time)
+        if log is not None:
+            print('{:<60} {:>12}'.format(case.name, _format_seconds(results[case.name]['seconds']['median'])),
+                  file=log)
+    return {
+        'version': RESULTS_VERSION,
+        'created': datetime.datetime.now(datetime.timezone.utc).replace(microsecond=0).isoformat(),
+        'environment': environment(),
+        'results': results,
+    }
+
+
+def compare(baseline, current, threshold=0.1, statistic='min'):
+    """Compare two results files.
+
+    Returns:
+        list of tuples: `(name, baseline seconds, current seconds, ratio, status)` for each benchmark, where the
+        status is `'regression'` when the current time exceeds the baseline by more than `threshold` (a fraction),
+        `'improvement'` when it is lower by more than `threshold`, `'ok'` otherwise, or `'missing'`/`'new'` when
+        the benchmark is absent from one of the files.
+    """
+    rows = []
+    base, cur = baseline['results'], current['results']
+    for name in sorted(set(base) | set(cur)):
+        if name not in cur:
+            rows.append((name, base[name]['seconds'][statistic], None, None, 'missing'))
+        elif name not in base:
+            rows.append((name, None, cur[name]['seconds'][statistic], None, 'new'))
+        else:
+            before, after = base[name]['seconds'][statistic], cur[name]['seconds'][statistic]
+            ratio = after / before if before > 0 else float('inf')
+            if ratio > 1 + threshold:
+                status = 'regression'
+            elif ratio < 1 - threshold:
+                status = 'improvement'
+            else:
+                status = 'ok'
+            rows.append((name, before, after, ratio, status))
+    return rows
+
+
+def _format_seconds(seconds):
+    if seconds is None:
+        return '-'
+    for unit, scale in (('s', 1), ('ms', 1e3), ('us', 1e6)):
+        if seconds * scale >= 1:
+            return '{:.3g} {}'.format(seconds * scale, unit)
+    return '{:.3g} ns'.format(seconds * 1e9)
+
+
+def main(cases, argv=None):
+    parser = argparse.ArgumentParser(description='Run the benchmarks, or compare two results files.')
+    commands = parser.add_subparsers(dest='command')
+    commands.required = True
+
+    run_parser = commands.add_parser('run', help='run the benchmarks and write the results as JSON')
+    run_parser.add_argument('-o', '--output', help='the results file (default: standard output)')
+    run_parser.add_argument('-k', '--filter', help='only run the benchmarks matching this regular expression')
+    run_parser.add_argument('--quick', action='store_true', help='only run a representative subset')
+    run_parser.add_argument('--repeats', type=int, default=5, help='number of timed repeats (default: 5)')
+    run_parser.add_argument('--min-time', type=float, default=0.05,
+                            help='minimum duration of a repeat in seconds (default: 0.05)')
+
+    compare_parser = commands.add_parser('compare', help='compare results, failing on regressions')
+    compare_parser.add_argument('baseline', help='the results file to compare against')
+    compare_parser.add_argument('current', help='the new results file')
+    compare_parser.add_argument('--threshold', type=float, default=0.1,
+                                help='the tolerated slowdown as a fraction of the baseline (default: 0.1)')
+    compare_parser.add_argument('--statistic', choices=('min', 'median', 'mean'), default='min',
+                                help='the statistic that is compared (default: min)')
+    compare_parser.add_argument('--fail-on-missing', action='store_true',
+                                help='also fail when a baseline benchmark is missing from the new results')
+
+    args = parser.parse_args(argv)
+    if args.command == 'run':
+        results = run(cases, args.filter, args.quick, args.repeats, args.min_time)
+        if args.output:
+            with open(args.output, 'w') as f:
+                json.dump(results, f, indent=2, sort_keys=True)
+        else:
+            json.dump(results, sys.stdout, indent=2, sort_keys=True)
+            print()
+        return 0
+
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    with open(args.current) as f:
+        current = json.load(f)
+    rows = compare(baseline, current, args.threshold, args.statistic)
+    print('{:<60} {:>12} {:>12} {:>8}  {}'.format('benchmark', 'baseline', 'current', 'ratio', 'status'))
+    for name, before, after, ratio, status in rows:
+        print('{:<60} {:>12} {:>12} {:>8}  {}'.format(name, _format_seconds(before), _format_seconds(after),
+                                                      '-' if ratio is None else '{:.2f}'.format(ratio), status))
+    failed = [row for row in rows if row[4] == 'regression' or (args.fail_on_missing and row[4] == 'missing')]
+    if failed:
+        print('\n{} benchmark(s) failed the comparison (threshold {:.0%}).'.format(len(failed), args.threshold))
+        return 1
+    return 0
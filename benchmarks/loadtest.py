@@ -0,0 +1,367 @@
+#
+# Copyright 2018-2019 IBM Corp. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+"""A load generator for `MAXApp` servers, reporting throughput, latency percentiles and errors.
+
+By default the stub model of ``benchmarks.stub_model`` is served in-process; `--subprocess` serves it from a separate
+Python process instead (so that the load generator does not compete for its GIL, and the server settings in the
+`MAX_*` environment variables apply), and `--url` targets an already running server. Examples:
+
+    $ python -m benchmarks.loadtest --concurrency 8 --duration 20
+    $ MAX_WORKERS=4 python -m benchmarks.loadtest --subprocess --rate 100 --duration 30 -o results.json
+    $ python -m benchmarks.loadtest --url http://127.0.0.1:5000 --concurrency 16
+
+Without `--rate` the load is closed-loop: each of the `--concurrency` clients sends its next request as soon as it
+received a response. With `--rate` requests are started at a fixed rate by up to `--concurrency` clients, and the
+latency is measured from the time a request was due, so that a server falling behind shows up in the latency
+instead of lowering the request rate.
+"""
+import argparse
+import http.client
+import json
+import logging
+import os
+import queue
+import socket
+import subprocess  # nosec - only used to start the stub model server
+import sys
+import threading
+import time
+import urllib.parse
+import uuid
+
+from .bench_image import synthetic_bytes
+from .harness import environment
+
+
+def multipart_body(fields):
+    """Encode `fields`, a dictionary of names to `(filename, content type, bytes)` tuples, as multipart form data.
+
+    Returns:
+        tuple: the content type header value and the body.
+    """
+    boundary = uuid.uuid4().hex
+    parts = []
+    for name, (filename, content_type, data) in fields.items():
+        parts.append('--{}\r\nContent-Disposition: form-data; name="{}"; filename="{}"\r\nContent-Type: {}\r\n\r\n'
+                     .format(boundary, name, filename, content_type).encode('latin1') + data + b'\r\n')
+    parts.append('--{}--\r\n'.format(boundary).encode('latin1'))
+    return 'multipart/form-data; boundary=' + boundary, b''.join(parts)
+
+
+def percentile(sorted_values, q):
+    """The `q`-th percentile (0-100) of an ascending list, by the nearest-rank method."""
+    if not sorted_values:
+        return None
+    rank = max(1, int(-(-q * len(sorted_values) // 100)))
+    return sorted_values[rank - 1]
+
+
+class Recorder(object):
+    """Collects the latencies and outcomes of the requests started in the measurement window."""
+
+    def __init__(self):
+        self.latencies = []
+        self.statuses = {}
+        self.errors = {}
+        self._lock = threading.Lock()
+
+    def record(self, latency, status=None, error=None):
+        with self._lock:
+            if error is not None:
+                self.errors[error] = self.errors.get(error, 0) + 1
+            else:
+                self.statuses[status] = self.statuses.get(status, 0) + 1
+                if 200 <= status < 300:
+                    self.latencies.append(latency)
+
+    def report(self, seconds):
+        with self._lock:
+            latencies = sorted(self.latencies)
+            statuses = dict(self.statuses)
+            errors = dict(self.errors)
+        ok = len(latencies)
+        total = sum(statuses.values()) + sum(errors.values())
+        return {
+            'duration_seconds': seconds,
+            'requests': total,
+            'ok': ok,
+            'failed': total - ok,
+            'error_rate': (total - ok) / total if total else 0.0,
+            'throughput_rps': ok / seconds if seconds > 0 else 0.0,
+            'latency_seconds': {
+                'mean': sum(latencies) / ok if ok else None,
+                'p50': percentile(latencies, 50),
+                'p95': percentile(latencies, 95),
+                'p99': percentile(latencies, 99),
+                'max': latencies[-1] if latencies else None,
+            },
+            'statuses': {str(k): v for k, v in sorted(statuses.items())},
+            'errors': errors,
+        }
+
+
+class _Client(object):
+    """A keep-alive HTTP connection that posts the same request over and over."""
+
+    def __init__(self, url, path, headers, body, timeout):
+        self.url = url
+        self.path = path
+        self.headers = headers
+        self.body = body
+        self.timeout = timeout
+        self._connection = None
+
+    def post(self):
+        """Send the request and return the status code of the response."""
+        if self._connection is None:
+            self._connection = http.client.HTTPConnection(self.url.hostname, self.url.port or 80, timeout=self.timeout)
+        try:
+            self._connection.request('POST', self.path, self.body, self.headers)
+            response = self._connection.getresponse()
+            response.read()
+            if response.getheader('Connection', '').lower() == 'close':
+                self.close()
+            return response.status
+        except BaseException:
+            self.close()
+            raise
+
+    def close(self):
+        if self._connection is not None:
+            self._connection.close()
+            self._connection = None
+
+
+def run_load(url, body, content_type, path='/model/predict', concurrency=8, duration=10, warmup=2, rate=None,
+             timeout=30):
+    """Drive the server at `url` with POST requests of `body` and return the report of the requests started in the
+    measurement window.
+
+    The first `warmup` seconds are not measured. Without a `rate` the load is closed-loop with `concurrency`
+    clients; with a `rate` (requests per second) requests are started on a fixed schedule by up to `concurrency`
+    clients.
+    """
+    url = urllib.parse.urlsplit(url)
+    path = url.path.rstrip('/') + path
+    headers = {'Content-Type': content_type, 'Content-Length': str(len(body))}
+    recorder = Recorder()
+    start = time.perf_counter()
+    measure_from = start + warmup
+    stop_at = measure_from + duration
+    schedule = queue.Queue(maxsize=concurrency * 4) if rate else None
+
+    def worker():
+        client = _Client(url, path, headers, body, timeout)
+        try:
+            while True:
+                if schedule is not None:
+                    due = schedule.get()
+                    if due is None:
+                        return
+                    delay = due - time.perf_counter()
+                    if delay > 0:
+                        time.sleep(delay)
+                else:
+                    due = time.perf_counter()
+                    if due >= stop_at:
+                        return
+                try:
+                    status, error = client.post(), None
+                except (OSError, http.client.HTTPException) as e:
+                    status, error = None, type(e).__name__
+                if measure_from <= due < stop_at:
+                    recorder.record(time.perf_counter() - due, status, error)
+        finally:
+            client.close()
+
+    threads = [threading.Thread(target=worker, daemon=True) for _ in range(concurrency)]
+    for t in threads:
+        t.start()
+    if schedule is not None:
+        # the requests are due at fixed intervals, whether or not the server keeps up
+        interval = 1 / rate
+        due = start
+        while due < stop_at:
+            schedule.put(due)
+            due += interval
+        for _ in threads:
+            schedule.put(None)
+    for t in threads:
+        t.join()
+    # the requests started in the measurement window are measured until they complete
+    return recorder.report(time.perf_counter() - measure_from)
+
+
+class InProcessServer(object):
+    """Serve a Flask app on a free local port from a background thread."""
+
+    def __init__(self, app, host='127.0.0.1'):
+        from werkzeug.serving import make_server
+        # logging every request would slow the server down
+        logging.getLogger('werkzeug').setLevel(logging.WARNING)
+        self._server = make_server(host, 0, app, threaded=True)
+        self.url = 'http://{}:{}'.format(host, self._server.server_port)
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._server.shutdown()
+        self._thread.join()
+
+
+class SubprocessServer(object):
+    """Serve the stub model from a separate Python process on a free local port."""
+
+    def __init__(self, args=(), host='127.0.0.1', startup_timeout=60):
+        self.port = _free_port(host)
+        self.url = 'http://{}:{}'.format(host, self.port)
+        self.command = [sys.executable, '-m', 'benchmarks.stub_model', '--host', host, '--port', str(self.port)]
+        self.command += list(args)
+        self.startup_timeout = startup_timeout
+        self._process = None
+
+    def __enter__(self):
+        root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        self._process = subprocess.Popen(self.command, cwd=root)  # nosec - runs this interpreter on a fixed module
+        try:
+            wait_until_ready(self.url, self.startup_timeout, self._process)
+        except BaseException:
+            self.__exit__()
+            raise
+        return self
+
+    def __exit__(self, *exc_info):
+        self._process.terminate()
+        try:
+            self._process.wait(10)
+        except subprocess.TimeoutExpired:
+            self._process.kill()
+            self._process.wait()
+
+
+def _free_port(host):
+    with socket.socket() as s:
+        s.bind((host, 0))
+        return s.getsockname()[1]
+
+
+def wait_until_ready(url, timeout=60, process=None):
+    """Wait until the server at `url` reports that it is ready on `/health/ready`."""
+    url = urllib.parse.urlsplit(url)
+    deadline = time.perf_counter() + timeout
+    while True:
+        if process is not None and process.poll() is not None:
+            raise RuntimeError('The server exited with status {}.'.format(process.returncode))
+        try:
+            connection = http.client.HTTPConnection(url.hostname, url.port or 80, timeout=5)
+            try:
+                connection.request('GET', url.path.rstrip('/') + '/health/ready')
+                if connection.getresponse().status == 200:
+                    return
+            finally:
+                connection.close()
+        except (OSError, http.client.HTTPException):
+            pass
+        if time.perf_counter() > deadline:
+            raise RuntimeError('The server at {} did not start within {} seconds.'.format(url.geturl(), timeout))
+        time.sleep(0.1)
+
+
+def _format_report(report):
+    latency = report['latency_seconds']
+    lines = [
+        'requests:   {} ({} ok, {} failed, error rate {:.2%})'.format(
+            report['requests'], report['ok'], report['failed'], report['error_rate']),
+        'throughput: {:.1f} requests/s'.format(report['throughput_rps']),
+    ]
+    if latency['p50'] is not None:
+        lines.append('latency:    mean {:.1f} ms, p50 {:.1f} ms, p95 {:.1f} ms, p99 {:.1f} ms, max {:.1f} ms'.format(
+            *(latency[k] * 1000 for k in ('mean', 'p50', 'p95', 'p99', 'max'))))
+    if report['statuses']:
+        lines.append('statuses:   ' + ', '.join('{}: {}'.format(k, v) for k, v in report['statuses'].items()))
+    if report['errors']:
+        lines.append('errors:     ' + ', '.join('{}: {}'.format(k, v) for k, v in report['errors'].items()))
+    return '\n'.join(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Load test a MAX model server.')
+    target = parser.add_mutually_exclusive_group()
+    target.add_argument('--url', help='the base URL of a running server (default: serve the stub model)')
+    target.add_argument('--subprocess', action='store_true', help='serve the stub model from a separate process')
+    parser.add_argument('-c', '--concurrency', type=int, default=8, help='number of clients (default: 8)')
+    parser.add_argument('-r', '--rate', type=float, help='requests per second (default: closed-loop)')
+    parser.add_argument('-d', '--duration', type=float, default=10, help='measured seconds (default: 10)')
+    parser.add_argument('--warmup', type=float, default=2, help='unmeasured seconds first (default: 2)')
+    parser.add_argument('--timeout', type=float, default=30, help='request timeout in seconds (default: 30)')
+    parser.add_argument('--path', default='/model/predict', help='the endpoint (default: /model/predict)')
+    parser.add_argument('--field', default='image', help='the form field of the upload (default: image)')
+    parser.add_argument('--image', help='the image to upload (default: a synthetic JPEG image)')
+    parser.add_argument('--image-size', default='640x480', help='size of the synthetic image (default: 640x480)')
+    parser.add_argument('--sleep-ms', type=float, default=20, help='stub inference time without the GIL')
+    parser.add_argument('--cpu-ms', type=float, default=0, help='stub inference time holding the GIL')
+    parser.add_argument('--batch-max-size', type=int, default=0, help='stub micro-batching (default: off)')
+    parser.add_argument('-o', '--output', help='also write the report as JSON to this file')
+    args = parser.parse_args(argv)
+
+    if args.image:
+        with open(args.image, 'rb') as f:
+            data = f.read()
+    else:
+        width, height = (int(v) for v in args.image_size.lower().split('x'))
+        data = synthetic_bytes((width, height), 'RGB', 'JPEG')
+    content_type, body = multipart_body({args.field: ('image.jpg', 'image/jpeg', data)})
+    stub_args = ['--sleep-ms', str(args.sleep_ms), '--cpu-ms', str(args.cpu_ms),
+                 '--batch-max-size', str(args.batch_max_size)]
+
+    def load(url):
+        return run_load(url, body, content_type, args.path, args.concurrency, args.duration, args.warmup, args.rate,
+                        args.timeout)
+
+    if args.url:
+        report = load(args.url)
+    elif args.subprocess:
+        with SubprocessServer(stub_args) as server:
+            report = load(server.url)
+    else:
+        from .stub_model import StubModelWrapper, create_app
+        app = create_app(StubModelWrapper(args.sleep_ms, args.cpu_ms, args.batch_max_size))
+        with InProcessServer(app.app) as server:
+            report = load(server.url)
+
+    report['settings'] = {
+        'target': args.url or ('subprocess' if args.subprocess else 'in-process'),
+        'concurrency': args.concurrency,
+        'rate': args.rate,
+        'warmup_seconds': args.warmup,
+        'upload_bytes': len(data),
+        'stub': None if args.url else {'sleep_ms': args.sleep_ms, 'cpu_ms': args.cpu_ms,
+                                       'batch_max_size': args.batch_max_size},
+        'server_environment': {k: v for k, v in os.environ.items() if k.startswith('MAX_')},
+    }
+    report['environment'] = environment()
+    print(_format_report(report))
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+    return 1 if report['ok'] == 0 else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
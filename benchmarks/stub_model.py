@@ -0,0 +1,144 @@
+#
+# Copyright 2018-2019 IBM Corp. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+"""A reference MAX model with a synthetic inference cost, for load tests of the framework.
+
+The model decodes and pre-processes the uploaded image like an image classifier, then spends a configurable time
+in "inference": `sleep_ms` milliseconds that release the GIL (like inference on a GPU or in a native library) and
+`cpu_ms` milliseconds of busy work that hold it (like inference in Python). Serve it with:
+
+    $ python -m benchmarks.stub_model --port 5000 --sleep-ms 20 --cpu-ms 5
+
+The usual `MAX_WORKERS`, `MAX_THREADS` and `MAX_ASYNC` environment variables select the server.
+"""
+import argparse
+import logging
+import time
+
+import numpy as np
+from flask import request
+
+from maxfw.core import MAXApp, MetadataAPI, PredictAPI
+from maxfw.model import MAXModelWrapper
+from maxfw.utils.image_utils import ImageProcessor, ToPILImage, Resize, ToTensor
+
+from .bench_image import synthetic_bytes
+
+MODEL_META_DATA = {
+    'id': 'max-stub-model',
+    'name': 'MAX Stub Model',
+    'description': 'A model with a synthetic inference cost for load tests',
+    'type': 'Image Classification',
+    'source': 'https://github.com/IBM/MAX-Framework',
+    'license': 'Apache 2.0',
+}
+
+LABELS = ['label_{}'.format(i) for i in range(10)]
+
+
+class StubModelWrapper(MAXModelWrapper):
+    """A model that classifies images into made-up labels after a synthetic inference cost.
+
+    Args:
+        sleep_ms (float): milliseconds spent per inference without holding the GIL.
+        cpu_ms (float): milliseconds of busy work per inference, holding the GIL.
+        batch_max_size (int): enables micro-batching of concurrent predictions (see ``MAXModelWrapper``).
+            A batch costs as much as a single inference.
+    """
+
+    MODEL_META_DATA = MODEL_META_DATA
+
+    def __init__(self, sleep_ms=20, cpu_ms=0, batch_max_size=0):
+        self.sleep_seconds = sleep_ms / 1000
+        self.cpu_seconds = cpu_ms / 1000
+        self.batch_max_size = batch_max_size
+        self.image_processor = ImageProcessor([
+            ToPILImage('RGB'), Resize((224, 224)), ToTensor('CHW', np.float32, mean=127.5, std=127.5)
+        ], compile=True)
+        self._weights = np.random.RandomState(0).standard_normal((len(LABELS), 3)).astype(np.float32)
+
+    def _pre_process(self, x):
+        return self.image_processor.apply_transforms(x)
+
+    def _infer(self, tensors):
+        if self.sleep_seconds:
+            time.sleep(self.sleep_seconds)
+        deadline = time.perf_counter() + self.cpu_seconds
+        while time.perf_counter() < deadline:
+            pass
+        # a cheap stand-in for the network that still depends on the input
+        features = np.stack([t.mean(axis=(1, 2)) for t in tensors])
+        return features @ self._weights.T
+
+    def _predict(self, x):
+        return self._infer([x])[0]
+
+    def _predict_batch(self, xs):
+        return list(self._infer(xs))
+
+    def _post_process(self, x):
+        top = np.argsort(x)[::-1][:5]
+        return [{'label': LABELS[i], 'probability': float(p)} for i, p in zip(top, _softmax(x)[top])]
+
+
+def _softmax(x):
+    e = np.exp(x - x.max())
+    return e / e.sum()
+
+
+def create_app(model):
+    """Create a `MAXApp` that serves `model` on `/model/metadata` and `/model/predict`.
+
+    The API resources are registered on the shared `MAX_API` namespace, so only one app can be created per process.
+    """
+
+    class StubMetadataAPI(MetadataAPI):
+
+        def get(self):
+            return model.MODEL_META_DATA
+
+    class StubPredictAPI(PredictAPI):
+
+        def post(self):
+            upload = request.get_upload('image')
+            if upload is None:
+                return {'status': 'error', 'message': 'No image uploaded.'}, 400
+            return {'status': 'ok', 'predictions': model.predict(upload)}
+
+    app = MAXApp(title=MODEL_META_DATA['name'], desc=MODEL_META_DATA['description'])
+    app.add_api(StubMetadataAPI, '/metadata')
+    app.add_api(StubPredictAPI, '/predict')
+    return app
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Serve the stub model.')
+    parser.add_argument('--host', default='127.0.0.1', help='interface to bind to (default: 127.0.0.1)')
+    parser.add_argument('--port', type=int, default=5000, help='port to bind to (default: 5000)')
+    parser.add_argument('--sleep-ms', type=float, default=20, help='inference time without the GIL (default: 20)')
+    parser.add_argument('--cpu-ms', type=float, default=0, help='inference time holding the GIL (default: 0)')
+    parser.add_argument('--batch-max-size', type=int, default=0, help='enable micro-batching (default: off)')
+    args = parser.parse_args(argv)
+
+    # logging every request would slow the development server down
+    logging.getLogger('werkzeug').setLevel(logging.WARNING)
+    model = StubModelWrapper(args.sleep_ms, args.cpu_ms, args.batch_max_size)
+    app = create_app(model)
+    app.warm_up(model, inputs=[synthetic_bytes((640, 480), 'RGB', 'JPEG')], iterations=3)
+    app.run(args.host, args.port)
+
+
+if __name__ == '__main__':
+    main()
@@ -13,6 +13,46 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 #
-from .app import MAXApp, MAX_API  # noqa
-from .api import *  # noqa
-from .utils import *  # noqa
+"""The web API of a MAX model.
+
+The submodules are imported on first access of their names (PEP 562), so that importing ``maxfw.core`` or one of
+its siblings does not load Flask and flask-restx until the API is actually used.
+"""
+import importlib
+
+# the public names of the package, and the modules that define them
+_EXPORTS = {
+    'MAXApp': '.app',
+    'MAX_API': '.app',
+    'MAXRequest': '.app',
+    'MAXAPI': '.api',
+    'MetadataAPI': '.api',
+    'PredictAPI': '.api',
+    'CustomMAXAPI': '.api',
+    'METADATA_SCHEMA': '.api',
+    'Resource': '.api',
+    'fields': '.api',
+    'MAXImageProcessor': '.utils',
+    'ImageProcessor': '.utils',
+    'redirect_errors_to_flask': '.utils',
+    'AdmissionController': '.admission',
+}
+
+_SUBMODULES = ('admission', 'api', 'app', 'asgi', 'default_config', 'server', 'utils')
+
+__all__ = sorted(_EXPORTS)
+
+
+def __getattr__(name):
+    if name in _SUBMODULES:
+        return importlib.import_module('.' + name, __name__)
+    module = _EXPORTS.get(name)
+    if module is None:
+        raise AttributeError('module {!r} has no attribute {!r}'.format(__name__, name))
+    value = getattr(importlib.import_module(module, __name__), name)
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(set(globals()) | set(_EXPORTS))
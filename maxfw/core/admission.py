@@ -0,0 +1,133 @@
+#
+# Copyright 2018-2019 IBM Corp. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+import os
+import threading
+import time
+from collections import deque
+
+from maxfw.utils.metrics import ADMISSION_IN_FLIGHT, ADMISSION_QUEUE_DEPTH, ADMISSION_REJECTED, ADMISSION_WAIT_SECONDS
+
+_lock = threading.Lock()
+
+
+class AdmissionController(object):
+    """Limits the number of requests that run at the same time, with a bounded first-in first-out queue.
+
+    A request that finds all the slots taken waits in the queue, unless the queue is full, in which case it is
+    rejected right away, so that an overloaded server sheds the excess load instead of letting the latency of every
+    request grow until they time out.
+
+    Args:
+        max_concurrency (int): the maximum number of requests that run at the same time.
+        max_queue (int): the maximum number of requests waiting for a slot.
+        max_wait (float): the maximum time in seconds a request waits in the queue before it is rejected
+            (optional). Requests that waited longer than the clients are willing to wait are wasted work.
+
+    Example:
+        >>> controller = AdmissionController(max_concurrency=4, max_queue=16)
+        >>> if controller.acquire():
+        >>>     try:
+        >>>         handle_request()
+        >>>     finally:
+        >>>         controller.release()
+    """
+
+    def __init__(self, max_concurrency, max_queue=0, max_wait=None):
+        if max_concurrency < 1:
+            raise ValueError('max_concurrency should be a positive integer. Got {}.'.format(max_concurrency))
+        if max_queue < 0:
+            raise ValueError('max_queue should be a non-negative integer. Got {}.'.format(max_queue))
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.max_wait = max_wait
+
+        self._lock = threading.Lock()
+        self._active = 0
+        self._queue = deque()  # the events of the waiting requests
+
+        # counters
+        self._admitted = 0
+        self._rejected = 0
+        self._timeouts = 0
+
+    def acquire(self):
+        """Take a slot, waiting in the queue if necessary. Returns False if the request is rejected."""
+        with self._lock:
+            if self._active < self.max_concurrency and not self._queue:
+                self._active += 1
+                self._admitted += 1
+                ADMISSION_IN_FLIGHT.inc()
+                return True
+            if len(self._queue) >= self.max_queue:
+                self._rejected += 1
+                ADMISSION_REJECTED.labels('queue_full').inc()
+                return False
+            turn = threading.Event()
+            self._queue.append(turn)
+            ADMISSION_QUEUE_DEPTH.inc()
+
+        start = time.perf_counter()
+        turn.wait(self.max_wait)
+        with self._lock:
+            if not turn.is_set():
+                # the slot was not handed over in time
+                self._queue.remove(turn)
+                self._timeouts += 1
+                ADMISSION_QUEUE_DEPTH.dec()
+                ADMISSION_REJECTED.labels('timeout').inc()
+                ADMISSION_WAIT_SECONDS.observe(time.perf_counter() - start)
+                return False
+        ADMISSION_WAIT_SECONDS.observe(time.perf_counter() - start)
+        return True
+
+    def release(self):
+        """Free the slot of a finished request, handing it over to the first request in the queue."""
+        with self._lock:
+            if self._queue:
+                # the slot stays taken, by the next request in line
+                self._queue.popleft().set()
+                self._admitted += 1
+                ADMISSION_QUEUE_DEPTH.dec()
+            else:
+                self._active -= 1
+                ADMISSION_IN_FLIGHT.dec()
+
+    def stats(self):
+        """Return a dictionary with the number of running and queued requests and the admission counters."""
+        with self._lock:
+            return {
+                'active': self._active,
+                'queued': len(self._queue),
+                'admitted': self._admitted,
+                'rejected': self._rejected,
+                'timeouts': self._timeouts,
+            }
+
+
+def _controller(resource):
+    """The admission controller of a resource class, created on first use in every (pre-forked worker) process."""
+    cls = type(resource)
+    if cls.max_concurrency <= 0:
+        return None
+    key = '_admission_controller_{}'.format(os.getpid())
+    controller = cls.__dict__.get(key)
+    if controller is None:
+        with _lock:
+            controller = cls.__dict__.get(key)
+            if controller is None:
+                controller = AdmissionController(cls.max_concurrency, cls.max_queue, cls.max_queue_wait)
+                setattr(cls, key, controller)
+    return controller
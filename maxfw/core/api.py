@@ -13,6 +13,9 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 #
+import os
+
+from .admission import _controller
 from .app import MAX_API
 from flask_restx import Resource, fields
 
@@ -38,6 +41,28 @@ class MetadataAPI(MAXAPI):
 
 
 class PredictAPI(MAXAPI):
+    # Opt-in admission control: when `max_concurrency` is positive, at most `max_concurrency` requests are handled
+    # at the same time, and at most `max_queue` more wait for their turn (for at most `max_queue_wait` seconds,
+    # if set). The requests beyond that are rejected right away with a 503 response with a `Retry-After` header
+    # of `retry_after` seconds. The defaults are read from the MAX_CONCURRENCY, MAX_QUEUE_SIZE and
+    # MAX_QUEUE_WAIT environment variables.
+    max_concurrency = int(os.getenv('MAX_CONCURRENCY', 0))
+    max_queue = int(os.getenv('MAX_QUEUE_SIZE', 0))
+    max_queue_wait = float(os.getenv('MAX_QUEUE_WAIT', 0)) or None
+    retry_after = 1
+
+    def dispatch_request(self, *args, **kwargs):
+        # the admission control is not one of the `method_decorators`, which subclasses are free to replace
+        controller = _controller(self)
+        if controller is None:
+            return super().dispatch_request(*args, **kwargs)
+        if not controller.acquire():
+            return {'status': 'error', 'message': 'The server is overloaded, please retry later.'}, 503, \
+                {'Retry-After': str(self.retry_after)}
+        try:
+            return super().dispatch_request(*args, **kwargs)
+        finally:
+            controller.release()
 
     def post(self):
         """To be implemented"""
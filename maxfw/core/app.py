@@ -13,15 +13,67 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 #
+import io
 import os
-from flask import Flask
+import shutil
+import tempfile
+import threading
+import time
+from flask import Flask, Request, Response, current_app, g, jsonify, request
 from flask_restx import Api, Namespace
-from flask_cors import CORS
-from .default_config import API_TITLE, API_DESC, API_VERSION
+from maxfw.utils.metrics import REGISTRY, REQUEST_SECONDS, REQUESTS, REQUEST_ERRORS, REQUESTS_IN_PROGRESS, READY, \
+    WARM_UP_SECONDS
+from .default_config import API_TITLE, API_DESC, API_VERSION, SPOOL_MAX_SIZE
 
 MAX_API = Namespace('model', description='Model information and inference operations')
 
 
+class MAXRequest(Request):
+    """The request class of a `MAXApp`, which bounds the memory used by large uploads.
+
+    Uploaded files and request bodies larger than the `MAX_SPOOL_SIZE` setting are spooled to a temporary file
+    instead of being held in memory. ``get_upload`` returns them as file objects, which ``ToPILImage`` decodes
+    straight from the file:
+
+        >>> img = image_processor.apply_transforms(request.get_upload('image'))
+    """
+
+    _spooled_body = None
+
+    def _spool(self):
+        return tempfile.SpooledTemporaryFile(max_size=current_app.config['MAX_SPOOL_SIZE'], mode='w+b')
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        return self._spool()
+
+    def get_upload(self, name=None):
+        """Return an upload as a seekable binary file object, without reading it into memory.
+
+        For form submissions this is the uploaded file called `name` (the first file when `name` is None), or None
+        if there is no such file. For other requests it is the request body.
+        """
+        if name is not None or self.mimetype in ('multipart/form-data', 'application/x-www-form-urlencoded'):
+            if name is None:
+                return next(iter(self.files.values()), None)
+            return self.files.get(name)
+
+        if self._spooled_body is None:
+            data = getattr(self, '_cached_data', None)
+            if data is not None:
+                # the body was read already
+                self._spooled_body = io.BytesIO(data)
+            else:
+                self._spooled_body = self._spool()
+                shutil.copyfileobj(self.stream, self._spooled_body, 64 * 1024)
+                self._spooled_body.seek(0)
+        return self._spooled_body
+
+    def close(self):
+        if self._spooled_body is not None:
+            self._spooled_body.close()
+        super().close()
+
+
 class MAXApp(object):
 
     def __init__(self, title=API_TITLE, desc=API_DESC, version=API_VERSION):
@@ -30,6 +82,13 @@ class MAXApp(object):
         # load config
         if os.path.exists("config.py"):
             self.app.config.from_object("config")
+        if os.getenv('MAX_SPOOL_SIZE'):
+            self.app.config['MAX_SPOOL_SIZE'] = int(os.getenv('MAX_SPOOL_SIZE'))
+        self.app.config.setdefault('MAX_SPOOL_SIZE', SPOOL_MAX_SIZE)
+        if os.getenv('MAX_PROFILE_ENDPOINT'):
+            self.app.config['MAX_PROFILE_ENDPOINT'] = os.getenv('MAX_PROFILE_ENDPOINT') == 'true'
+        self.app.config.setdefault('MAX_PROFILE_ENDPOINT', os.getenv('MAX_PROFILE_TRANSFORMS') == 'true')
+        self.app.request_class = MAXRequest
 
         self.api = Api(
             self.app,
@@ -37,15 +96,171 @@ class MAXApp(object):
             description=desc,
             version=version)
 
+        self._asgi_app = None
+
+        # the app is ready right away, unless a warm-up is started
+        self.model = None
+        self._warm_up_done = threading.Event()
+        self._warm_up_done.set()
+        self._warm_up_error = None
+        self._warm_up_thread = None
+        READY.set(1)
+
         self.api.namespaces.clear()
         self.api.add_namespace(MAX_API)
 
         # enable cors if flag is set
         if os.getenv('CORS_ENABLE') == 'true' and \
                 (os.environ.get('WERKZEUG_RUN_MAIN') == 'true' or self.app.debug is not True):
+            from flask_cors import CORS
             CORS(self.app, origins='*')
             print('NOTE: MAX Model Server is currently allowing cross-origin requests - (CORS ENABLED)')
 
+        # collect request metrics and expose them in the Prometheus format
+        self.app.before_request(self._before_request)
+        self.app.after_request(self._after_request)
+        self.app.teardown_request(self._teardown_request)
+        self.app.add_url_rule('/metrics', 'metrics', self._metrics)
+        if self.app.config['MAX_PROFILE_ENDPOINT']:
+            # the profiles reveal the internals of the pipelines, so they are only served when enabled
+            self.app.add_url_rule('/admin/profile', 'admin_profile', self._profile, methods=['GET', 'DELETE'])
+
+        # health checks, which are answered right away during the warm-up
+        self.app.before_request(self._reject_until_ready)
+        self.app.add_url_rule('/health/live', 'health_live', self._live)
+        self.app.add_url_rule('/health/ready', 'health_ready', self._ready)
+
+    @staticmethod
+    def _before_request():
+        g.maxfw_start = time.perf_counter()
+        REQUESTS_IN_PROGRESS.inc()
+
+    @staticmethod
+    def _after_request(response):
+        endpoint = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+        REQUESTS.labels(request.method, endpoint, response.status_code).inc()
+        if response.status_code >= 500:
+            REQUEST_ERRORS.labels(request.method, endpoint).inc()
+        g.maxfw_status = response.status_code
+        return response
+
+    @staticmethod
+    def _teardown_request(exc):
+        if 'maxfw_start' not in g:
+            return
+        REQUESTS_IN_PROGRESS.dec()
+        endpoint = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+        REQUEST_SECONDS.labels(request.method, endpoint).observe(time.perf_counter() - g.maxfw_start)
+        if 'maxfw_status' not in g:
+            # the request failed before a response could be created
+            REQUESTS.labels(request.method, endpoint, 500).inc()
+            REQUEST_ERRORS.labels(request.method, endpoint).inc()
+
+    @staticmethod
+    def _metrics():
+        return Response(REGISTRY.exposition(), mimetype='text/plain; version=0.0.4')
+
+    @staticmethod
+    def _profile():
+        # the profiles of the image processors created with profiling enabled (DELETE resets them)
+        from maxfw.utils import profiling
+        if request.method == 'DELETE':
+            profiling.reset()
+        return jsonify({'processors': profiling.summaries()})
+
+    @staticmethod
+    def _live():
+        return jsonify({'status': 'alive'})
+
+    def _ready(self):
+        if self.ready:
+            return jsonify({'status': 'ready'})
+        elif self._warm_up_error is not None:
+            return jsonify({'status': 'failed', 'error': repr(self._warm_up_error)}), 503
+        return jsonify({'status': 'warming_up'}), 503, {'Retry-After': '1'}
+
+    def _reject_until_ready(self):
+        # the model API is only served once the warm-up has completed successfully
+        if self.ready or request.url_rule is None or not request.url_rule.rule.startswith(MAX_API.path + '/'):
+            return None
+        if self._warm_up_error is not None:
+            return jsonify({'status': 'error', 'message': 'The warm-up of the model failed.',
+                            'error': repr(self._warm_up_error)}), 503
+        return jsonify({'status': 'error', 'message': 'The model is warming up.'}), 503, {'Retry-After': '1'}
+
+    @property
+    def ready(self):
+        """Whether the warm-up (if any) has completed successfully."""
+        return self._warm_up_done.is_set() and self._warm_up_error is None
+
+    def wait_ready(self, timeout=None):
+        """Wait until the warm-up has finished, and return whether the app is ready."""
+        self._warm_up_done.wait(timeout)
+        return self.ready
+
+    def warm_up(self, model, inputs=(), iterations=1, background=True):
+        """Load the model and run synthetic predictions before reporting ready.
+
+        Until the warm-up has completed, `/health/ready` and the requests of the model API are answered with
+        503 responses, while `/health/live` reports that the server is alive. If the warm-up fails, they keep
+        being answered with 503 responses, which report the error. The model is available as
+        `app.model` once it is loaded.
+
+        Warm up the instance that serves the requests, i.e. the model wrapper that the API resources use:
+
+            >>> model_wrapper = ModelWrapper()  # used by ModelPredictAPI
+            >>> app = MAXApp()
+            >>> app.add_api(ModelPredictAPI, '/predict')
+            >>> app.warm_up(model_wrapper, inputs=[sample_image_bytes], iterations=3)
+            >>> app.run()
+
+        Passing a loader instead (e.g. the class of the wrapper) also loads the model in the background, but
+        creates a new instance, which only serves requests if the API resources get it from `app.model`.
+
+        Args:
+            model: a ``MAXModelWrapper``, or a callable (e.g. the class of the wrapper) that loads and returns one.
+            inputs (sequence): raw inputs like those of real requests, which are passed through the full
+                pre-processing, inference and post-processing path of the model (bypassing the prediction cache).
+            iterations (int): the number of times each input is predicted.
+            background (bool): warm up in a background thread, so that the server can start answering health checks
+                in the meantime. Otherwise this method returns once the warm-up is done, and raises its errors.
+                ``run`` waits for a background warm-up before forking the worker processes of a production server,
+                which then share the warm model.
+        """
+        if not self._warm_up_done.is_set():
+            raise RuntimeError('A warm-up is in progress already.')
+        self._warm_up_done.clear()
+        self._warm_up_error = None
+        READY.set(0)
+        if background:
+            self._warm_up_thread = threading.Thread(target=self._warm_up, args=(model, inputs, iterations),
+                                                    name='maxfw-warm-up', daemon=True)
+            self._warm_up_thread.start()
+        else:
+            self._warm_up(model, inputs, iterations)
+            if self._warm_up_error is not None:
+                raise self._warm_up_error
+
+    def _warm_up(self, model, inputs, iterations):
+        start = time.perf_counter()
+        try:
+            if isinstance(model, type) or not hasattr(model, 'predict'):
+                model = model()
+            self.model = model
+            # predict without the prediction cache, which would skip the work after the first iteration
+            predict = getattr(model, '_run_predict', model.predict)
+            for _ in range(iterations):
+                for x in inputs:
+                    predict(x)
+        except Exception as e:
+            self._warm_up_error = e
+            self.app.logger.exception('The warm-up of the model failed.')
+        else:
+            READY.set(1)
+        finally:
+            WARM_UP_SECONDS.set(time.perf_counter() - start)
+            self._warm_up_done.set()
+
     def add_api(self, api, route):
         MAX_API.add_resource(api, route)
 
@@ -54,5 +269,54 @@ class MAXApp(object):
         def index():
             return self.app.send_static_file('index.html')
 
-    def run(self, host='0.0.0.0', port=5000):  # nosec - binding to all interfaces
-        self.app.run(host, port)
+    @property
+    def asgi_app(self):
+        """The API as an ASGI application, for use with any ASGI server."""
+        if self._asgi_app is None:
+            from .asgi import ASGIAdapter
+            threads = int(os.getenv('MAX_THREADS', 0)) or None
+            self._asgi_app = ASGIAdapter(self.app, max_workers=threads,
+                                         spool_max_size=self.app.config['MAX_SPOOL_SIZE'])
+        return self._asgi_app
+
+    def run(self, host='0.0.0.0', port=5000,  # nosec - binding to all interfaces
+            workers=None, threads=None, asynchronous=None):
+        """Start serving the API.
+
+        By default the Flask development server is used. When `workers` (or the `MAX_WORKERS` environment
+        variable) is set to a positive number, a production server with that many pre-forked worker processes,
+        each running `threads` (or `MAX_THREADS`) request threads, is started instead. Load the model before
+        calling this method so that its weights are shared by all the workers.
+
+        When `asynchronous` is true (or the `MAX_ASYNC` environment variable is set to `true`), a single process
+        asyncio server is started instead, which handles the connections on an event loop and runs the
+        requests in a pool of `threads` threads.
+
+        A background warm-up (see ``warm_up``) continues while the development or asynchronous server starts. The
+        production server waits for it, so that the workers are forked from the warm model.
+        """
+        if workers is None:
+            workers = int(os.getenv('MAX_WORKERS', 0))
+        if threads is None:
+            threads = int(os.getenv('MAX_THREADS', 0)) or None
+        if asynchronous is None:
+            asynchronous = os.getenv('MAX_ASYNC') == 'true'
+
+        if asynchronous:
+            try:
+                import uvicorn
+            except ImportError:
+                raise ImportError('The asynchronous server requires uvicorn. Install it with `pip install maxfw[async]`.')
+            from .asgi import ASGIAdapter
+            self._asgi_app = ASGIAdapter(self.app, max_workers=threads,
+                                         spool_max_size=self.app.config['MAX_SPOOL_SIZE'])
+            uvicorn.run(self._asgi_app, host=host, port=port)
+        elif workers > 0:
+            # threads do not survive the fork of the workers
+            self._warm_up_done.wait()
+            if self._warm_up_error is not None:
+                raise RuntimeError('The warm-up of the model failed.') from self._warm_up_error
+            from .server import serve
+            serve(self.app, host, port, workers=workers, threads=threads or 1)
+        else:
+            self.app.run(host, port)
@@ -0,0 +1,145 @@
+#
+# Copyright 2018-2019 IBM Corp. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+import asyncio
+import sys
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+
+from .default_config import SPOOL_MAX_SIZE
+
+
+class ASGIAdapter(object):
+    """Serve a WSGI application (e.g. the Flask app of a `MAXApp`) from an asyncio event loop.
+
+    Receiving the request body and sending the response happen on the event loop, so slow clients and slow
+    uploads do not hold a thread. Only the (blocking) WSGI application itself runs in a bounded thread pool,
+    which keeps the number of concurrent inferences fixed while the event loop holds any number of open
+    connections.
+
+    Args:
+        wsgi_app: the WSGI application to serve.
+        max_workers (int): number of threads running the WSGI application.
+        spool_max_size (int): request bodies larger than this number of bytes are spooled to disk.
+    """
+
+    def __init__(self, wsgi_app, max_workers=None, spool_max_size=SPOOL_MAX_SIZE):
+        self.wsgi_app = wsgi_app
+        self.spool_max_size = spool_max_size
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='maxfw-asgi')
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            await self._lifespan(receive, send)
+        elif scope['type'] == 'http':
+            await self._http(scope, receive, send)
+        else:
+            raise ValueError('Unsupported ASGI scope type {}.'.format(scope['type']))
+
+    async def _lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                self.executor.shutdown(wait=True)
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    async def _http(self, scope, receive, send):
+        body = tempfile.SpooledTemporaryFile(max_size=self.spool_max_size)
+        try:
+            content_length = 0
+            more_body = True
+            while more_body:
+                message = await receive()
+                if message['type'] == 'http.disconnect':
+                    return
+                chunk = message.get('body', b'')
+                body.write(chunk)
+                content_length += len(chunk)
+                more_body = message.get('more_body', False)
+            body.seek(0)
+
+            environ = self._environ(scope, body, content_length)
+            loop = asyncio.get_running_loop()
+            status, headers, chunks = await loop.run_in_executor(self.executor, self._run_wsgi, environ)
+        finally:
+            body.close()
+
+        await send({'type': 'http.response.start', 'status': status, 'headers': headers})
+        for chunk in chunks:
+            await send({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+        await send({'type': 'http.response.body', 'body': b''})
+
+    def _environ(self, scope, body, content_length):
+        """Build a PEP 3333 environ dictionary from an ASGI HTTP scope."""
+        server = scope.get('server') or ('localhost', 80)
+        environ = {
+            'REQUEST_METHOD': scope['method'],
+            'SCRIPT_NAME': scope.get('root_path', '').encode('utf8').decode('latin1'),
+            'PATH_INFO': scope['path'].encode('utf8').decode('latin1'),
+            'QUERY_STRING': scope.get('query_string', b'').decode('latin1'),
+            'SERVER_NAME': server[0],
+            'SERVER_PORT': str(server[1]),
+            'SERVER_PROTOCOL': 'HTTP/{}'.format(scope.get('http_version', '1.1')),
+            'CONTENT_LENGTH': str(content_length),
+            'wsgi.version': (1, 0),
+            'wsgi.url_scheme': scope.get('scheme', 'http'),
+            'wsgi.input': body,
+            'wsgi.input_terminated': True,
+            'wsgi.errors': sys.stderr,
+            'wsgi.multithread': True,
+            'wsgi.multiprocess': False,
+            'wsgi.run_once': False,
+        }
+        if scope.get('client'):
+            environ['REMOTE_ADDR'] = scope['client'][0]
+            environ['REMOTE_PORT'] = str(scope['client'][1])
+
+        for name, value in scope.get('headers', []):
+            name = name.decode('latin1').upper().replace('-', '_')
+            value = value.decode('latin1')
+            if name == 'CONTENT_LENGTH':
+                # the length of the received body takes precedence
+                continue
+            elif name != 'CONTENT_TYPE':
+                name = 'HTTP_' + name
+            if name in environ:
+                value = environ[name] + ',' + value
+            environ[name] = value
+        return environ
+
+    def _run_wsgi(self, environ):
+        """Run the WSGI application and collect the complete response (called from the thread pool)."""
+        response = {}
+        chunks = []
+
+        def start_response(status, headers, exc_info=None):
+            if exc_info is not None and response:
+                raise exc_info[1].with_traceback(exc_info[2])
+            response['status'] = int(status.split(' ', 1)[0])
+            response['headers'] = [(name.lower().encode('latin1'), value.encode('latin1')) for name, value in headers]
+            return chunks.append
+
+        result = self.wsgi_app(environ, start_response)
+        try:
+            for chunk in result:
+                if chunk:
+                    chunks.append(chunk)
+        finally:
+            if hasattr(result, 'close'):
+                result.close()
+        return response['status'], response['headers'], chunks
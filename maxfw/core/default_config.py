@@ -17,3 +17,6 @@
 API_TITLE = 'Model Asset Exchange Microservice'
 API_DESC = 'An API for serving models'
 API_VERSION = '0.1'
+
+# request bodies and uploaded files larger than this number of bytes are spooled to a temporary file
+SPOOL_MAX_SIZE = 1024 * 1024
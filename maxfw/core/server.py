@@ -0,0 +1,97 @@
+#
+# Copyright 2018-2019 IBM Corp. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+import gc
+import os
+
+from maxfw.utils.metrics import REGISTRY
+
+
+def _freeze_heap():
+    """Move all objects allocated so far (e.g. the model weights) to the permanent GC generation.
+
+    The garbage collector writes to the header of every object it visits, which un-shares the copy-on-write
+    memory pages inherited by the worker processes. Frozen objects are never visited again.
+    """
+    gc.collect()
+    if hasattr(gc, 'freeze'):
+        gc.freeze()
+
+
+def _label_worker_metrics():
+    """Label the metrics of a worker process with its pid.
+
+    Every worker collects its own metrics, and a scrape of `/metrics` is answered by whichever worker gets the
+    request. The label keeps the series of the workers apart, so that they can be summed up in the queries.
+    """
+    REGISTRY.const_labels = (('worker', str(os.getpid())),)
+
+
+def serve(wsgi_app, host, port, workers, threads=1, **options):
+    """Serve a WSGI application with a pre-forking gunicorn server.
+
+    The application, and with it any model that has been loaded before calling this function, lives in the
+    parent process. The worker processes are forked from the parent and share its memory copy-on-write, so
+    the model weights are loaded once regardless of the number of workers.
+
+    Args:
+        wsgi_app: the WSGI application to serve.
+        host (str): interface to bind to.
+        port (int): port to bind to.
+        workers (int): number of worker processes.
+        threads (int): number of request threads per worker process.
+        options: additional `gunicorn settings`_, e.g. ``timeout=120``.
+
+    The metrics of every worker process are labelled with its pid (``worker``), see ``_label_worker_metrics``.
+
+    .. _gunicorn settings: https://docs.gunicorn.org/en/stable/settings.html
+    """
+    _create_server(wsgi_app, host, port, workers, threads, **options).run()
+
+
+def _create_server(wsgi_app, host, port, workers, threads=1, **options):
+    """Create the gunicorn application of ``serve``, without starting it."""
+    try:
+        from gunicorn.app.base import BaseApplication
+    except ImportError:
+        raise ImportError('The production server requires gunicorn. Install it with `pip install maxfw[server]`.')
+
+    post_fork = options.pop('post_fork', None)
+
+    def _post_fork(server, worker):
+        _label_worker_metrics()
+        if post_fork is not None:
+            post_fork(server, worker)
+
+    class _MAXServer(BaseApplication):
+
+        def load_config(self):
+            config = {
+                'bind': '{}:{}'.format(host, port),
+                'workers': workers,
+                'threads': threads,
+                'worker_class': 'gthread' if threads > 1 else 'sync',
+                'preload_app': True,
+                'post_fork': _post_fork,
+            }
+            config.update(options)
+            for key, value in config.items():
+                self.cfg.set(key, value)
+
+        def load(self):
+            _freeze_heap()
+            return wsgi_app
+
+    return _MAXServer()
@@ -13,30 +13,37 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 #
-from flask import abort
-from maxfw.utils.image_utils import ImageProcessor
+from maxfw.utils.image_utils import ImageProcessor, ImageTooLargeError
+
+
+def _abort(code, message):
+    # Flask is only imported once there is an error to report, so that the image utilities work without it
+    from flask import abort
+    abort(code, message)
 
 
 def redirect_errors_to_flask(func):
     """
     This decorator function will capture all Pythonic errors and return them as flask errors.
 
-    If you are looking to disable this functionality, please remove this decorator from the `apply_transforms()` module
-    under the ImageProcessor class.
+    If you are looking to disable this functionality, please remove this decorator from the `apply_transforms()`,
+    `map_transforms()` and `apply_batch()` methods of the MAXImageProcessor class.
     """
 
     def inner(*args, **kwargs):
         try:
             # run the function
             return func(*args, **kwargs)
+        except ImageTooLargeError as e:
+            _abort(413, str(e))
         except ValueError as ve:
             if 'pic should be 2 or 3 dimensional' in str(ve):
-                abort(400, "Invalid input, please ensure the input is either "
-                      "a grayscale or a colour image.")
+                _abort(400, "Invalid input, please ensure the input is either "
+                       "a grayscale or a colour image.")
         except TypeError as te:
             if 'bytes or ndarray' in str(te):
-                abort(400, "Invalid input format, please make sure the input file format "
-                      " is a common image format such as JPG or PNG.")
+                _abort(400, "Invalid input format, please make sure the input file format "
+                       " is a common image format such as JPG or PNG.")
     return inner
 
 
@@ -59,3 +66,11 @@ class MAXImageProcessor(ImageProcessor):
     @redirect_errors_to_flask
     def apply_transforms(self, img):
         return super().apply_transforms(img)
+
+    @redirect_errors_to_flask
+    def map_transforms(self, images, return_exceptions=False):
+        return super().map_transforms(images, return_exceptions=return_exceptions)
+
+    @redirect_errors_to_flask
+    def apply_batch(self, images, out=None, layout=None, dtype=None):
+        return super().apply_batch(images, out=out, layout=layout, dtype=dtype)
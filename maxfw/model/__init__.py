@@ -14,3 +14,5 @@
 # limitations under the License.
 #
 from .model import MAXModelWrapper  # noqa
+from .batching import BatchScheduler  # noqa
+from .cache import PredictionCache  # noqa
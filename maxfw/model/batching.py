@@ -0,0 +1,157 @@
+#
+# Copyright 2018-2019 IBM Corp. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+import threading
+import time
+from collections import deque
+
+
+class _BatchItem(object):
+    """A single pending request waiting to be processed as part of a batch."""
+
+    __slots__ = ('x', 'enqueued', 'done', 'result', 'error')
+
+    def __init__(self, x):
+        self.x = x
+        self.enqueued = time.monotonic()
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class BatchScheduler(object):
+    """Collects concurrent calls into batches and runs them with a single function call.
+
+    Request threads call ``submit(x)`` and block until their result is ready. A background
+    thread groups the pending inputs into batches of at most ``max_batch_size`` items, waiting
+    at most ``max_wait`` seconds after the first item of a batch has arrived, and calls
+    ``batch_fn`` once per batch. Each result is handed back to the thread that submitted it.
+
+    Args:
+        batch_fn (callable): function mapping a list of inputs to a list of results of the same length.
+        max_batch_size (int): maximum number of inputs passed to ``batch_fn`` in one call.
+        max_wait (float): maximum time in seconds the first item of a batch waits for more items.
+
+    Example:
+        >>> scheduler = BatchScheduler(lambda xs: [x * 2 for x in xs], max_batch_size=16, max_wait=0.005)
+        >>> scheduler.submit(21)
+        42
+    """
+
+    def __init__(self, batch_fn, max_batch_size=8, max_wait=0.005):
+        if max_batch_size < 1:
+            raise ValueError('max_batch_size should be a positive integer. Got {}.'.format(max_batch_size))
+        if max_wait < 0:
+            raise ValueError('max_wait should be a non-negative number. Got {}.'.format(max_wait))
+        self.batch_fn = batch_fn
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+
+        self._queue = deque()
+        self._cond = threading.Condition()
+        self._closed = False
+
+        # counters
+        self._batches = 0
+        self._items = 0
+        self._largest_batch = 0
+        self._queue_wait_total = 0.0
+        self._queue_wait_max = 0.0
+
+        self._worker = threading.Thread(target=self._run, name='maxfw-batch-scheduler')
+        self._worker.daemon = True
+        self._worker.start()
+
+    def submit(self, x):
+        """Queue `x` for the next batch and block until its result is available."""
+        item = _BatchItem(x)
+        with self._cond:
+            if self._closed:
+                raise RuntimeError('The batch scheduler has been closed.')
+            self._queue.append(item)
+            self._cond.notify()
+        item.done.wait()
+        if item.error is not None:
+            raise item.error
+        return item.result
+
+    def close(self):
+        """Stop the scheduler once the pending items have been processed."""
+        with self._cond:
+            self._closed = True
+            self._cond.notify()
+        self._worker.join()
+
+    def stats(self):
+        """Return a dictionary with the batch size and queue wait counters."""
+        with self._cond:
+            batches = self._batches
+            return {
+                'batches': batches,
+                'items': self._items,
+                'pending': len(self._queue),
+                'largest_batch': self._largest_batch,
+                'mean_batch_size': self._items / batches if batches else 0.0,
+                'queue_wait_total': self._queue_wait_total,
+                'queue_wait_mean': self._queue_wait_total / self._items if self._items else 0.0,
+                'queue_wait_max': self._queue_wait_max,
+            }
+
+    def _next_batch(self):
+        """Block until a batch is ready, and return it (an empty list means the scheduler is closed)."""
+        with self._cond:
+            while not self._queue:
+                if self._closed:
+                    return []
+                self._cond.wait()
+
+            # the batch deadline is relative to the arrival of its oldest item
+            deadline = self._queue[0].enqueued + self.max_wait
+            while len(self._queue) < self.max_batch_size and not self._closed:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+
+            batch = [self._queue.popleft() for _ in range(min(self.max_batch_size, len(self._queue)))]
+
+            now = time.monotonic()
+            self._batches += 1
+            self._items += len(batch)
+            self._largest_batch = max(self._largest_batch, len(batch))
+            for item in batch:
+                wait = now - item.enqueued
+                self._queue_wait_total += wait
+                self._queue_wait_max = max(self._queue_wait_max, wait)
+            return batch
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            if not batch:
+                return
+            try:
+                results = self.batch_fn([item.x for item in batch])
+                if len(results) != len(batch):
+                    raise ValueError('The batch function returned {} results for a batch of {} inputs.'
+                                     .format(len(results), len(batch)))
+                for item, result in zip(batch, results):
+                    item.result = result
+            except Exception as e:
+                for item in batch:
+                    item.error = e
+            finally:
+                for item in batch:
+                    item.done.set()
@@ -0,0 +1,200 @@
+#
+# Copyright 2018-2019 IBM Corp. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+import hashlib
+import sys
+import threading
+import time
+from collections import OrderedDict
+
+
+def cache_key(x, *namespace):
+    """Return a content hash of the raw input `x`, or `None` if `x` cannot be hashed by content.
+
+    Args:
+        x (bytes, bytearray, memoryview, str, numpy.ndarray or a seekable binary file object): raw model input.
+            File objects (e.g. uploads from ``MAXRequest.get_upload``) are hashed like the bytes they hold, from
+            the start, and left at the start.
+        namespace: values that are hashed along with the input, e.g. the model id and version.
+    """
+    digest = hashlib.blake2b(digest_size=20)
+    for value in namespace:
+        digest.update(str(value).encode('utf8'))
+        digest.update(b'\0')
+
+    if isinstance(x, (bytes, bytearray, memoryview)):
+        digest.update(b'bytes\0')
+        digest.update(x)
+    elif isinstance(x, str):
+        digest.update(b'str\0')
+        digest.update(x.encode('utf8'))
+    elif _is_array(x) and x.dtype != object:
+        digest.update('ndarray\0{}\0{}\0'.format(x.dtype.str, x.shape).encode('utf8'))
+        digest.update(sys.modules['numpy'].ascontiguousarray(x).data)
+    elif hasattr(x, 'read') and hasattr(x, 'seek'):
+        digest.update(b'bytes\0')
+        if not _update_from_file(digest, x):
+            return None
+    else:
+        return None
+    return digest.hexdigest()
+
+
+def _update_from_file(digest, f, chunk_size=64 * 1024):
+    # hash the content of a binary file in chunks, so that spooled uploads are not read into memory at once
+    f.seek(0)
+    try:
+        while True:
+            chunk = f.read(chunk_size)
+            if not chunk:
+                return True
+            if not isinstance(chunk, (bytes, bytearray)):
+                return False
+            digest.update(chunk)
+    finally:
+        f.seek(0)
+
+
+def _is_array(x):
+    # an array implies that NumPy has been imported already, so models without NumPy inputs never import it
+    np = sys.modules.get('numpy')
+    return np is not None and isinstance(x, np.ndarray)
+
+
+def _sizeof(obj):
+    """Estimate the number of bytes held by a prediction result."""
+    if hasattr(obj, 'nbytes'):
+        return int(obj.nbytes)
+    if isinstance(obj, dict):
+        return sys.getsizeof(obj) + sum(_sizeof(k) + _sizeof(v) for k, v in obj.items())
+    if isinstance(obj, (list, tuple, set, frozenset)):
+        return sys.getsizeof(obj) + sum(_sizeof(v) for v in obj)
+    return sys.getsizeof(obj)
+
+
+class _Flight(object):
+    """A computation that is in progress, shared by all the callers asking for the same key."""
+
+    __slots__ = ('done', 'result', 'error')
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class PredictionCache(object):
+    """A thread-safe LRU cache for prediction results with a byte budget, a TTL and request coalescing.
+
+    When several threads ask for the same key while it is being computed, only the first one runs the
+    computation; the others wait for, and share, its result (or error). Cached results are shared between
+    callers and should be treated as read-only.
+
+    Args:
+        max_bytes (int): the (estimated) size of all cached results is kept below this number of bytes.
+        ttl (float): number of seconds a result stays valid, or `None` to keep results until they are evicted.
+    """
+
+    def __init__(self, max_bytes=64 * 1024 * 1024, ttl=3600):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+
+        self._entries = OrderedDict()  # key -> (value, size, expiry)
+        self._inflight = {}
+        self._lock = threading.Lock()
+        self._bytes = 0
+
+        # counters
+        self._hits = 0
+        self._misses = 0
+        self._coalesced = 0
+        self._evictions = 0
+        self._expirations = 0
+
+    def get_or_compute(self, key, compute):
+        """Return the cached result for `key`, calling `compute()` to produce it when needed."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                value, size, expiry = entry
+                if expiry is None or expiry > time.monotonic():
+                    self._entries.move_to_end(key)
+                    self._hits += 1
+                    return value
+                self._remove(key)
+                self._expirations += 1
+
+            flight = self._inflight.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._inflight[key] = _Flight()
+                self._misses += 1
+            else:
+                self._coalesced += 1
+
+        if not leader:
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.result
+
+        try:
+            flight.result = compute()
+        except Exception as e:
+            flight.error = e
+            raise
+        else:
+            self._store(key, flight.result)
+        finally:
+            with self._lock:
+                del self._inflight[key]
+            flight.done.set()
+        return flight.result
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self):
+        """Return a dictionary with the cache counters."""
+        with self._lock:
+            return {
+                'hits': self._hits,
+                'misses': self._misses,
+                'coalesced': self._coalesced,
+                'evictions': self._evictions,
+                'expirations': self._expirations,
+                'entries': len(self._entries),
+                'bytes': self._bytes,
+            }
+
+    def _store(self, key, value):
+        size = _sizeof(value)
+        if size > self.max_bytes:
+            return
+        expiry = time.monotonic() + self.ttl if self.ttl is not None else None
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (value, size, expiry)
+            self._bytes += size
+            while self._bytes > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+                self._evictions += 1
+
+    def _remove(self, key):
+        _, size, _ = self._entries.pop(key)
+        self._bytes -= size
@@ -14,10 +14,30 @@
 # limitations under the License.
 #
 
+import os
+import threading
 from abc import ABC, abstractmethod
 
+from maxfw.utils.metrics import PREDICTIONS, PREDICTIONS_IN_PROGRESS, stage_timer
+from .batching import BatchScheduler
+from .cache import PredictionCache, cache_key
+
+_lock = threading.Lock()
+
 
 class MAXModelWrapper(ABC):
+    # Opt-in micro-batching: when `batch_max_size` is larger than 1, concurrent `predict` calls are grouped
+    # into batches of at most `batch_max_size` inputs, waiting at most `batch_max_wait` seconds for a batch
+    # to fill up, and each batch is collated by `_collate_batch` and passed to `_predict_batch` at once.
+    batch_max_size = 0
+    batch_max_wait = 0.005
+
+    # Opt-in prediction cache: when `cache_max_bytes` is positive, the results of `predict` are cached by a
+    # hash of the raw input and the model id and version from `MODEL_META_DATA`, up to `cache_max_bytes`
+    # bytes, for `cache_ttl` seconds. Concurrent calls with the same input share a single computation.
+    cache_max_bytes = 0
+    cache_ttl = 3600
+
     def __init__(self, path=None):
         """Implement code to load model here"""
         pass
@@ -35,8 +55,101 @@ class MAXModelWrapper(ABC):
         """Implement core model inference code here"""
         pass
 
+    def _collate_batch(self, xs):
+        """Implement code to combine a list of pre-processed inputs into a batch for model inference here,
+        e.g. by stacking them into a single ndarray. Defaults to the list itself."""
+        return xs
+
+    def _pre_process_batch(self, xs):
+        """Implement code to process a list of raw inputs into a batch for model inference here.
+        Defaults to `_pre_process` on every input, collated by `_collate_batch`."""
+        return self._collate_batch([self._pre_process(x) for x in xs])
+
+    def _predict_batch(self, xs):
+        """Implement vectorized model inference on a batch of pre-processed inputs here.
+
+        The batch is the output of `_pre_process_batch` or, when micro-batching concurrent `predict` calls,
+        the `_pre_process` outputs collated by `_collate_batch`. Override `_collate_batch` rather than
+        `_pre_process_batch` to build the batch, so that both get the same input. Must return one prediction
+        per input. Defaults to `_predict` on every input."""
+        return [self._predict(x) for x in xs]
+
+    def _run_batch(self, xs):
+        # the batch function of the micro-batching scheduler
+        return self._predict_batch(self._collate_batch(xs))
+
+    def _post_process_batch(self, xs):
+        """Implement any code to post-process a batch of model inference responses here.
+        Must return one result per input. Defaults to `_post_process` on every response."""
+        return [self._post_process(x) for x in xs]
+
+    @property
+    def batch_scheduler(self):
+        """The `BatchScheduler` used for micro-batching, or `None` if batching is disabled."""
+        if self.batch_max_size <= 1:
+            return None
+        # the scheduler thread does not survive a fork, so every (pre-forked worker) process needs its own
+        key = '_batch_scheduler_{}'.format(os.getpid())
+        scheduler = self.__dict__.get(key)
+        if scheduler is None:
+            with _lock:
+                scheduler = self.__dict__.get(key)
+                if scheduler is None:
+                    scheduler = BatchScheduler(self._run_batch, self.batch_max_size, self.batch_max_wait)
+                    self.__dict__[key] = scheduler
+        return scheduler
+
+    @property
+    def prediction_cache(self):
+        """The `PredictionCache` used for caching predictions, or `None` if caching is disabled."""
+        if self.cache_max_bytes <= 0:
+            return None
+        cache = self.__dict__.get('_prediction_cache')
+        if cache is None:
+            with _lock:
+                cache = self.__dict__.get('_prediction_cache')
+                if cache is None:
+                    cache = self._prediction_cache = PredictionCache(self.cache_max_bytes, self.cache_ttl)
+        return cache
+
     def predict(self, x):
-        pre_x = self._pre_process(x)
-        prediction = self._predict(pre_x)
-        result = self._post_process(prediction)
+        cache = self.prediction_cache
+        if cache is not None:
+            metadata = getattr(self, 'MODEL_META_DATA', None) or {}
+            key = cache_key(x, metadata.get('id'), metadata.get('version'))
+            if key is not None:
+                return cache.get_or_compute(key, lambda: self._run_predict(x))
+        return self._run_predict(x)
+
+    def _run_predict(self, x):
+        PREDICTIONS_IN_PROGRESS.inc()
+        try:
+            with stage_timer('pre_process'):
+                pre_x = self._pre_process(x)
+            scheduler = self.batch_scheduler
+            with stage_timer('predict'):
+                if scheduler is not None:
+                    prediction = scheduler.submit(pre_x)
+                else:
+                    prediction = self._predict(pre_x)
+            with stage_timer('post_process'):
+                result = self._post_process(prediction)
+        finally:
+            PREDICTIONS_IN_PROGRESS.dec()
+        PREDICTIONS.inc()
         return result
+
+    def predict_batch(self, xs):
+        """Run the model on a list of inputs at once and return a list with one result per input."""
+        PREDICTIONS_IN_PROGRESS.inc(len(xs))
+        try:
+            with stage_timer('pre_process_batch'):
+                pre_xs = self._pre_process_batch(xs)
+            with stage_timer('predict_batch'):
+                predictions = self._predict_batch(pre_xs)
+            with stage_timer('post_process_batch'):
+                results = list(self._post_process_batch(predictions))
+        finally:
+            PREDICTIONS_IN_PROGRESS.dec(len(xs))
+        PREDICTIONS.inc(len(xs))
+        return results
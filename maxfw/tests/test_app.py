@@ -0,0 +1,433 @@
+#
+# Copyright 2018-2019 IBM Corp. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# Standard libs
+import asyncio
+import functools
+import gc
+import io
+import json
+import os
+import subprocess
+import sys
+import threading
+import unittest
+
+# Dependencies
+import nose
+import numpy as np
+from flask import request
+
+# The module to test
+from maxfw.core import AdmissionController, MAXApp, PredictAPI, server
+from maxfw.model import MAXModelWrapper
+from maxfw.utils.image_utils import ImageProcessor, Resize, ToPILImage
+
+
+class EchoAPI(PredictAPI):
+
+    def post(self):
+        return {'size': len(request.get_data()), 'query': request.args.get('q')}
+
+
+class CountingModel(MAXModelWrapper):
+
+    def __init__(self):
+        self.inputs = []
+
+    def _predict(self, x):
+        self.inputs.append(x)
+        return len(x)
+
+
+served_model = CountingModel()
+
+
+class ServedAPI(PredictAPI):
+
+    def post(self):
+        return {'prediction': served_model.predict(request.get_data())}
+
+
+class GatedAPI(PredictAPI):
+    max_concurrency = 1
+    max_queue = 1
+    retry_after = 3
+    entered = threading.Semaphore(0)
+    proceed = threading.Event()
+
+    def post(self):
+        self.entered.release()
+        self.proceed.wait(10)
+        return {'status': 'ok'}
+
+
+def count_calls(method):
+    @functools.wraps(method)
+    def wrapper(*args, **kwargs):
+        response = method(*args, **kwargs)
+        response['decorators'] = response.get('decorators', 0) + 1
+        return response
+    return wrapper
+
+
+class DecoratedAPI(PredictAPI):
+    max_concurrency = 1
+    method_decorators = [count_calls]
+
+    def post(self):
+        return {'status': 'ok'}
+
+
+class StackedAPI(DecoratedAPI):
+    method_decorators = [count_calls, count_calls]
+
+
+class UploadAPI(PredictAPI):
+
+    def post(self):
+        upload = request.get_upload(request.args.get('name'))
+        if upload is None:
+            return {'size': None}
+        stream = getattr(upload, 'stream', upload)
+        return {'size': len(upload.read()), 'spooled': getattr(stream, '_rolled', False)}
+
+
+app = MAXApp()
+app.add_api(EchoAPI, '/echo')
+app.add_api(ServedAPI, '/served')
+app.add_api(UploadAPI, '/upload')
+app.add_api(GatedAPI, '/gated')
+app.add_api(DecoratedAPI, '/decorated')
+app.add_api(StackedAPI, '/stacked')
+
+
+def _asgi_request(asgi_app, method, path, chunks=(b'',), query_string=b''):
+    """Send a request through an ASGI application and return the status, headers and body."""
+    messages = [{'type': 'http.request', 'body': chunk, 'more_body': i < len(chunks) - 1}
+                for i, chunk in enumerate(chunks)]
+    sent = []
+
+    async def receive():
+        return messages.pop(0)
+
+    async def send(message):
+        sent.append(message)
+
+    scope = {'type': 'http', 'method': method, 'path': path, 'query_string': query_string,
+             'headers': [(b'content-type', b'application/octet-stream')]}
+    asyncio.run(asgi_app(scope, receive, send))
+
+    assert sent[0]['type'] == 'http.response.start'
+    body = b''.join(m.get('body', b'') for m in sent[1:])
+    return sent[0]['status'], dict(sent[0]['headers']), body
+
+
+def test_asgi_app():
+    status, headers, body = _asgi_request(app.asgi_app, 'POST', '/model/echo', [b'a' * 10, b'b' * 5], b'q=x')
+    assert status == 200
+    assert headers[b'content-type'] == b'application/json'
+    assert json.loads(body.decode()) == {'size': 15, 'query': 'x'}
+
+    status, _, _ = _asgi_request(app.asgi_app, 'GET', '/model/missing')
+    assert status == 404
+
+
+def test_upload():
+    client = app.app.test_client()
+    app.app.config['MAX_SPOOL_SIZE'] = 100
+
+    # the request body
+    assert client.post('/model/upload', data=b'a' * 10).get_json() == {'size': 10, 'spooled': False}
+    assert client.post('/model/upload', data=b'a' * 1000).get_json() == {'size': 1000, 'spooled': True}
+
+    # uploaded files
+    data = {'image': (io.BytesIO(b'a' * 1000), 'image.jpg'), 'other': (io.BytesIO(b'b' * 10), 'other.jpg')}
+    response = client.post('/model/upload?name=image', data=data, content_type='multipart/form-data')
+    assert response.get_json() == {'size': 1000, 'spooled': True}
+    data = {'image': (io.BytesIO(b'a' * 10), 'image.jpg')}
+    response = client.post('/model/upload', data=data, content_type='multipart/form-data')
+    assert response.get_json() == {'size': 10, 'spooled': False}
+    response = client.post('/model/upload?name=missing', data={'x': '1'}, content_type='multipart/form-data')
+    assert response.get_json() == {'size': None}
+
+    app.app.config['MAX_SPOOL_SIZE'] = 1024 * 1024
+
+
+def test_profile():
+    # the endpoint is disabled by default
+    assert app.app.test_client().get('/admin/profile').status_code == 404
+
+    os.environ['MAX_PROFILE_ENDPOINT'] = 'true'
+    try:
+        profile_app = MAXApp()
+    finally:
+        del os.environ['MAX_PROFILE_ENDPOINT']
+    client = profile_app.app.test_client()
+    client.delete('/admin/profile')
+    p = ImageProcessor([ToPILImage('RGB'), Resize((10, 10))], profile='test pipeline')
+    p.apply_transforms(np.zeros((20, 20, 3), dtype=np.uint8))
+
+    response = client.get('/admin/profile')
+    assert response.status_code == 200
+    profiles = [s for s in response.get_json()['processors'] if s['name'] == 'test pipeline']
+    assert len(profiles) == 1
+    assert [(s['transform'], s['calls']) for s in profiles[0]['steps']] == [('ToPILImage', 1), ('Resize', 1)]
+
+    response = client.delete('/admin/profile')
+    assert all(s['name'] != 'test pipeline' for s in response.get_json()['processors'])
+
+
+class SlowModel(MAXModelWrapper):
+    loaded = threading.Event()
+    cache_max_bytes = 1024
+
+    def __init__(self):
+        self.loaded.wait(10)
+        self.inputs = []
+
+    def _predict(self, x):
+        self.inputs.append(x)
+        return x
+
+
+def test_warm_up():
+    warm_app = MAXApp()
+    client = warm_app.app.test_client()
+    assert client.get('/health/ready').status_code == 200
+
+    warm_app.warm_up(SlowModel, inputs=[b'a', b'b'], iterations=2)
+    with nose.tools.assert_raises(RuntimeError):
+        warm_app.warm_up(SlowModel)
+    assert client.get('/health/live').get_json() == {'status': 'alive'}
+    response = client.get('/health/ready')
+    assert response.status_code == 503
+    assert response.get_json() == {'status': 'warming_up'}
+    response = client.post('/model/echo', data=b'abc')
+    assert response.status_code == 503
+    assert response.headers['Retry-After'] == '1'
+    assert not warm_app.wait_ready(0.01)
+
+    SlowModel.loaded.set()
+    assert warm_app.wait_ready(10)
+    assert client.get('/health/ready').get_json() == {'status': 'ready'}
+    assert client.post('/model/echo', data=b'abc').status_code == 200
+    # every prediction runs, despite the prediction cache
+    assert warm_app.model.inputs == [b'a', b'b', b'a', b'b']
+
+    def fail():
+        raise IOError('no weights')
+
+    warm_app.warm_up(fail)
+    assert not warm_app.wait_ready(10)
+    response = client.get('/health/ready')
+    assert response.status_code == 503
+    assert response.get_json()['status'] == 'failed'
+    assert client.get('/health/live').status_code == 200
+    # the model API is not served after a failed warm-up
+    response = client.post('/model/echo', data=b'abc')
+    assert response.status_code == 503
+    assert 'no weights' in response.get_json()['error']
+    assert 'Retry-After' not in response.headers
+    with nose.tools.assert_raises(IOError):
+        warm_app.warm_up(fail, background=False)
+
+
+def test_warm_up_serving_instance():
+    # the model wrapper that serves the requests is the one that is warmed up
+    warm_app = MAXApp()
+    warm_app.warm_up(served_model, inputs=[b'warm'], iterations=2, background=False)
+    assert warm_app.model is served_model
+    response = warm_app.app.test_client().post('/model/served', data=b'abc')
+    assert response.get_json() == {'prediction': 3}
+    assert served_model.inputs == [b'warm', b'warm', b'abc']
+
+
+def test_server():
+    try:
+        import gunicorn  # noqa: F401
+    except ImportError:
+        raise unittest.SkipTest('the production server requires gunicorn')
+
+    forked = []
+    gunicorn_app = server._create_server(app.app, '127.0.0.1', 5000, workers=2, threads=4, timeout=5,
+                                         post_fork=lambda arbiter, worker: forked.append(os.getpid()))
+    cfg = gunicorn_app.cfg
+    assert cfg.bind == ['127.0.0.1:5000']
+    assert (cfg.workers, cfg.threads, cfg.worker_class_str, cfg.timeout) == (2, 4, 'gthread', 5)
+    assert cfg.preload_app
+    assert server._create_server(app.app, '127.0.0.1', 5000, workers=2).cfg.worker_class_str == 'sync'
+
+    # the app is loaded in the parent process, and its objects are left alone by the garbage collector
+    try:
+        assert gunicorn_app.load() is app.app
+        if hasattr(gc, 'get_freeze_count'):
+            assert gc.get_freeze_count() > 0
+    finally:
+        if hasattr(gc, 'unfreeze'):
+            gc.unfreeze()
+
+    # in a forked worker, the metrics are labelled with its pid and the post_fork hook of the user runs
+    if not hasattr(os, 'fork'):
+        return
+    read, write = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        try:
+            cfg.post_fork(None, None)
+            label = 'maxfw_ready{{worker="{}"}}'.format(os.getpid())
+            os.write(write, json.dumps({'pid': os.getpid(), 'forked': forked,
+                                        'labelled': label in server.REGISTRY.exposition()}).encode())
+        finally:
+            os._exit(0)
+    os.close(write)
+    with os.fdopen(read, 'rb') as f:
+        result = json.loads(f.read().decode())
+    os.waitpid(pid, 0)
+    assert result == {'pid': pid, 'forked': [pid], 'labelled': True}
+    assert server.REGISTRY.const_labels == ()
+
+
+def test_run_workers():
+    served = []
+    serve = server.serve
+    server.serve = lambda *args, **kwargs: served.append((args, kwargs))
+    try:
+        app.run(workers=2, threads=3)
+        assert served == [((app.app, '0.0.0.0', 5000), {'workers': 2, 'threads': 3})]
+
+        # the workers are not started after a failed warm-up
+        def fail():
+            raise IOError('no weights')
+
+        failed_app = MAXApp()
+        failed_app.warm_up(fail)
+        with nose.tools.assert_raises(RuntimeError):
+            failed_app.run(workers=2)
+        assert len(served) == 1
+    finally:
+        server.serve = serve
+
+
+def test_admission_controller():
+    controller = AdmissionController(max_concurrency=2, max_queue=2, max_wait=10)
+    assert controller.acquire() and controller.acquire()
+
+    # the queued requests are admitted in order, as slots are released
+    order = []
+
+    def queued(i):
+        if controller.acquire():
+            order.append(i)
+
+    threads = []
+    for i in range(2):
+        threads.append(threading.Thread(target=queued, args=(i,)))
+        threads[-1].start()
+        while controller.stats()['queued'] <= i:
+            pass
+    assert not controller.acquire()  # the queue is full
+    controller.release()
+    threads[0].join()
+    controller.release()
+    threads[1].join()
+    assert order == [0, 1]
+    assert controller.stats() == {'active': 2, 'queued': 0, 'admitted': 4, 'rejected': 1, 'timeouts': 0}
+
+    # requests that wait too long are rejected
+    controller.max_wait = 0.01
+    assert not controller.acquire()
+    assert controller.stats()['timeouts'] == 1
+    controller.release()
+    controller.release()
+    assert controller.stats()['active'] == 0
+
+    with nose.tools.assert_raises(ValueError):
+        AdmissionController(0)
+
+
+def test_admission_control():
+    client = app.app.test_client()
+    responses = []
+
+    def post():
+        responses.append(app.app.test_client().post('/model/gated'))
+
+    threads = [threading.Thread(target=post) for _ in range(2)]
+    for t in threads:
+        t.start()
+    # one request runs and one waits, so a third one is rejected
+    assert GatedAPI.entered.acquire(timeout=10)
+    controller = getattr(GatedAPI, '_admission_controller_{}'.format(os.getpid()))
+    while controller.stats()['queued'] < 1:
+        pass
+    response = client.post('/model/gated')
+    assert response.status_code == 503
+    assert response.headers['Retry-After'] == '3'
+
+    GatedAPI.proceed.set()
+    for t in threads:
+        t.join()
+    assert [r.status_code for r in responses] == [200, 200]
+    assert controller.stats()['active'] == 0
+
+    metrics = client.get('/metrics').data.decode()
+    assert 'maxfw_admission_rejected_total{reason="queue_full"}' in metrics
+    assert 'maxfw_admission_queue_depth 0.0' in metrics
+
+
+def test_admission_control_subclasses():
+    # the admission control does not depend on the method decorators of the subclasses
+    client = app.app.test_client()
+    for api, route, decorators in ((DecoratedAPI, '/model/decorated', 1), (StackedAPI, '/model/stacked', 2)):
+        response = client.post(route)
+        assert response.status_code == 200
+        assert response.get_json()['decorators'] == decorators
+        controller = getattr(api, '_admission_controller_{}'.format(os.getpid()))
+        assert controller.acquire()
+        try:
+            response = client.post(route)
+            assert response.status_code == 503
+            assert response.headers['Retry-After'] == '1'
+        finally:
+            controller.release()
+        assert client.post(route).status_code == 200
+
+
+def test_lazy_imports():
+    code = ("import sys, maxfw.core, maxfw.model, maxfw.utils.image_functions; "
+            "print(sorted(m for m in ('flask', 'flask_restx', 'flask_cors') if m in sys.modules))")
+    assert subprocess.check_output([sys.executable, '-c', code]).decode().strip() == '[]'
+    code = "import sys, maxfw.core, maxfw.model; print('numpy' in sys.modules)"
+    assert subprocess.check_output([sys.executable, '-c', code]).decode().strip() == 'False'
+
+
+def test_metrics():
+    client = app.app.test_client()
+    client.post('/model/echo', data=b'abc')
+    client.get('/model/missing')
+
+    response = client.get('/metrics')
+    assert response.status_code == 200
+    assert response.mimetype == 'text/plain'
+    metrics = response.data.decode()
+    assert '# TYPE maxfw_request_seconds histogram' in metrics
+    assert 'maxfw_requests_total{method="POST",endpoint="/model/echo",status="200"}' in metrics
+    assert 'maxfw_request_seconds_bucket{method="POST",endpoint="/model/echo",le="+Inf"}' in metrics
+    assert 'maxfw_requests_in_progress 1.0' in metrics
+
+
+if __name__ == '__main__':
+    nose.main()
@@ -15,21 +15,28 @@
 #
 # Standard libs
 import io
+import os
+import pickle  # nosec - only used on objects created by the test
+import unittest
 
 # Dependencies
 import nose
 import numpy as np
-from PIL import Image
+from PIL import Image, ImageEnhance
 
 # The module to test
 from maxfw.utils.image_utils import ImageProcessor, ToPILImage, Resize, Grayscale, Normalize, Standardize, Rotate, \
-    PILtoarray
+    PILtoarray, ToTensor, AdjustBrightness, AdjustContrast, AdjustGamma, AdjustHue, ImageTooLargeError, probe_image
+from maxfw.utils.buffers import BufferPool
+from maxfw.utils import executors
 from maxfw.core.utils import MAXImageProcessor
 
 # Initialize a test input file
 stream = io.BytesIO()
 Image.open('maxfw/tests/test_image.jpg').convert('RGBA').save(stream, 'PNG')
 test_input = stream.getvalue()
+with open('maxfw/tests/test_image.jpg', 'rb') as f:
+    test_input_jpg = f.read()
 
 
 def test_imageprocessor_read():
@@ -62,6 +69,55 @@ def test_imageprocessor_read():
     assert np.max(img_out) <= 255
 
 
+def test_imageprocessor_read_direct():
+    """Test that images are decoded, or wrapped, without intermediate copies."""
+
+    # bytes are decoded straight into the target mode, with the same result as a conversion of the decoded image
+    for target_mode in ['RGB', 'RGBA', 'L']:
+        img_ref = Image.open(io.BytesIO(test_input)).convert(target_mode)
+        img_out = ToPILImage(target_mode)(test_input)
+        assert img_out.mode == target_mode
+        assert np.array_equal(np.array(img_out), np.array(img_ref))
+
+    # palette images are converted using their palette
+    stream = io.BytesIO()
+    Image.open(io.BytesIO(test_input)).convert('RGB').convert('P').save(stream, 'PNG')
+    img_out = ToPILImage('RGB')(stream.getvalue())
+    assert np.array_equal(np.array(img_out), np.array(Image.open(stream).convert('RGB')))
+
+    # arrays that match the target mode share their memory with the image
+    for target_mode, shape in [('L', (20, 30)), ('RGBA', (20, 30, 4))]:
+        arr = np.zeros(shape, dtype=np.uint8)
+        img_out = ToPILImage(target_mode)(arr)
+        arr[5, 7] = 255
+        assert np.array(img_out)[5, 7].min() == 255
+
+    # other arrays are converted
+    arr = np.zeros((20, 30), dtype=np.uint8)
+    img_out = ToPILImage('RGB')(arr)
+    arr[5, 7] = 255
+    assert img_out.mode == 'RGB'
+    assert np.array(img_out).max() == 0
+
+
+def test_imageprocessor_draft():
+    """Test the reduced resolution decoding of JPEG images."""
+
+    # the image is decoded at the smallest scale that is still at least as large as the requested size
+    assert ToPILImage('RGB', draft_size=(100, 200))(test_input_jpg).size == (256, 170)
+    assert ToPILImage('L', draft_size=100)(test_input_jpg).size == (256, 170)
+    assert ToPILImage('RGB', draft_size=(600, 200))(test_input_jpg).size == (1024, 678)
+
+    # other formats are decoded at full resolution
+    assert ToPILImage('RGB', draft_size=(100, 200))(test_input).size == (1024, 678)
+
+    # the result is close to a full resolution decode
+    img_ref = ImageProcessor([ToPILImage('RGB'), Resize((100, 200)), PILtoarray()]).apply_transforms(test_input_jpg)
+    img_out = ImageProcessor([ToPILImage('RGB', draft_size=(100, 200)), Resize((100, 200)), PILtoarray()]) \
+        .apply_transforms(test_input_jpg)
+    assert np.mean(np.abs(img_out.astype(np.float64) - img_ref)) <= 0.02 * 255
+
+
 def test_imageprocessor_resize():
     """Test the Imageprocessor's resize function."""
 
@@ -266,6 +322,243 @@ def test_imageprocessor_standardize():
         p.apply_transforms(test_input)
 
 
+def test_imageprocessor_probe():
+    """Test reading the image header, and the size limits of ToPILImage."""
+
+    info = probe_image(test_input)
+    assert info == ('PNG', 1024, 678, 'RGBA', 1)
+    info = probe_image(test_input_jpg)
+    assert (info.format, info.width, info.height, info.mode, info.frames) == ('JPEG', 1024, 678, 'RGB', 1)
+
+    with nose.tools.assert_raises(ImageTooLargeError):
+        probe_image(test_input_jpg, max_pixels=1024 * 677)
+    with nose.tools.assert_raises(TypeError):
+        probe_image(b'not an image')
+    with nose.tools.assert_raises(TypeError):
+        probe_image(np.zeros((10, 10)))
+
+    # Test the limits
+    with nose.tools.assert_raises(ImageTooLargeError):
+        ImageProcessor([ToPILImage('RGB', max_bytes=len(test_input) - 1)]).apply_transforms(test_input)
+    with nose.tools.assert_raises(ImageTooLargeError):
+        ImageProcessor([ToPILImage('RGB', max_pixels=1000 * 678)]).apply_transforms(test_input)
+    img_out = ImageProcessor([ToPILImage('RGB', max_pixels=1024 * 678, max_bytes=len(test_input))]) \
+        .apply_transforms(test_input)
+    assert img_out.size == (1024, 678)
+
+    # Test that the limit applies to the reduced size of a JPEG image that is decoded at a lower resolution
+    transform_sequence = [ToPILImage('RGB', max_pixels=256 * 170), Resize((100, 100))]
+    with nose.tools.assert_raises(ImageTooLargeError):
+        ImageProcessor(transform_sequence).apply_transforms(test_input_jpg)
+    img_out = ImageProcessor(transform_sequence, compile=True).apply_transforms(test_input_jpg)
+    assert img_out.size == (100, 100)
+
+    # Test images in file objects
+    f = io.BytesIO(test_input_jpg)
+    f.seek(10)
+    assert probe_image(f).format == 'JPEG'
+    assert f.tell() == 10
+    with nose.tools.assert_raises(ImageTooLargeError):
+        ImageProcessor([ToPILImage('RGB', max_bytes=len(test_input_jpg) - 1)]).apply_transforms(f)
+    img_out = ImageProcessor([ToPILImage('RGB', max_bytes=len(test_input_jpg))]).apply_transforms(f)
+    np.testing.assert_array_equal(np.asarray(img_out), np.asarray(Image.open(io.BytesIO(test_input_jpg))))
+
+    # Test the error response
+    p = MAXImageProcessor([ToPILImage('RGB', max_pixels=100 * 100)])
+    with nose.tools.assert_raises_regexp(Exception, r".*413.*"):
+        p.apply_transforms(test_input)
+    with nose.tools.assert_raises_regexp(Exception, r".*413.*"):
+        p.apply_batch([test_input])
+    with nose.tools.assert_raises_regexp(Exception, r".*413.*"):
+        p.map_transforms([test_input])
+    executor = executors.ThreadExecutor(max_workers=2)
+    try:
+        p = MAXImageProcessor([ToPILImage('RGB', max_pixels=100 * 100)], executor=executor)
+        with nose.tools.assert_raises_regexp(Exception, r".*413.*"):
+            p.map_transforms([test_input, test_input])
+        with nose.tools.assert_raises_regexp(Exception, r".*413.*"):
+            p.apply_batch([test_input, test_input])
+    finally:
+        executor.close()
+
+
+def test_imageprocessor_standardize_dtype():
+    """Test the Imageprocessor's standardize function with other data types and output buffers."""
+
+    mean, std = [120, 110, 100], [50, 60, 0]
+    pil_img = ImageProcessor([ToPILImage('RGB'), PILtoarray()]).apply_transforms(test_input)
+    img_ref = pil_img.astype(np.float64) - mean
+    img_ref[..., :2] /= std[:2]
+
+    # the result matches the channel-wise computation (channels with a std of 0 are only mean-centered)
+    img_out = Standardize(mean, std)(pil_img)
+    assert img_out.dtype == np.float64
+    np.testing.assert_allclose(img_out, img_ref, atol=1e-9)
+
+    # the same transformation is reused for several images
+    p = ImageProcessor([ToPILImage('RGB'), Standardize(mean, std, dtype=np.float32)])
+    for _ in range(2):
+        img_out = p.apply_transforms(test_input)
+        assert img_out.dtype == np.float32
+        np.testing.assert_allclose(img_out, img_ref, atol=1e-4)
+
+    img_out = Standardize(mean, std, dtype=np.float16)(pil_img)
+    assert img_out.dtype == np.float16
+    np.testing.assert_allclose(img_out, img_ref, atol=1e-2)
+
+    # the result is written into the given buffer
+    out = np.empty(pil_img.shape, dtype=np.float32)
+    assert Standardize(mean, std)(pil_img, out=out) is out
+    np.testing.assert_allclose(out, img_ref, atol=1e-4)
+    with nose.tools.assert_raises_regexp(ValueError, r".*shape of the image.*"):
+        Standardize(mean, std)(pil_img, out=out[1:])
+
+    # floating point images of the right type can be standardized in place
+    img = pil_img.astype(np.float32)
+    assert Standardize(mean, std, dtype=np.float32, inplace=True)(img) is img
+    np.testing.assert_allclose(img, img_ref, atol=1e-4)
+    assert Standardize(mean, std, dtype=np.float32, inplace=True)(pil_img) is not pil_img
+
+
+def test_imageprocessor_to_tensor():
+    """Test the Imageprocessor's tensor conversion."""
+
+    mean, std = [0.485, 0.456, 0.406], [0.229, 0.224, 0.225]
+    pil_img = ImageProcessor([ToPILImage('RGB'), PILtoarray()]).apply_transforms(test_input)
+    img_ref = (pil_img / 255 - mean) / std
+
+    # channels last
+    img_out = ImageProcessor([ToPILImage('RGB'), ToTensor(mean=mean, std=std, scale=1 / 255)]).apply_transforms(test_input)
+    assert img_out.shape == (678, 1024, 3)
+    assert img_out.dtype == np.float32
+    np.testing.assert_allclose(img_out, img_ref, atol=1e-5)
+
+    # channels first, with a batch axis, in the same pass
+    t = ToTensor(layout='CHW', dtype=np.float64, mean=mean, std=std, scale=1 / 255, batch_axis=True)
+    img_out = ImageProcessor([ToPILImage('RGB'), PILtoarray(), t]).apply_transforms(test_input)
+    assert img_out.shape == (1, 3, 678, 1024)
+    assert img_out.flags.c_contiguous
+    np.testing.assert_allclose(img_out, img_ref.transpose(2, 0, 1)[np.newaxis], atol=1e-9)
+
+    # into a given buffer
+    out = np.empty((1, 3, 678, 1024), dtype=np.float16)
+    assert t(pil_img, out=out) is out
+    np.testing.assert_allclose(out[0], img_ref.transpose(2, 0, 1), atol=1e-2)
+    with nose.tools.assert_raises_regexp(ValueError, r".*shape of the tensor.*"):
+        t(pil_img, out=out[0])
+
+    # single-channel images get a channel axis
+    img_out = ImageProcessor([ToPILImage('L'), ToTensor('CHW', dtype=np.uint8)]).apply_transforms(test_input)
+    assert img_out.shape == (1, 678, 1024)
+    assert img_out.dtype == np.uint8
+    with nose.tools.assert_raises_regexp(ValueError, r".*must correspond to the number of channels.*"):
+        ImageProcessor([ToPILImage('L'), ToTensor(mean=mean)]).apply_transforms(test_input)
+    with nose.tools.assert_raises(ValueError):
+        ToTensor(layout='NCHW')
+    with nose.tools.assert_raises(ValueError):
+        ToTensor(std=[1, 0, 1])
+
+    # Standardize may be followed by ToTensor, but ToTensor must be the last transformation
+    p = ImageProcessor([ToPILImage('RGB'), Standardize(), ToTensor('CHW')])
+    assert p.apply_transforms(test_input).shape == (3, 678, 1024)
+    for transform_sequence in [[ToPILImage('RGB'), ToTensor(), Resize((100, 200))],
+                               [ToPILImage('RGB'), ToTensor(), ToTensor()],
+                               [ToPILImage('RGB'), Standardize(), Resize((100, 200)), ToTensor()]]:
+        with nose.tools.assert_raises(ValueError):
+            ImageProcessor(transform_sequence).apply_transforms(test_input)
+
+    # the compiled pipeline converts PIL images directly
+    p = ImageProcessor([ToPILImage('RGB'), Resize((100, 200)), PILtoarray(), ToTensor('CHW')], compile=True)
+    assert not any(isinstance(t, PILtoarray) for t in p.steps)
+
+    # batches of tensors are written straight into the batch array
+    batch_out = p.apply_batch([test_input, pil_img])
+    assert batch_out.shape == (2, 3, 100, 200)
+    assert batch_out.dtype == np.float32
+    np.testing.assert_array_equal(batch_out[0], p.apply_transforms(test_input))
+    np.testing.assert_array_equal(batch_out[1], p.apply_transforms(pil_img))
+    with nose.tools.assert_raises_regexp(ValueError, r".*must have the same shape.*"):
+        p.apply_batch([test_input], out=np.empty((1, 100, 200, 3)))
+    with nose.tools.assert_raises(ValueError):
+        p.apply_batch([test_input], layout='NHWC')
+
+
+def test_imageprocessor_adjust():
+    """Test the Imageprocessor's brightness, contrast and gamma adjustments."""
+
+    for mode in ['L', 'RGB', 'RGBA']:
+        img = ToPILImage(mode)(test_input)
+
+        # the adjustments match those of Pillow's ImageEnhance
+        for factor in [0, 0.4, 1, 1.7]:
+            img_ref = ImageEnhance.Brightness(img).enhance(factor)
+            assert np.array_equal(np.array(AdjustBrightness(factor)(img)), np.array(img_ref))
+            img_ref = ImageEnhance.Contrast(img).enhance(factor)
+            assert np.array_equal(np.array(AdjustContrast(factor)(img)), np.array(img_ref))
+
+        # gamma correction keeps the alpha channel
+        img_out = AdjustGamma(2.2, gain=0.9)(img)
+        assert img_out.mode == mode
+        lut = np.array([min(max(round(255 * 0.9 * pow(v / 255., 2.2)), 0), 255) for v in range(256)])
+        img_ref = np.array(img)
+        if mode == 'L':
+            img_ref = lut[img_ref]
+        else:
+            img_ref[..., :3] = lut[img_ref[..., :3]]
+        assert np.array_equal(np.array(img_out), img_ref)
+
+        # a sequence of adjustments is merged into a single one with the same result
+        transform_sequence = [ToPILImage(mode), AdjustBrightness(1.2), AdjustGamma(0.8), AdjustContrast(1.5),
+                              AdjustBrightness(0.9), PILtoarray()]
+        p = ImageProcessor(transform_sequence, compile=True)
+        assert len(p.steps) == 3
+        assert np.array_equal(p.apply_transforms(test_input), ImageProcessor(transform_sequence).apply_transforms(test_input))
+
+    # other modes are adjusted by Pillow
+    img = ToPILImage('CMYK')(test_input)
+    assert np.array_equal(np.array(AdjustBrightness(0.5)(img)), np.array(ImageEnhance.Brightness(img).enhance(0.5)))
+
+    with nose.tools.assert_raises_regexp(ValueError, r".*non-negative.*"):
+        ImageProcessor([ToPILImage('RGB'), AdjustGamma(-1)]).apply_transforms(test_input)
+    with nose.tools.assert_raises(TypeError):
+        AdjustContrast(1.5)(np.zeros((10, 10)))
+
+
+def test_imageprocessor_hue():
+    """Test the Imageprocessor's hue adjustment."""
+
+    def adjust_hue_reference(img, hue_factor):
+        # shift the hue channel of the image in HSV mode
+        h, s, v = img.convert('HSV').split()
+        np_h = np.array(h, dtype=np.uint8) + np.uint8(int(hue_factor * 255) % 256)
+        return Image.merge('HSV', (Image.fromarray(np_h, 'L'), s, v)).convert('RGB')
+
+    img = ToPILImage('RGB')(test_input)
+    for hue_factor in [-0.5, -0.2, 0, 0.1, 0.5]:
+        img_ref = np.array(adjust_hue_reference(img, hue_factor))
+        assert np.array_equal(np.array(AdjustHue(hue_factor)(img)), img_ref)
+
+        # the approximation is close to the exact result
+        img_out = np.array(AdjustHue(hue_factor, approximate=True)(img))
+        diff = np.abs(img_out.astype(np.int16) - img_ref)
+        assert diff.mean() < 0.5 and diff.max() <= 10
+
+    # the alpha channel is kept
+    img = ToPILImage('RGBA')(test_input)
+    alpha = np.arange(img.size[0] * img.size[1], dtype=np.uint32).reshape(img.size[::-1]).astype(np.uint8)
+    img.putalpha(Image.fromarray(alpha))
+    for approximate in [False, True]:
+        img_out = AdjustHue(0.3, approximate)(img)
+        assert img_out.mode == 'RGBA'
+        assert np.array_equal(np.array(img_out)[..., 3], alpha)
+
+    # grayscale images have no hue
+    img = ToPILImage('L')(test_input)
+    assert AdjustHue(0.3)(img) is img
+    with nose.tools.assert_raises(ValueError):
+        AdjustHue(0.7)(img)
+
+
 def test_imageprocessor_rotate():
     """Test the Imageprocessor's rotate function."""
 
@@ -363,6 +656,272 @@ def test_imageprocessor_combinations():
     p.apply_transforms(test_input)
 
 
+def test_imageprocessor_compile():
+    """Test the compiled Imageprocessor pipelines."""
+
+    pipelines = [
+        [ToPILImage('RGB'), Resize((200, 200)), Grayscale(), PILtoarray(), Standardize()],
+        [ToPILImage('RGB'), Resize((300, 300)), Rotate(10), Resize((200, 200)), Grayscale(num_output_channels=3)],
+        [ToPILImage('RGB'), Rotate(30), Resize(200)],
+        [ToPILImage('RGB'), Resize((2000, 2000)), Rotate(5), Grayscale(num_output_channels=4), Resize((200, 200))],
+        [ToPILImage('RGBA'), Resize((200, 200)), Rotate(-5), Normalize()],
+        [ToPILImage('RGB'), AdjustBrightness(1.2), AdjustContrast(1.5), AdjustGamma(0.8), Resize((200, 200))],
+        [ToPILImage('RGB'), AdjustHue(0.1), Resize(150), Rotate(10)],
+        [ToPILImage('RGB'), AdjustContrast(0.5), Resize((2000, 2000))],
+    ]
+    for transform_sequence in pipelines:
+        img_ref = np.asarray(ImageProcessor(transform_sequence).apply_transforms(test_input), dtype=np.float64)
+        img_out = np.asarray(ImageProcessor(transform_sequence, compile=True).apply_transforms(test_input),
+                             dtype=np.float64)
+        assert img_out.shape == img_ref.shape
+        # the results only differ by rounding and resampling
+        assert np.mean(np.abs(img_out - img_ref)) <= 0.02 * (np.max(img_ref) - np.min(img_ref))
+
+    # grayscale conversion is merged into the decoding, and array conversion into standardization
+    p = ImageProcessor([ToPILImage('RGB'), Resize((200, 200)), Grayscale(), PILtoarray(), Standardize()], compile=True)
+    assert [type(t) for t in p.steps] == [ToPILImage, Resize, Standardize]
+    assert p.steps[0].target_mode == 'L'
+
+    # consecutive resizes are merged
+    p = ImageProcessor([ToPILImage('RGB'), Resize(500), Resize((100, 200))], compile=True)
+    assert [type(t) for t in p.steps] == [ToPILImage, Resize]
+    assert p.apply_transforms(test_input).size == (200, 100)
+
+    # brightness and contrast reductions are applied after the resizes that shrink the image, other adjustments
+    # do not commute with the resize
+    adjustments = [AdjustBrightness(0.8), AdjustContrast(0.6)]
+    p = ImageProcessor([ToPILImage('RGB')] + adjustments + [Resize((100, 200))], compile=True)
+    assert [type(t).__name__ for t in p.steps] == ['ToPILImage', '_ResizeFirst']
+    for adjustment in [AdjustBrightness(1.2), AdjustContrast(1.5), AdjustGamma(2.2), AdjustHue(0.1)]:
+        p = ImageProcessor([ToPILImage('RGB'), adjustment, Resize((100, 200))], compile=True)
+        assert [type(t) for t in p.steps] == [ToPILImage, type(adjustment), Resize]
+    p = ImageProcessor([ToPILImage('RGB'), AdjustBrightness(0.8), Resize((100, 200), Image.BICUBIC)], compile=True)
+    assert [type(t) for t in p.steps] == [ToPILImage, AdjustBrightness, Resize]
+
+    # on a high-frequency image, the results of the compiled pipelines only differ by rounding
+    noise = np.random.RandomState(0).randint(0, 256, (1000, 1000, 3), dtype=np.uint8)
+    pipelines = [
+        adjustments + [Resize((100, 100))],
+        [AdjustContrast(0.5), Resize(64)],
+        [AdjustBrightness(0.6), AdjustGamma(2.2), Resize((100, 100))],
+        [AdjustBrightness(2.0), Resize((100, 100))],
+        [AdjustHue(0.2), Resize((100, 100))],
+        adjustments + [Resize((2000, 2000))],
+    ]
+    for transform_sequence in pipelines:
+        transform_sequence = [ToPILImage('RGB')] + transform_sequence
+        for img in (noise, test_input):
+            img_ref = np.asarray(ImageProcessor(transform_sequence).apply_transforms(img), dtype=np.int16)
+            img_out = np.asarray(ImageProcessor(transform_sequence, compile=True).apply_transforms(img),
+                                 dtype=np.int16)
+            assert np.max(np.abs(img_out - img_ref)) <= 1
+
+    # JPEG images are decoded at a reduced resolution when they are resized
+    p = ImageProcessor([ToPILImage('RGB'), Rotate(5), Resize((100, 200))], compile=True)
+    assert p.steps[0].draft_size == (100, 200)
+    assert p.apply_transforms(test_input_jpg).size == (200, 100)
+
+    # the pipeline is validated once, when it is created
+    with nose.tools.assert_raises(ValueError):
+        ImageProcessor([ToPILImage('RGB'), Normalize(), Resize((200, 200))], compile=True)
+
+
+def test_imageprocessor_apply_batch():
+    """Test the Imageprocessor's batch function."""
+
+    # a mix of input types
+    pil_img = Image.open(io.BytesIO(test_input))
+    batch = [test_input, pil_img.convert('RGB'), np.array(pil_img.convert('RGB')), np.array(pil_img.convert('L'))]
+
+    p = ImageProcessor([ToPILImage('RGB'), Resize((100, 200))])
+    expected = np.stack([np.array(p.apply_transforms(img), dtype=np.float32) for img in batch])
+
+    batch_out = p.apply_batch(batch)
+    assert batch_out.shape == (4, 100, 200, 3)
+    assert batch_out.dtype == np.float32
+    np.testing.assert_array_equal(batch_out, expected)
+
+    # channels first, into a preallocated array
+    out = np.zeros((5, 3, 100, 200), dtype=np.uint8)
+    batch_out = p.apply_batch(batch, out=out, layout='NCHW')
+    assert batch_out is out
+    np.testing.assert_array_equal(out[:4], expected.transpose(0, 3, 1, 2))
+    assert not np.any(out[4])
+
+    # single-channel images get a channel axis
+    p = ImageProcessor([ToPILImage('L'), Resize((100, 200)), Normalize()])
+    assert p.apply_batch(batch, dtype=np.float64).shape == (4, 100, 200, 1)
+
+    # the images must have the same shape
+    p = ImageProcessor([ToPILImage('RGB')])
+    with nose.tools.assert_raises_regexp(ValueError, r".*must have the same shape.*"):
+        p.apply_batch([test_input, np.zeros((10, 10, 3), dtype=np.uint8)])
+    with nose.tools.assert_raises(ValueError):
+        p.apply_batch([test_input], layout='HWC')
+
+
+def test_imageprocessor_profile():
+    """Test the per-transform profiles."""
+
+    transform_sequence = [ToPILImage('RGB'), Resize((100, 120)), PILtoarray(), Normalize()]
+    p = ImageProcessor(transform_sequence, profile=True)
+    for _ in range(3):
+        p.apply_transforms(test_input)
+    with nose.tools.assert_raises(TypeError):
+        p.apply_transforms(b'not an image')
+
+    summary = p.profile_summary()
+    assert summary['name'] == 'ToPILImage > Resize > PILtoarray > Normalize'
+    steps = summary['steps']
+    assert [s['transform'] for s in steps] == ['ToPILImage', 'Resize', 'PILtoarray', 'Normalize']
+    assert [(s['calls'], s['errors']) for s in steps] == [(4, 1), (3, 0), (3, 0), (3, 0)]
+    assert all(s['total_seconds'] > 0 and s['max_seconds'] >= s['mean_seconds'] for s in steps)
+    assert steps[0]['inputs'] == [{'shape': [len(test_input)], 'dtype': 'bytes', 'count': 3},
+                                  {'shape': [12], 'dtype': 'bytes', 'count': 1}]
+    assert steps[0]['outputs'] == [{'shape': [678, 1024, 3], 'dtype': 'PIL:RGB', 'count': 3}]
+    assert steps[1]['outputs'] == [{'shape': [100, 120, 3], 'dtype': 'PIL:RGB', 'count': 3}]
+    assert steps[3]['outputs'] == [{'shape': [100, 120, 3], 'dtype': '<f8', 'count': 3}]
+    assert steps[1]['bytes_allocated'] == 3 * 100 * 120 * 3
+    assert steps[3]['mean_bytes_allocated'] == 100 * 120 * 3 * 8
+
+    # Test the compiled pipeline, and that images wrapping an array do not count as allocations
+    p = ImageProcessor([ToPILImage('RGBA'), Resize((100, 120)), PILtoarray(), Normalize()], compile=True, profile='p')
+    p.apply_transforms(np.zeros((50, 60, 4), dtype=np.uint8))
+    summary = p.profile_summary()
+    assert summary['name'] == 'p'
+    assert [s['transform'] for s in summary['steps']] == ['ToPILImage', 'Resize', 'Normalize']
+    assert summary['steps'][0]['bytes_allocated'] == 0
+    p.profiler.reset()
+    assert p.profile_summary()['steps'] == []
+
+    assert ImageProcessor(transform_sequence).profile_summary() is None
+
+
+def test_buffer_pool():
+    """Test the reuse of arrays by the buffer pool."""
+
+    pool = BufferPool(max_bytes=500, max_per_key=2)
+    a = pool.acquire((10, 10), np.float32)
+    assert a.shape == (10, 10) and a.dtype == np.float32
+    pool.release(a)
+    assert pool.acquire((10, 10), np.float32) is a
+    assert pool.acquire((10, 10), np.float64) is not a
+    with pool.borrow((10, 10), np.float32) as b:
+        assert b is not a
+    assert pool.acquire((10, 10), np.float32) is b
+
+    # views are not reused, and the pool is bounded
+    pool.release(a[1:])
+    pool.release(a)
+    pool.release(np.empty((10, 10), dtype=np.float32))
+    assert pool.stats() == {'hits': 2, 'misses': 3, 'releases': 4, 'discards': 1, 'buffers': 1, 'bytes': 400}
+    pool.clear()
+    assert pool.stats()['buffers'] == 0
+
+    # the transforms take their outputs from the pool, and the intermediate arrays are handed back to it
+    pool = BufferPool()
+    p = ImageProcessor([ToPILImage('RGB'), Resize((100, 200)), Standardize(0, 255, dtype=np.float32, pool=pool),
+                        ToTensor('CHW', pool=pool)], pool=pool)
+    for _ in range(3):
+        img_out = p.apply_transforms(test_input)
+        pool.release(img_out)
+    assert pool.stats()['misses'] == 2
+    assert pool.stats()['hits'] == 4
+
+    batch_out = p.apply_batch([test_input, test_input])
+    assert batch_out.shape == (2, 3, 100, 200)
+    np.testing.assert_array_equal(batch_out[0], p.apply_transforms(test_input))
+    pool.release(batch_out)
+    assert p.apply_batch([test_input, test_input]) is batch_out
+
+    # the input of the pipeline is not handed to the pool
+    arr = np.zeros((100, 200, 3), dtype=np.float32)
+    ImageProcessor([Standardize(0, 1, dtype=np.float32, inplace=True), ToTensor()], pool=pool).apply_transforms(arr)
+    assert all(a is not arr for free in pool._free.values() for a in free)
+
+
+def test_thread_executor():
+    """Test the transformation of images in a pool of threads."""
+
+    executor = executors.ThreadExecutor(max_workers=3)
+    try:
+        pil_img = Image.open(io.BytesIO(test_input))
+        batch = [test_input, test_input_jpg, pil_img.convert('L'), np.array(pil_img)] * 2
+        transforms = [ToPILImage('RGB'), Resize((100, 200)), Rotate(30), PILtoarray()]
+        expected = ImageProcessor(transforms).apply_batch(batch)
+
+        # the results are in the order of the images
+        p = ImageProcessor(transforms, executor=executor)
+        np.testing.assert_array_equal(p.apply_batch(batch), expected)
+        np.testing.assert_array_equal(np.stack(p.map_transforms(batch)), expected)
+
+        # errors are reported for each image
+        results = p.map_transforms([test_input, b'not an image', np.zeros((5, 5, 5))], return_exceptions=True)
+        np.testing.assert_array_equal(results[0], expected[0])
+        assert isinstance(results[1], TypeError)
+        assert isinstance(results[2], TypeError)
+        with nose.tools.assert_raises(TypeError):
+            p.map_transforms([test_input, b'not an image', np.zeros((5, 5, 5))])
+        with nose.tools.assert_raises(TypeError):
+            p.apply_batch([test_input, b'not an image'])
+
+        # without an executor the images are transformed one after the other
+        results = ImageProcessor(transforms).map_transforms([b'not an image', test_input], return_exceptions=True)
+        assert isinstance(results[0], TypeError)
+        np.testing.assert_array_equal(results[1], expected[0])
+    finally:
+        executor.close()
+
+
+def test_process_executor():
+    """Test the transformation of images in worker processes."""
+
+    if executors.shared_memory is None:
+        raise unittest.SkipTest('shared memory requires Python 3.8 or later')
+    shm_dir = '/dev/shm'  # nosec - only listed, to check for leaked shared memory blocks
+    shm_before = set(os.listdir(shm_dir)) if os.path.isdir(shm_dir) else set()
+
+    executor = executors.ProcessExecutor(max_workers=2)
+    try:
+        pil_img = Image.open(io.BytesIO(test_input))
+        batch = [test_input, test_input_jpg, pil_img.convert('L'), np.array(pil_img)]
+        transforms = [ToPILImage('RGB'), Resize((100, 200)), ToTensor('CHW', mean=127, std=64, batch_axis=True)]
+        expected = ImageProcessor(transforms).apply_batch(batch)
+
+        p = ImageProcessor(transforms, executor=executor)
+        np.testing.assert_array_equal(p.apply_batch(batch), expected)
+        np.testing.assert_array_equal(np.concatenate(p.map_transforms(batch)), expected)
+
+        # images are returned in their mode
+        p = ImageProcessor([ToPILImage('L'), Resize((100, 200))], compile=True, executor=executor)
+        results = p.map_transforms(batch)
+        assert [img.mode for img in results] == ['L'] * 4
+        np.testing.assert_array_equal(np.array(results[0]), np.array(p.apply_transforms(batch[0])))
+
+        # errors are raised in the calling process, or reported for each image
+        with nose.tools.assert_raises_regexp(TypeError, r".*not suitable for the Pillow library.*"):
+            p.map_transforms([test_input, b'not an image', test_input])
+        results = p.map_transforms([test_input, b'not an image', test_input], return_exceptions=True)
+        assert isinstance(results[1], TypeError)
+        assert results[0].mode == results[2].mode == 'L'
+    finally:
+        executor.close()
+
+    # all the shared memory blocks are released
+    if os.path.isdir(shm_dir):
+        assert set(os.listdir(shm_dir)) <= shm_before
+
+    # the workers ask for the pipelines they do not know, and keep the most recently used ones
+    assert isinstance(executors._process_image('unknown', None, test_input), executors._UnknownSteps)
+    try:
+        for i in range(executors._WORKER_STEPS_MAX_SIZE + 1):
+            assert executors._process_image(str(i), pickle.dumps([]), b'image') == b'image'
+        assert len(executors._worker_steps) == executors._WORKER_STEPS_MAX_SIZE
+        assert '0' not in executors._worker_steps
+    finally:
+        executors._worker_steps.clear()
+
+
 def test_flask_error():
 
     # Test invalid input format
@@ -0,0 +1,280 @@
+#
+# Copyright 2018-2019 IBM Corp. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# Standard libs
+import io
+import threading
+import time
+
+# Dependencies
+import nose
+import numpy as np
+
+# The module to test
+from maxfw.model import MAXModelWrapper, BatchScheduler, PredictionCache
+from maxfw.model.cache import cache_key
+from maxfw.utils.metrics import Counter, Gauge, Histogram, Registry, STAGE_SECONDS
+
+
+class DoublingModel(MAXModelWrapper):
+
+    def __init__(self):
+        self.batch_sizes = []
+
+    def _predict(self, x):
+        return x * 2
+
+    def _predict_batch(self, xs):
+        self.batch_sizes.append(len(xs))
+        return [x * 2 for x in xs]
+
+
+class ScalingModel(MAXModelWrapper):
+
+    def _pre_process(self, x):
+        return np.asarray(x, dtype=np.float32)
+
+    def _predict(self, x):
+        return x * 10
+
+    def _post_process(self, x):
+        return float(x.sum())
+
+
+class VectorizedScalingModel(ScalingModel):
+
+    def _collate_batch(self, xs):
+        return np.stack(xs)
+
+    def _predict_batch(self, xs):
+        assert isinstance(xs, np.ndarray)
+        return xs * 10
+
+    def _post_process_batch(self, xs):
+        return xs.reshape(len(xs), -1).sum(axis=1).tolist()
+
+
+class BatchedDoublingModel(DoublingModel):
+    batch_max_size = 4
+    batch_max_wait = 0.05
+
+
+class BatchedVectorizedScalingModel(VectorizedScalingModel):
+    batch_max_size = 4
+    batch_max_wait = 0.05
+
+
+class CachedModel(MAXModelWrapper):
+    MODEL_META_DATA = {'id': 'cached-model'}
+    cache_max_bytes = 1024 * 1024
+
+    def __init__(self):
+        self.calls = 0
+
+    def _predict(self, x):
+        self.calls += 1
+        time.sleep(0.05)
+        return {'length': len(x.read() if hasattr(x, 'read') else x)}
+
+
+def _predict_concurrently(model, inputs):
+    results = [None] * len(inputs)
+
+    def worker(i):
+        results[i] = model.predict(inputs[i])
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(len(inputs))]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return results
+
+
+def test_predict_without_batching():
+    model = DoublingModel()
+    assert model.batch_scheduler is None
+    assert model.predict(3) == 6
+    assert model.batch_sizes == []
+
+
+def test_predict_with_batching():
+    model = BatchedDoublingModel()
+    inputs = list(range(10))
+    assert _predict_concurrently(model, inputs) == [x * 2 for x in inputs]
+
+    # every input was processed exactly once, in batches no larger than the maximum
+    assert sum(model.batch_sizes) == len(inputs)
+    assert max(model.batch_sizes) <= 4
+    assert len(model.batch_sizes) < len(inputs)
+
+    stats = model.batch_scheduler.stats()
+    assert stats['items'] == len(inputs)
+    assert stats['batches'] == len(model.batch_sizes)
+    assert stats['largest_batch'] == max(model.batch_sizes)
+    assert stats['queue_wait_max'] >= stats['queue_wait_mean'] >= 0
+
+
+def test_stage_metrics():
+    count, _ = STAGE_SECONDS.labels('predict_batch').get()
+    ScalingModel().predict_batch([[1], [2]])
+    assert STAGE_SECONDS.labels('predict_batch').get()[0] == count + 1
+
+
+def test_metrics_exposition():
+    registry = Registry()
+    counter = Counter('test_total', 'A counter', ['kind'], registry=registry)
+    gauge = Gauge('test_gauge', 'A gauge', registry=registry)
+    histogram = Histogram('test_seconds', 'A histogram', registry=registry, buckets=[0.1, 1])
+
+    counter.labels('a').inc()
+    counter.labels('a').inc(2)
+    gauge.set(5)
+    gauge.dec()
+    histogram.observe(0.05)
+    histogram.observe(0.5)
+    histogram.observe(5)
+
+    lines = registry.exposition().splitlines()
+    assert '# TYPE test_total counter' in lines
+    assert 'test_total{kind="a"} 3.0' in lines
+    assert 'test_gauge 4.0' in lines
+    assert 'test_seconds_bucket{le="0.1"} 1' in lines
+    assert 'test_seconds_bucket{le="1.0"} 2' in lines
+    assert 'test_seconds_bucket{le="+Inf"} 3' in lines
+    assert 'test_seconds_count 3' in lines
+
+    # the constant labels are added to every sample
+    registry.const_labels = (('worker', '42'),)
+    lines = registry.exposition().splitlines()
+    assert 'test_total{kind="a",worker="42"} 3.0' in lines
+    assert 'test_gauge{worker="42"} 4.0' in lines
+    assert 'test_seconds_bucket{worker="42",le="0.1"} 1' in lines
+    assert 'test_seconds_count{worker="42"} 3' in lines
+
+    with nose.tools.assert_raises(ValueError):
+        Counter('test_total', 'A duplicate', registry=registry)
+    with nose.tools.assert_raises(ValueError):
+        counter.labels('a').inc(-1)
+
+
+def test_predict_batch():
+    inputs = [[1, 2], [3, 4], [5, 6]]
+
+    # a model with only the per-item hooks falls back to them
+    model = ScalingModel()
+    assert model.predict_batch(inputs) == [model.predict(x) for x in inputs] == [30.0, 70.0, 110.0]
+
+    # a model with vectorized hooks processes the whole batch at once
+    model = VectorizedScalingModel()
+    assert model.predict_batch(inputs) == [30.0, 70.0, 110.0]
+
+    # the micro-batches of concurrent predictions are collated in the same way
+    model = BatchedVectorizedScalingModel()
+    assert _predict_concurrently(model, inputs) == [30.0, 70.0, 110.0]
+    assert model.batch_scheduler.stats()['items'] == len(inputs)
+
+
+def test_predict_with_cache():
+    model = CachedModel()
+    assert model.predict(b'abc') == {'length': 3}
+    assert model.predict(b'abc') == {'length': 3}
+    assert model.calls == 1
+
+    # concurrent requests for the same input share a single computation
+    assert _predict_concurrently(model, [b'abcd'] * 5) == [{'length': 4}] * 5
+    assert model.calls == 2
+
+    stats = model.prediction_cache.stats()
+    assert stats['hits'] + stats['coalesced'] == 5
+    assert stats['misses'] == 2
+    assert stats['entries'] == 2
+
+    # uploads in file objects are cached by their content
+    assert model.predict(io.BytesIO(b'abcde')) == model.predict(io.BytesIO(b'abcde'))
+    assert model.calls == 3
+    assert model.prediction_cache.stats()['hits'] + model.prediction_cache.stats()['coalesced'] == 6
+
+    # inputs that cannot be hashed by content bypass the cache
+    assert model.predict([1, 2]) == {'length': 2}
+    assert model.calls == 4
+
+
+def test_prediction_cache():
+    # the key depends on the content, the type and the namespace of the input
+    assert cache_key(b'abc', 'model', 1) == cache_key(bytearray(b'abc'), 'model', 1)
+    assert cache_key(b'abc', 'model', 1) != cache_key(b'abc', 'model', 2)
+    assert cache_key(np.zeros((2, 3))) != cache_key(np.zeros((3, 2)))
+    assert cache_key(np.zeros((2, 3))) == cache_key(np.zeros((3, 2)).T)
+    assert cache_key(object()) is None
+
+    # file objects are hashed like their content, and rewound
+    f = io.BytesIO(b'abc')
+    f.seek(2)
+    assert cache_key(f, 'model', 1) == cache_key(b'abc', 'model', 1)
+    assert f.tell() == 0
+    assert cache_key(io.StringIO('abc')) is None
+
+    # least recently used entries are evicted to stay within the byte budget
+    cache = PredictionCache(max_bytes=2500, ttl=None)
+    for i in range(3):
+        cache.get_or_compute(i, lambda: np.zeros(1000, dtype=np.uint8))
+    assert cache.stats()['evictions'] == 1
+    assert cache.stats()['bytes'] == 2000
+
+    cache.get_or_compute(1, lambda: None)
+    cache.get_or_compute(3, lambda: np.zeros(1000, dtype=np.uint8))
+    assert isinstance(cache.get_or_compute(1, lambda: 'recomputed'), np.ndarray)
+    assert cache.get_or_compute(2, lambda: 'recomputed') == 'recomputed'
+
+    # entries expire after the TTL
+    cache = PredictionCache(ttl=0.01)
+    cache.get_or_compute('key', lambda: 'value')
+    time.sleep(0.02)
+    assert cache.get_or_compute('key', lambda: 'new value') == 'new value'
+    assert cache.stats()['expirations'] == 1
+
+    # errors are not cached
+    def fail():
+        raise RuntimeError('inference failed')
+
+    with nose.tools.assert_raises(RuntimeError):
+        cache.get_or_compute('error', fail)
+    assert cache.get_or_compute('error', lambda: 'value') == 'value'
+
+
+def test_batch_scheduler_errors():
+    def fail(xs):
+        raise RuntimeError('inference failed')
+
+    scheduler = BatchScheduler(fail, max_batch_size=2, max_wait=0)
+    with nose.tools.assert_raises_regexp(RuntimeError, r".*inference failed.*"):
+        scheduler.submit(1)
+
+    # the batch function must return one result per input
+    scheduler = BatchScheduler(lambda xs: xs[:-1], max_batch_size=2, max_wait=0)
+    with nose.tools.assert_raises_regexp(ValueError, r".*returned 0 results for a batch of 1.*"):
+        scheduler.submit(1)
+
+    scheduler.close()
+    with nose.tools.assert_raises(RuntimeError):
+        scheduler.submit(1)
+
+    with nose.tools.assert_raises(ValueError):
+        BatchScheduler(fail, max_batch_size=0)
+
+
+if __name__ == '__main__':
+    nose.main()
@@ -0,0 +1,117 @@
+#
+# Copyright 2018-2019 IBM Corp. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+import threading
+from contextlib import contextmanager
+
+import numpy as np
+
+
+class BufferPool(object):
+    """A thread-safe pool of reusable NumPy arrays, keyed by shape and data type.
+
+    Arrays are borrowed with ``acquire`` and handed back with ``release`` once they are no longer used, so that
+    requests for arrays of the same shape reuse the same memory instead of allocating new arrays. Borrowed arrays
+    are not initialized. The pool only holds on to idle arrays up to the given limits; arrays that do not fit are
+    left to the garbage collector.
+
+    Example:
+        >>> pool = BufferPool()
+        >>> with pool.borrow((224, 224, 3), np.float32) as buf:
+        >>>     Standardize(mean, std, dtype=np.float32)(img, out=buf)
+
+    Args:
+        max_bytes (int): the maximum total size of the idle arrays held by the pool.
+        max_per_key (int): the maximum number of idle arrays held for each shape and data type.
+    """
+
+    def __init__(self, max_bytes=256 * 1024 * 1024, max_per_key=16):
+        self.max_bytes = max_bytes
+        self.max_per_key = max_per_key
+
+        self._free = {}  # (shape, dtype) -> list of idle arrays
+        self._lock = threading.Lock()
+        self._bytes = 0
+
+        # counters
+        self._hits = 0
+        self._misses = 0
+        self._releases = 0
+        self._discards = 0
+
+    def __getstate__(self):
+        # a copy of the pool, e.g. in a worker process, starts out empty
+        return {'max_bytes': self.max_bytes, 'max_per_key': self.max_per_key}
+
+    def __setstate__(self, state):
+        self.__init__(**state)
+
+    def acquire(self, shape, dtype=np.float64):
+        """Return an uninitialized array of the given shape and data type, reusing an idle array if possible."""
+        key = (tuple(shape), np.dtype(dtype))
+        with self._lock:
+            free = self._free.get(key)
+            if free:
+                arr = free.pop()
+                self._bytes -= arr.nbytes
+                self._hits += 1
+                return arr
+            self._misses += 1
+        return np.empty(key[0], dtype=key[1])
+
+    def release(self, arr):
+        """Hand an array back to the pool. It must not be used by the caller afterwards.
+
+        Only arrays that own their (contiguous) memory can be reused; other arrays, e.g. views, are ignored.
+        """
+        if not isinstance(arr, np.ndarray) or not arr.flags.owndata or not arr.flags.c_contiguous:
+            return
+        key = (arr.shape, arr.dtype)
+        with self._lock:
+            self._releases += 1
+            free = self._free.setdefault(key, [])
+            if len(free) >= self.max_per_key or self._bytes + arr.nbytes > self.max_bytes or \
+                    any(a is arr for a in free):
+                self._discards += 1
+                return
+            free.append(arr)
+            self._bytes += arr.nbytes
+
+    @contextmanager
+    def borrow(self, shape, dtype=np.float64):
+        """Context manager that acquires an array and releases it at the end of the block."""
+        arr = self.acquire(shape, dtype)
+        try:
+            yield arr
+        finally:
+            self.release(arr)
+
+    def clear(self):
+        """Drop all the idle arrays."""
+        with self._lock:
+            self._free.clear()
+            self._bytes = 0
+
+    def stats(self):
+        """Return a dictionary with the pool counters and the number and size of the idle arrays."""
+        with self._lock:
+            return {
+                'hits': self._hits,
+                'misses': self._misses,
+                'releases': self._releases,
+                'discards': self._discards,
+                'buffers': sum(len(free) for free in self._free.values()),
+                'bytes': self._bytes,
+            }
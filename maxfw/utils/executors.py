@@ -0,0 +1,248 @@
+#
+# Copyright 2018-2019 IBM Corp. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+"""Executors that run the transformations of an ``ImageProcessor`` on several images concurrently.
+
+``ThreadExecutor`` has the lowest overhead and suits pipelines dominated by Pillow, which releases the GIL.
+``ProcessExecutor`` also spreads the work that holds the GIL over several cores.
+
+Example:
+    >>> p = ImageProcessor([ToPILImage('RGB'), Resize((224, 224)), ToTensor('CHW')],
+    >>>                    executor=ProcessExecutor(max_workers=4))
+    >>> batch = p.apply_batch(images)
+"""
+import hashlib
+import os
+import pickle  # nosec - only used for objects created by this process and its workers
+import sys
+import threading
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+try:
+    from multiprocessing import resource_tracker, shared_memory
+except ImportError:  # Python < 3.8
+    resource_tracker = shared_memory = None
+
+import numpy as np
+from PIL import Image
+
+from .image_utils import _run
+
+# the modes of the PIL images that can be restored from their array representation
+_ARRAY_MODES = ('L', 'LA', 'RGB', 'RGBA', 'RGBX', 'CMYK', 'YCbCr', 'HSV', 'I', 'F')
+
+
+class _SharedArray(object):
+    """An array (or an image) that a worker process placed in a shared memory block for the parent process."""
+
+    __slots__ = ('name', 'shape', 'dtype', 'mode')
+
+    def __init__(self, name, shape, dtype, mode=None):
+        self.name = name
+        self.shape = shape
+        self.dtype = dtype
+        self.mode = mode
+
+    @classmethod
+    def export(cls, arr, mode=None):
+        if sys.version_info >= (3, 13):
+            shm = shared_memory.SharedMemory(create=True, size=arr.nbytes, track=False)
+        else:
+            shm = shared_memory.SharedMemory(create=True, size=arr.nbytes)
+            # the parent process unlinks the block once it has read the array
+            resource_tracker.unregister(shm._name, 'shared_memory')
+        try:
+            np.ndarray(arr.shape, dtype=arr.dtype, buffer=shm.buf)[...] = arr
+        except BaseException:
+            shm.close()
+            shm.unlink()
+            raise
+        shm.close()
+        return cls(shm.name, arr.shape, arr.dtype.str, mode)
+
+    def load(self):
+        """Copy the array out of the shared memory block, and release the block."""
+        shm = shared_memory.SharedMemory(name=self.name)
+        try:
+            arr = np.ndarray(self.shape, dtype=self.dtype, buffer=shm.buf).copy()
+        finally:
+            shm.close()
+            shm.unlink()
+        return arr if self.mode is None else Image.fromarray(arr, mode=self.mode)
+
+
+def _export(result):
+    """Move a transformed image into shared memory, if it is an array or an image that can be restored from one."""
+    if isinstance(result, Image.Image) and result.mode in _ARRAY_MODES:
+        arr = np.asarray(result)
+        if arr.nbytes:
+            return _SharedArray.export(arr, result.mode)
+    elif isinstance(result, np.ndarray) and result.dtype != object and result.nbytes:
+        return _SharedArray.export(result)
+    return result
+
+
+def _read(img):
+    """Read encoded images passed as file objects, which cannot be sent to a worker process."""
+    if hasattr(img, 'read') and hasattr(img, 'seek'):
+        img.seek(0)
+        return img.read()
+    return img
+
+
+def _import(result):
+    return result.load() if isinstance(result, _SharedArray) else result
+
+
+# the pipelines known to a worker process, by the digest of their pickled form (the least recently used are dropped)
+_worker_steps = OrderedDict()
+_WORKER_STEPS_MAX_SIZE = 16
+
+
+class _UnknownSteps(object):
+    """Returned by a worker that was sent the key of a pipeline it does not know, instead of the pipeline."""
+
+
+def _process_image(key, payload, img):
+    steps = _worker_steps.get(key)
+    if steps is not None:
+        _worker_steps.move_to_end(key)
+    elif payload is None:
+        return _UnknownSteps()
+    else:
+        steps = _worker_steps[key] = pickle.loads(payload)  # nosec - pickled by the parent process
+        if len(_worker_steps) > _WORKER_STEPS_MAX_SIZE:
+            _worker_steps.popitem(last=False)
+    return _export(_run(steps, img))
+
+
+class _Executor(object):
+    """Base class of the executors, holding a pool of workers that is created on first use in each process."""
+
+    def __init__(self, max_workers=None):
+        self.max_workers = max_workers
+        self._executor = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def map(self, steps, images, return_exceptions=False):
+        """Apply the `steps` to each of the `images` and return the list of results, in order.
+
+        When `return_exceptions` is set, the exception raised for an image is returned in place of its result.
+        Otherwise the first exception (in the order of the images) is raised once all the images are done.
+        """
+        futures = self._submit(self._get_executor(), steps, images)
+        results = []
+        error = None
+        for future in futures:
+            # wait for every image, so that nothing is left running (or behind) when an image fails
+            try:
+                result = self._result(future)
+            except Exception as e:
+                result = e
+                error = error or e
+            results.append(result)
+        if error is not None and not return_exceptions:
+            raise error
+        return results
+
+    def close(self):
+        """Shut down the workers."""
+        with self._lock:
+            if self._executor is not None and self._pid == os.getpid():
+                self._executor.shutdown()
+            self._executor = None
+
+    def _get_executor(self):
+        with self._lock:
+            # a pool inherited from the parent of a forked process cannot be used
+            if self._executor is None or self._pid != os.getpid():
+                self._executor = self._create_executor()
+                self._pid = os.getpid()
+            return self._executor
+
+    def _create_executor(self):
+        raise NotImplementedError()
+
+    def _submit(self, executor, steps, images):
+        raise NotImplementedError()
+
+    def _result(self, future):
+        return future.result()
+
+
+class ThreadExecutor(_Executor):
+    """Runs the transformations of several images at the same time in a pool of threads.
+
+    Pillow releases the GIL while it decodes, resizes and converts images, so these steps run in parallel without
+    the overhead of worker processes. Steps that hold the GIL (e.g. NumPy code on small arrays) are not sped up.
+
+    Args:
+        max_workers (int, optional): the number of threads. Defaults to the default of
+            ``concurrent.futures.ThreadPoolExecutor``.
+    """
+
+    def _create_executor(self):
+        return ThreadPoolExecutor(self.max_workers, thread_name_prefix='maxfw-transforms')
+
+    def _submit(self, executor, steps, images):
+        steps = list(steps)
+        return [executor.submit(_run, steps, img) for img in images]
+
+
+class ProcessExecutor(_Executor):
+    """Runs the transformations in a pool of worker processes, so that they are not limited by the GIL.
+
+    The (encoded) images are sent to the workers, and the transformed arrays and images are returned through
+    shared memory instead of being pickled. PIL images are returned as copies in the same mode; results of other
+    types (e.g. palette images) are pickled. Images in file objects are read before they are sent. The
+    transformations must be picklable; they are sent to each worker once, and afterwards referred to by the digest
+    of their pickled form. The pool of processes is started on first use, once per server process.
+
+    Args:
+        max_workers (int, optional): the number of worker processes. Defaults to the number of CPUs.
+        mp_context (optional): the multiprocessing context used to start the workers.
+    """
+
+    def __init__(self, max_workers=None, mp_context=None):
+        if shared_memory is None:
+            raise RuntimeError('ProcessExecutor requires Python 3.8 or later.')
+        super().__init__(max_workers)
+        self.mp_context = mp_context
+        self._sent = set()  # the keys of the pipelines sent to the workers of the pool
+
+    def _create_executor(self):
+        self._sent = set()
+        return ProcessPoolExecutor(self.max_workers, mp_context=self.mp_context)
+
+    def _submit(self, executor, steps, images):
+        payload = pickle.dumps(list(steps), protocol=pickle.HIGHEST_PROTOCOL)
+        key = hashlib.blake2b(payload, digest_size=16).hexdigest()
+        tasks = []
+        for img in images:
+            img = _read(img)
+            # the pipeline goes along with the first image only, the images of workers that miss it are resubmitted
+            sent = key in self._sent
+            self._sent.add(key)
+            tasks.append((executor.submit(_process_image, key, None if sent else payload, img), key, payload, img))
+        return tasks
+
+    def _result(self, task):
+        future, key, payload, img = task
+        result = future.result()
+        if isinstance(result, _UnknownSteps):
+            result = self._get_executor().submit(_process_image, key, payload, img).result()
+        return _import(result)
@@ -16,10 +16,12 @@
 from __future__ import division
 import sys
 import io
+import math
 import numbers
 import collections
+from functools import lru_cache
 
-from PIL import Image, ImageEnhance
+from PIL import Image, ImageEnhance, ImageFilter
 import numpy as np
 
 if sys.version_info < (3, 3):
@@ -38,19 +40,99 @@ def _is_numpy_image(img):
     return isinstance(img, np.ndarray) and (img.ndim in {2, 3})
 
 
-def to_pil_image(pic, target_mode, mode=None):
+class ImageTooLargeError(ValueError):
+    """Raised when an encoded image exceeds the configured byte or pixel limits."""
+
+
+ImageInfo = collections.namedtuple('ImageInfo', ['format', 'width', 'height', 'mode', 'frames'])
+
+
+def probe_image(pic, max_pixels=None, max_bytes=None):
+    """Read the format, dimensions, mode and number of frames of an encoded image from its header, without
+    decoding the pixels.
+
+    Args:
+        pic (bytes, bytearray or binary file object): the encoded image. The position of a file object is restored
+            afterwards, so that it can be decoded next.
+        max_pixels (int): raise an ``ImageTooLargeError`` if the image has more pixels than this (optional).
+        max_bytes (int): raise an ``ImageTooLargeError`` if the encoded image is larger than this (optional).
+
+    Returns:
+        ImageInfo: a named tuple with the fields ``format``, ``width``, ``height``, ``mode`` and ``frames``.
+    """
+    if not _is_encoded_image(pic):
+        raise TypeError('pic should be bytes or a binary file object. Got {}.'.format(type(pic)))
+    position = None if isinstance(pic, (bytes, bytearray)) else pic.tell()
+    try:
+        img = _open(pic, max_bytes)
+        _check_pixels(img, max_pixels)
+        return ImageInfo(img.format, img.width, img.height, img.mode, getattr(img, 'n_frames', 1))
+    finally:
+        if position is not None:
+            pic.seek(position)
+
+
+def _is_encoded_image(pic):
+    return isinstance(pic, (bytes, bytearray)) or (hasattr(pic, 'read') and hasattr(pic, 'seek'))
+
+
+def _open(pic, max_bytes=None):
+    """Open an encoded image, which only reads its header. Images in file objects are decoded from the file (e.g. an
+    upload spooled to disk), without a copy of its contents in memory."""
+    if isinstance(pic, (bytes, bytearray)):
+        size = len(pic)
+        pic = io.BytesIO(pic)
+    else:
+        # Pillow reads the image from the start of the file
+        size = pic.seek(0, io.SEEK_END)
+    if max_bytes is not None and size > max_bytes:
+        raise ImageTooLargeError('The image is {} bytes large, which exceeds the limit of {} bytes.'
+                                 .format(size, max_bytes))
+    try:
+        return Image.open(pic)
+    except Image.DecompressionBombError as e:
+        raise ImageTooLargeError(str(e))
+    except Exception:
+        raise TypeError('The input bytes object is not suitable for the Pillow library. Check the input again.')
+
+
+def _check_pixels(img, max_pixels):
+    if max_pixels is not None and img.width * img.height > max_pixels:
+        raise ImageTooLargeError('The image has {}x{} pixels, which exceeds the limit of {} pixels.'
+                                 .format(img.width, img.height, max_pixels))
+
+
+def to_pil_image(pic, target_mode, mode=None, draft_size=None, max_pixels=None, max_bytes=None):
     """Convert an ndarray to PIL Image.
 
+    Encoded images are decoded straight into `target_mode`, without a round trip through NumPy. A uint8 ndarray
+    that already matches `target_mode` (e.g. 'L' or 'RGBA') is wrapped without copying its pixels, in which case
+    the returned image shares its memory with `pic`.
+
     Args:
-        pic (io.BytesIO or numpy.ndarray): Image to be converted to PIL Image.
+        pic (bytes, binary file object, numpy.ndarray or PIL Image): Image to be converted to PIL Image. Encoded
+            images can be passed as file objects (e.g. an uploaded ``FileStorage``), which are decoded directly
+            from the file instead of from a copy of its contents in memory.
         mode (`PIL.Image mode`_): color space and pixel depth of input data (optional).
+        draft_size (sequence or int): the size the image will be resized to later on (optional), using the
+            conventions of ``resize``. JPEG images are then decoded at the smallest scale (1/2, 1/4 or 1/8) that
+            still yields an image of at least this size, which is considerably faster than a full decode.
+        max_pixels (int): the maximum number of pixels of the decoded image (optional). The size of an encoded
+            image is read from its header, so that an ``ImageTooLargeError`` is raised before anything is decoded.
+            The limit applies to the reduced size of JPEG images decoded with a `draft_size`.
+        max_bytes (int): the maximum size of an encoded image in bytes (optional).
 
     .. _PIL.Image mode: https://pillow.readthedocs.io/en/latest/handbook/concepts.html#concept-modes
 
     Returns:
         PIL Image: Image converted to PIL Image.
     """
-    if not isinstance(pic, (bytes, bytearray)) and not(isinstance(pic, np.ndarray)):
+    if _is_pil_image(pic):
+        # the image is decoded already, only its mode may have to be converted
+        _check_target_mode(target_mode)
+        return _convert(pic, target_mode)
+
+    if not _is_encoded_image(pic) and not(isinstance(pic, np.ndarray)):
         # if the object is not bytes, and it's not a ndarray
         raise TypeError('pic should be bytes or ndarray. Got {}.'.format(type(pic)))
 
@@ -62,12 +144,26 @@ def to_pil_image(pic, target_mode, mode=None):
             # if 2D image, add channel dimension (HWC)
             pic = np.expand_dims(pic, 2)
 
-    elif isinstance(pic, (bytes, bytearray)):
+    else:
+        _check_target_mode(target_mode)
+        img = _open(pic, max_bytes)
+        if draft_size is not None:
+            _draft(img, target_mode, draft_size)
+        _check_pixels(img, max_pixels)
         try:
             # verify that the object can be loaded into memory
-            pic = np.array(Image.open(io.BytesIO(pic)))
+            img.load()
         except Exception:
             raise TypeError('The input bytes object is not suitable for the Pillow library. Check the input again.')
+        if mode is None:
+            # decode straight into the target mode
+            return _convert(img, target_mode)
+
+        # the caller asserts the layout of the decoded pixels, which is validated on their array representation
+        pic = np.array(img)
+        if pic.ndim == 2:
+            # single-channel images are decoded without a channel dimension
+            pic = np.expand_dims(pic, 2)
 
     npimg = pic
     if not isinstance(npimg, np.ndarray):
@@ -115,11 +211,30 @@ def to_pil_image(pic, target_mode, mode=None):
     if mode is None:
         raise TypeError('Input type {} is not supported'.format(npimg.dtype))
 
+    _check_target_mode(target_mode)
+
+    # `fromarray` wraps the array's buffer where Pillow allows it, and `convert` always copies
+    return _convert(Image.fromarray(npimg, mode=mode), target_mode)
+
+
+def _check_target_mode(target_mode):
     # Verify that the target mode exists
     if target_mode not in [1, 'L', 'P', 'RGB', 'RGBA', 'CMYK', 'YCbCr', 'LAB', 'HSV', 'I', 'F', 'RGBX', 'RGBBa']:
         raise ValueError("invalid target_mode: %r" % target_mode)
 
-    return Image.fromarray(npimg, mode=mode).convert(target_mode)
+
+def _convert(img, target_mode):
+    return img if img.mode == target_mode else img.convert(target_mode)
+
+
+def _draft(img, target_mode, size):
+    """Configure the decoder of `img` (only JPEG decoders support this) to decode a reduced version of the image
+    that is at least as large as `size`, as given to ``resize``."""
+    if isinstance(size, int):
+        requested_size = (size, size)
+    else:
+        requested_size = tuple(size[::-1])
+    img.draft('L' if target_mode == 'L' else None, requested_size)
 
 
 def pil_to_array(pic):
@@ -128,17 +243,38 @@ def pil_to_array(pic):
     return np.array(pic)
 
 
-def normalize(img):
+def normalize(img, out=None):
     if type(img) is not np.ndarray:
         img = np.array(img)
-    return img / (np.max(img) - np.min(img))
+    return np.divide(img, np.max(img) - np.min(img), out=out)
+
 
+def standardize(img, mean=None, std=None, dtype=np.float64, out=None):
+    """Standardize an image (mean-centering and STD of 1) with a single multiply-add per pixel.
 
-def standardize(img, mean=None, std=None):
+    Args:
+        img (PIL Image or numpy.ndarray): Image to be standardized.
+        mean (optional): a single number or an n-dimensional sequence with n equal to the number of image channels
+        std (optional): a single number or an n-dimensional sequence with n equal to the number of image channels
+        dtype (numpy dtype): the data type of the result, e.g. ``np.float32`` (ignored when `out` is given).
+        out (numpy.ndarray, optional): an array of the image's shape to write the result into. It may be `img`
+            itself to standardize a floating point image in place.
+
+    Returns:
+        numpy.ndarray: Standardized image.
+    """
+    scale, offset = standardize_params(img, mean, std)
+    return scale_offset(img, scale, offset, dtype=dtype, out=out)
+
+
+def standardize_params(img, mean=None, std=None):
+    """Return the `scale` and `offset` that standardize `img` as ``img * scale + offset``.
+
+    The result only depends on the number of channels of `img`, unless `mean` or `std` are computed from the image.
+    Both are float64 arrays that broadcast over the last axis of the image.
+    """
     # ensure we are working with a numpy ndarray
-    if type(img) is not np.ndarray:
-        img = np.array(img)
-    img = img.astype(np.float64)
+    img = np.asarray(img)
 
     # check whether the image has channels
     if img.ndim == 3:
@@ -152,17 +288,17 @@ def standardize(img, mean=None, std=None):
 
         if mean is None:
             # calculate channel-wise mean
-            mean = np.mean(img, axis=(0, 1), keepdims=True)
+            mean = np.mean(img, axis=(0, 1))
         elif isinstance(mean, (int, float)):
             # convert the number to an array
-            mean = np.array([mean] * channels).reshape((1, 1, channels))
+            mean = np.full((channels,), mean, dtype=np.float64)
         elif isinstance(mean, Sequence):
             # convert a sequence to the right dimensions
             if any(not isinstance(x, (int, float)) for x in mean):
                 raise ValueError('The sequence `mean` can only contain numbers.')
             if len(mean) != channels:
                 raise ValueError('The size of the `mean` array must correspond to the number of channels in the image.')
-            mean = np.array(mean).reshape((1, 1, channels))
+            mean = np.array(mean, dtype=np.float64)
         else:
             # if the mean is not a number or a sequence
             raise TypeError('`Mean` should either be a number or an n-dimensional vector of numbers '
@@ -170,33 +306,22 @@ def standardize(img, mean=None, std=None):
 
         if std is None:
             # calculate channel-wise std
-            std = np.std(img, axis=(0, 1)).reshape((channels,))
+            std = np.std(img, axis=(0, 1))
         elif isinstance(std, (int, float)):
             # convert the number to an array
-            std = np.array([std] * channels).reshape((channels,))
+            std = np.full((channels,), std, dtype=np.float64)
         elif isinstance(std, Sequence):
             # convert a sequence to the right dimensions
             if any(not isinstance(x, (int, float)) for x in std):
                 raise ValueError('The sequence `std` can only contain numbers.')
             if len(std) != channels:
                 raise ValueError('The size of the `std` array must correspond to the number of channels in the image.')
-            std = np.array(std).reshape((channels,))
+            std = np.array(std, dtype=np.float64)
         else:
             # if the std is not a number or a sequence
             raise TypeError('`std` should either be a number or an n-dimensional vector '
                             'of numbers with n equal to the number of image channels.')
 
-        # return the standardized array
-        # a. mean center
-        img_mean_centered = (img - mean).astype(np.float64)
-
-        # b. channel-wise division by std
-        for c in range(channels):
-            if std[c] != 0:
-                img_mean_centered[..., c] = img_mean_centered[..., c] / std[c]
-
-        return img_mean_centered
-
     else:
         # (this image has no channels)
         if mean is None:
@@ -219,10 +344,36 @@ def standardize(img, mean=None, std=None):
             raise ValueError('The value for `std` should be a number or `None` '
                              'when working with single-channel images.')
 
-        if std != 0:
-            return (img-mean)/std
-        else:
-            return img-mean
+    # channels with a std of 0 are only mean-centered
+    std = np.asarray(std, dtype=np.float64)
+    scale = 1.0 / np.where(std != 0, std, 1.0)
+    offset = -np.asarray(mean, dtype=np.float64) * scale
+    return scale, offset
+
+
+def scale_offset(img, scale, offset, dtype=np.float64, out=None):
+    """Compute ``img * scale + offset`` in `dtype`, without intermediate copies of the image.
+
+    Args:
+        img (PIL Image or numpy.ndarray): input image.
+        scale, offset (number or numpy.ndarray): values that broadcast over the image, e.g. one per channel.
+        dtype (numpy dtype): the data type of the result (ignored when `out` is given).
+        out (numpy.ndarray, optional): an array of the image's shape to write the result into, which may be `img`.
+
+    Returns:
+        numpy.ndarray: the transformed image.
+    """
+    img = np.asarray(img)
+    if out is None:
+        out = np.empty(img.shape, dtype=dtype)
+    elif out.shape != img.shape:
+        raise ValueError('The output array should have the shape of the image {}. Got {}.'.format(img.shape, out.shape))
+    # compute in the precision of the output, casting the parameters once instead of per pixel
+    scale = np.asarray(scale, dtype=out.dtype)
+    offset = np.asarray(offset, dtype=out.dtype)
+    np.multiply(img, scale, out=out)
+    np.add(out, offset, out=out)
+    return out
 
 
 def resize(img, size, interpolation=Image.BILINEAR):
@@ -250,16 +401,21 @@ def resize(img, size, interpolation=Image.BILINEAR):
         w, h = img.size
         if (w <= h and w == size) or (h <= w and h == size):
             return img
+    return img.resize(resize_output_size(img.size, size), interpolation)
+
+
+def resize_output_size(img_size, size):
+    """Return the (width, height) of an image of size `img_size` (width, height) after `resize` to `size`."""
+    if isinstance(size, int):
+        w, h = img_size
+        if (w <= h and w == size) or (h <= w and h == size):
+            return w, h
         if w < h:
-            ow = size
-            oh = int(size * h / w)
-            return img.resize((ow, oh), interpolation)
+            return size, int(size * h / w)
         else:
-            oh = size
-            ow = int(size * w / h)
-            return img.resize((ow, oh), interpolation)
+            return int(size * w / h), size
     else:
-        return img.resize(size[::-1], interpolation)
+        return tuple(size[::-1])
 
 
 def crop(img, i, j, h, w):
@@ -358,6 +514,9 @@ def adjust_brightness(img, brightness_factor):
     if not _is_pil_image(img):
         raise TypeError('img should be PIL Image. Got {}'.format(type(img)))
 
+    if img.mode in _POINT_MODES:
+        return adjust_points(img, [('brightness', brightness_factor)])
+
     enhancer = ImageEnhance.Brightness(img)
     img = enhancer.enhance(brightness_factor)
     return img
@@ -378,6 +537,9 @@ def adjust_contrast(img, contrast_factor):
     if not _is_pil_image(img):
         raise TypeError('img should be PIL Image. Got {}'.format(type(img)))
 
+    if img.mode in _POINT_MODES:
+        return adjust_points(img, [('contrast', contrast_factor)])
+
     enhancer = ImageEnhance.Contrast(img)
     img = enhancer.enhance(contrast_factor)
     return img
@@ -403,7 +565,7 @@ def adjust_saturation(img, saturation_factor):
     return img
 
 
-def adjust_hue(img, hue_factor):
+def adjust_hue(img, hue_factor, approximate=False):
     """Adjust hue of an image.
 
     The image hue is adjusted by converting the image to HSV and
@@ -424,6 +586,12 @@ def adjust_hue(img, hue_factor):
             HSV space in positive and negative direction respectively.
             0 means no shift. Therefore, both -0.5 and 0.5 will give an image
             with complementary colors while 0 gives the original image.
+        approximate (bool): for ``RGB`` and ``RGBA`` images, map the colours with a precomputed 3D lookup table
+            in a single pass, which is about twice as fast. The result then differs from the exact one by less
+            than 0.5 intensity levels on average, and by at most 10 levels.
+
+    Images in the modes ``RGB`` and ``RGBA`` keep their alpha channel, and their hue channel is shifted with a
+    lookup table while the image is in HSV mode.
 
     Returns:
         PIL Image: Hue adjusted image.
@@ -438,18 +606,50 @@ def adjust_hue(img, hue_factor):
     if input_mode in {'L', '1', 'I', 'F'}:
         return img
 
+    # uint8 addition takes care of rotation across boundaries
+    shift = int(hue_factor * 255) % 256
+
+    if input_mode in ('RGB', 'RGBA'):
+        if approximate:
+            return img.filter(_hue_color_lut(shift))
+        out = img.convert('HSV').point(_hue_lut(shift)).convert('RGB')
+        if input_mode == 'RGBA':
+            out.putalpha(img.getchannel('A'))
+        return out
+
     h, s, v = img.convert('HSV').split()
 
     np_h = np.array(h, dtype=np.uint8)
-    # uint8 addition take cares of rotation across boundaries
-    with np.errstate(over='ignore'):
-        np_h += np.uint8(hue_factor * 255)
+    np_h += np.uint8(shift)
     h = Image.fromarray(np_h, 'L')
 
     img = Image.merge('HSV', (h, s, v)).convert(input_mode)
     return img
 
 
+@lru_cache(maxsize=256)
+def _hue_lut(shift):
+    """The lookup table that shifts the hue band of an HSV image."""
+    return tuple((v + shift) % 256 for v in range(256)) + _IDENTITY_LUT * 2
+
+
+# the size of the 3D lookup tables of `adjust_hue`; 255 is a multiple of (size - 1), so that the nodes of the
+# table are exact colours
+_HUE_COLOR_LUT_SIZE = 52
+
+
+@lru_cache(maxsize=32)
+def _hue_color_lut(shift):
+    """A 3D lookup table that maps RGB colours to the colours with the given shift of their hue."""
+    size = _HUE_COLOR_LUT_SIZE
+    nodes = np.arange(size, dtype=np.uint8) * (255 // (size - 1))
+    # the red index varies fastest in the table
+    b, g, r = np.meshgrid(nodes, nodes, nodes, indexing='ij')
+    grid = Image.fromarray(np.stack([r, g, b], axis=-1).reshape(1, -1, 3))
+    table = np.asarray(grid.convert('HSV').point(_hue_lut(shift)).convert('RGB'), dtype=np.float64) / 255
+    return ImageFilter.Color3DLUT(size, table.reshape(-1), channels=3)
+
+
 def adjust_gamma(img, gamma, gain=1):
     r"""Perform gamma correction on an image.
 
@@ -469,6 +669,9 @@ def adjust_gamma(img, gamma, gain=1):
             gamma larger than 1 make the shadows darker,
             while gamma smaller than 1 make dark regions lighter.
         gain (float): The constant multiplier.
+
+    Images in the modes ``L``, ``LA``, ``RGB`` and ``RGBA`` are adjusted in their own mode, and their alpha channel
+    is left as it is.
     """
     if not _is_pil_image(img):
         raise TypeError('img should be PIL Image. Got {}'.format(type(img)))
@@ -476,6 +679,9 @@ def adjust_gamma(img, gamma, gain=1):
     if gamma < 0:
         raise ValueError('Gamma should be a non-negative real number')
 
+    if img.mode in _POINT_MODES:
+        return adjust_points(img, [('gamma', gamma, gain)])
+
     input_mode = img.mode
     img = img.convert('RGB')
 
@@ -486,6 +692,89 @@ def adjust_gamma(img, gamma, gain=1):
     return img
 
 
+# the modes that point-wise adjustments are applied in directly, with their number of colour bands (the other
+# band is the alpha channel, which is not adjusted)
+_POINT_MODES = {'L': 1, 'LA': 1, 'RGB': 3, 'RGBA': 3}
+_IDENTITY_LUT = tuple(range(256))
+_ADJUSTMENTS = {'brightness': adjust_brightness, 'contrast': adjust_contrast, 'gamma': adjust_gamma}
+
+
+def adjust_points(img, adjustments):
+    """Apply a sequence of point-wise adjustments to an image with a single lookup per pixel.
+
+    The lookup tables of the adjustments are composed into one table, which is applied with a single call of
+    ``Image.point``. The result is the same as applying ``adjust_brightness``, ``adjust_contrast`` and
+    ``adjust_gamma`` one after the other.
+
+    Args:
+        img (PIL Image): PIL Image to be adjusted.
+        adjustments (sequence): the adjustments, in order, each given as ``('brightness', brightness_factor)``,
+            ``('contrast', contrast_factor)`` or ``('gamma', gamma, gain)``.
+
+    Returns:
+        PIL Image: Adjusted image.
+    """
+    if not _is_pil_image(img):
+        raise TypeError('img should be PIL Image. Got {}'.format(type(img)))
+
+    if img.mode not in _POINT_MODES:
+        # other modes are adjusted one step at a time
+        for name, *args in adjustments:
+            img = _ADJUSTMENTS[name](img, *args)
+        return img
+
+    lut = _IDENTITY_LUT
+    for name, *args in adjustments:
+        if name == 'brightness':
+            step = _blend_lut(0, float(args[0]))
+        elif name == 'contrast':
+            if lut is not _IDENTITY_LUT and img.mode not in ('L', 'LA'):
+                # the mean intensity of a colour image depends on the adjustments so far
+                img = _point(img, lut)
+                lut = _IDENTITY_LUT
+            step = _blend_lut(_mean_intensity(img, lut), float(args[0]))
+        elif name == 'gamma':
+            gamma, gain = (args + [1])[:2]
+            if gamma < 0:
+                raise ValueError('Gamma should be a non-negative real number')
+            step = _gamma_lut(float(gamma), float(gain))
+        else:
+            raise ValueError('Unknown adjustment: {}'.format(name))
+        lut = tuple(step[v] for v in lut)
+    return _point(img, lut)
+
+
+@lru_cache(maxsize=1024)
+def _blend_lut(value, factor):
+    """The lookup table of ``Image.blend`` of a constant image of the given `value` and an image, as used by
+    ``ImageEnhance`` (the computation is done in single precision and truncated, like Pillow does)."""
+    v = np.arange(256, dtype=np.float32)
+    out = np.float32(value) + np.float32(factor) * (v - np.float32(value))
+    return tuple(np.clip(out, 0, 255).astype(np.uint8).tolist())
+
+
+@lru_cache(maxsize=256)
+def _gamma_lut(gamma, gain):
+    return tuple(min(max(int(round(255 * gain * pow(v / 255., gamma))), 0), 255) for v in range(256))
+
+
+def _mean_intensity(img, lut):
+    """The mean intensity, rounded like ``ImageEnhance.Contrast`` does, of `img` after applying `lut` to it
+    (which must be the identity for colour images)."""
+    if img.mode in ('L', 'LA'):
+        hist = img.histogram()[:256]
+    else:
+        hist = img.convert('L').histogram()
+    count = sum(hist)
+    mean = sum(lut[v] * n for v, n in enumerate(hist)) / count if count else 0
+    return int(mean + 0.5)
+
+
+def _point(img, lut):
+    colour_bands = _POINT_MODES[img.mode]
+    return img.point(lut * colour_bands + _IDENTITY_LUT * (len(img.getbands()) - colour_bands))
+
+
 def rotate(img, angle, resample=False, expand=False, center=None):
     """Rotate the image by angle.
 
@@ -516,6 +805,16 @@ def rotate(img, angle, resample=False, expand=False, center=None):
     return img.rotate(angle, resample, expand, center)
 
 
+def rotation_matrix(img_size, angle):
+    """Return the affine mapping (as used by ``PIL.Image.transform``) from output to input coordinates of
+    `rotate` for an image of size `img_size` (width, height), rotated around its center."""
+    w, h = img_size
+    cx, cy = w / 2., h / 2.
+    angle = -math.radians(angle % 360.)
+    a, b, d, e = math.cos(angle), math.sin(angle), -math.sin(angle), math.cos(angle)
+    return a, b, cx - a * cx - b * cy, d, e, cy - d * cx - e * cy
+
+
 def to_grayscale(img, num_output_channels=1):
     """Convert image to grayscale version of image.
 
@@ -17,8 +17,14 @@ from __future__ import division
 import sys
 from PIL import Image
 import collections
+import os
+from contextlib import nullcontext
+import numpy as np
 
 from . import image_functions as F
+from .metrics import stage_timer
+from .profiling import TransformProfiler
+from .image_functions import ImageInfo, ImageTooLargeError, probe_image  # noqa: F401
 
 if sys.version_info < (3, 3):
     Sequence = collections.Sequence
@@ -33,6 +39,17 @@ class ImageProcessor(object):
 
     Args:
         transforms (list of ``Transform`` objects): sequence of transforms to compose.
+        compile (bool): validate and optimize the pipeline once, when the processor is created (see below).
+        pool (BufferPool, optional): a pool that the intermediate arrays of the pipeline are handed back to, and
+            that ``apply_batch`` takes its output arrays from. The transforms should then not keep references to
+            the arrays they return. Give the same pool to the ``Normalize``, ``Standardize`` or ``ToTensor``
+            transforms to make them take their output arrays from it.
+        executor (optional): an executor from ``maxfw.utils.executors`` that ``map_transforms`` and
+            ``apply_batch`` use to transform several images concurrently, i.e. ``ThreadExecutor`` or
+            ``ProcessExecutor``.
+        profile (bool or str): record the time, the input and output shapes and data types, and the allocations of
+            each transformation (see ``profile_summary``). A string is used as the name of the profile. Defaults to
+            the `MAX_PROFILE_TRANSFORMS` environment variable being set to `true`.
 
     Example:
         >>> pipeline = ImageProcessor([
@@ -40,11 +57,31 @@ class ImageProcessor(object):
         >>>     Resize([100,100])
         >>> ])
         >>> pipeline.apply_transforms(img)
+
+    When `compile` is set, the sequence of transforms is rewritten into a cheaper sequence with the same result
+    (up to rounding and resampling differences):
+        - a ``Grayscale`` conversion is moved in front of the resizes and rotations that precede it, and merged
+          into the decoding of the image by ``ToPILImage`` where possible,
+        - consecutive resizes are merged into a single resize when the last one has an explicit output size,
+        - resizes and (at most one) rotation in a row are merged into a single affine resampling of the image
+          reduced by an integer factor, when they downscale the image at least twofold,
+        - consecutive ``AdjustBrightness``, ``AdjustContrast`` and ``AdjustGamma`` transforms are merged into a
+          single lookup table per pixel,
+        - a bilinear (or box) resize that shrinks the image is applied before the
+          ``AdjustBrightness`` and ``AdjustContrast`` transforms by factors up to 1 that precede it,
+        - a ``PILtoarray`` conversion in front of ``Normalize``, ``Standardize`` or ``ToTensor`` is merged into them.
+    The transforms should not be modified after the processor has been created in this mode.
     """
 
-    def __init__(self, transforms=[]):
+    def __init__(self, transforms=[], compile=False, pool=None, executor=None, profile=None):
         assert isinstance(transforms, Sequence)  # nosec - assert
         self.transforms = transforms
+        self.steps = _compile_transforms(transforms) if compile else None
+        self.pool = pool
+        self.executor = executor
+        if profile is None:
+            profile = os.getenv('MAX_PROFILE_TRANSFORMS') == 'true'
+        self.profiler = TransformProfiler(profile if isinstance(profile, str) else None) if profile else None
 
     def apply_transforms(self, img):
         """
@@ -57,15 +94,376 @@ class ImageProcessor(object):
             The transformed image.
             Depending on the transformation the output is either a Pillow Image object or a numpy ndarray.
         """
-        # verify whether the Normalize or Standardize transformations are positioned at the end
-        encoding = [(isinstance(t, Normalize) or isinstance(t, Standardize)) for t in self.transforms]
-        if sum(encoding[:-1]) != 0:
-            raise ValueError('A Standardize or Normalize transformation can only be positioned at the end of the'
-                             'pipeline.')
-        # apply the transformations
+        steps = self._steps()
+        with stage_timer('image_transforms'):
+            return _run(steps, img, self.pool, self.profiler)
+
+    def profile_summary(self):
+        """
+        Return the profile of the transformations, when the processor was created with `profile` set.
+
+        output:
+            A dictionary with the `name` of the profile and a list of `steps`, one for each transformation in the
+            order of the pipeline, with the number of `calls` and `errors`, the `total_seconds`, `mean_seconds`
+            and `max_seconds` spent in the transformation, the `bytes_allocated` for its outputs (in total and
+            `mean_bytes_allocated` per call), and the shapes and data types of its `inputs` and `outputs` with
+            their number of occurrences. Returns None when profiling is disabled.
+        """
+        return self.profiler.summary() if self.profiler is not None else None
+
+    def map_transforms(self, images, return_exceptions=False):
+        """
+        Apply the transformations to several images, using the executor of the processor if it has one.
+
+        args:
+            images: a sequence of images, each in bytes format, as a Pillow image object, or a numpy ndarray
+            return_exceptions: return the exception raised for an image in place of its result, instead of raising
+                the first exception
+
+        output:
+            The list of transformed images, in the order of the input images.
+        """
+        steps = self._steps()
+        if self.executor is not None:
+            with stage_timer('image_transforms'):
+                return self.executor.map(steps, list(images), return_exceptions=return_exceptions)
+
+        results = []
+        for img in images:
+            try:
+                results.append(self.apply_transforms(img))
+            except Exception as e:
+                if not return_exceptions:
+                    raise
+                results.append(e)
+        return results
+
+    def apply_batch(self, images, out=None, layout=None, dtype=None):
+        """
+        Apply the transformations to several images and collect the results in a single batch array.
+
+        Every result is written directly into its slice of the output array, which avoids a separate `np.stack`.
+        When the pipeline ends with ``ToTensor``, the tensors are computed straight into the output array.
+
+        args:
+            images: a sequence of images, each in bytes format, as a Pillow image object, or a numpy ndarray
+            out: an optional preallocated array to write the results into, with at least `len(images)` rows and the
+                shape of a transformed image (in the given layout) for each row
+            layout: the layout of the output array, `'NHWC'` (channels last, default) or `'NCHW'` (channels first).
+                For a pipeline that ends with ``ToTensor``, this is the layout of the tensors.
+            dtype: the data type of the output array (ignored when `out` is given). Defaults to `np.float32`, or
+                to the data type of the final ``ToTensor``.
+                When the processor has a pool, the output array is taken from it and can be handed back with
+                ``pool.release`` once the batch has been used.
+
+        output:
+            A numpy ndarray of shape N x H x W x C (or N x C x H x W), with N the number of images.
+            Single-channel results get a channel axis of size 1.
+        """
+        steps = self._steps()
+        tensor = steps[-1] if steps and isinstance(steps[-1], ToTensor) else None
+        if tensor is not None:
+            if layout not in (None, 'N' + tensor.layout):
+                raise ValueError("layout should be {!r} for a pipeline that ends with ToTensor(layout={!r}). Got {}."
+                                 .format('N' + tensor.layout, tensor.layout, layout))
+            dtype = tensor.dtype if dtype is None else dtype
+        else:
+            layout = 'NHWC' if layout is None else layout
+            dtype = np.float32 if dtype is None else dtype
+            if layout not in ('NHWC', 'NCHW'):
+                raise ValueError("layout should be 'NHWC' or 'NCHW'. Got {}.".format(layout))
+        images = list(images)
+        if not images:
+            raise ValueError('The batch should contain at least one image.')
+        if out is not None and len(out) < len(images):
+            raise ValueError('The output array has room for {} images, but the batch contains {}.'
+                             .format(len(out), len(images)))
+
+        if self.executor is not None:
+            # the images are transformed by the executor, all the way to their final array
+            with stage_timer('image_transforms'):
+                results = self.executor.map(steps, images)
+        else:
+            results = None
+
+        for i, img in enumerate(images):
+            with stage_timer('image_transforms') if results is None else nullcontext():
+                if tensor is not None:
+                    if results is None:
+                        result = _run(steps[:-1], img, self.pool, self.profiler)
+                        arr = tensor._as_array(result)
+                        shape = tensor._shape(arr)
+                    else:
+                        result = arr = results[i][0] if tensor.batch_axis else results[i]
+                        shape = arr.shape
+                else:
+                    result = arr = np.asarray(_run(steps, img, self.pool, self.profiler) if results is None else results[i])
+                    if arr.ndim == 2:
+                        arr = arr[:, :, np.newaxis]
+                    if layout == 'NCHW':
+                        arr = arr.transpose(2, 0, 1)
+                    shape = arr.shape
+
+                if out is None:
+                    shape_out = (len(images),) + shape
+                    out = np.empty(shape_out, dtype=dtype) if self.pool is None else self.pool.acquire(shape_out, dtype)
+                if shape != out.shape[1:]:
+                    raise ValueError('All the images in a batch must have the same shape after the transformations, '
+                                     'expected {} but image {} has shape {}.'.format(out.shape[1:], i, shape))
+                if tensor is not None and results is None:
+                    tensor._write(arr, out[i])
+                else:
+                    out[i] = arr
+                if self.pool is not None:
+                    _release(self.pool, result, img, out)
+        return out
+
+    def _steps(self):
+        if self.steps is not None:
+            # the compiled pipeline has been validated already
+            return self.steps
+        _validate_transforms(self.transforms)
+        return self.transforms
+
+
+def _run(steps, img, pool=None, profiler=None):
+    # apply the transformations, handing the intermediate arrays back to the pool
+    original = img
+    for i, t in enumerate(steps):
+        result = t(img) if profiler is None else profiler.call(i, t, img)
+        if pool is not None:
+            _release(pool, img, original, result)
+        img = result
+    return img
+
+
+def _release(pool, arr, *keep):
+    """Release `arr` to `pool`, unless it is (part of) one of the arrays in `keep`, which are still in use."""
+    if isinstance(arr, np.ndarray) and \
+            not any(isinstance(k, np.ndarray) and np.may_share_memory(arr, k) for k in keep):
+        pool.release(arr)
+
+
+def _validate_transforms(transforms):
+    """Verify whether the terminal transformations are positioned at the end (or Normalize or Standardize in front
+    of a final ToTensor)."""
+    for t, u in zip(transforms, transforms[1:]):
+        if getattr(t, 'terminal', False) and (isinstance(t, ToTensor) or not isinstance(u, ToTensor)):
+            raise ValueError('A Standardize, Normalize or ToTensor transformation can only be positioned at the end '
+                             'of the pipeline (Standardize and Normalize may be followed by ToTensor).')
+
+
+def _output_mode(t, mode):
+    """The mode of the image produced by the transform `t` for an input of the given mode (None if unknown)."""
+    if isinstance(t, ToPILImage):
+        return t.target_mode
+    if isinstance(t, Grayscale):
+        return {1: 'L', 3: 'RGB', 4: 'RGBA'}.get(t.num_output_channels)
+    if isinstance(t, (Resize, Rotate, _AffineResample, _ResizeFirst, AdjustBrightness, AdjustContrast, AdjustGamma,
+                      AdjustHue, _PointAdjust)):
+        return mode
+    return None
+
+
+def _is_geometric(t):
+    return isinstance(t, (Resize, Rotate))
+
+
+def _commutes_with_resize(t):
+    # brightness and contrast factors up to 1 blend the pixels with black or with their mean intensity, without
+    # clipping, just like the resampling filters without negative lobes blend neighbouring pixels; gamma, hue and
+    # stronger adjustments change the result when they are applied after the resize
+    if isinstance(t, _PointAdjust):
+        return all(_commutes_with_resize(u) for u in t.transforms)
+    if isinstance(t, AdjustBrightness):
+        return 0 <= t.brightness_factor <= 1
+    if isinstance(t, AdjustContrast):
+        return 0 <= t.contrast_factor <= 1
+    return False
+
+
+def _compile_transforms(transforms):
+    """Rewrite a validated sequence of transforms into a cheaper sequence of steps with the same result."""
+    _validate_transforms(transforms)
+    steps = list(transforms)
+
+    # 1. convert to grayscale before resizing or rotating (RGB images are resampled channel by channel)
+    i = 0
+    while i < len(steps):
+        t = steps[i]
+        if isinstance(t, Grayscale) and t.num_output_channels in (1, 3):
+            j = i
+            while j > 0 and _is_geometric(steps[j - 1]):
+                j -= 1
+            mode = None
+            for s in steps[:j]:
+                mode = _output_mode(s, mode)
+            if j < i and mode == 'RGB':
+                if t.num_output_channels == 1:
+                    del steps[i]
+                steps.insert(j, Grayscale(1))
+        i += 1
+
+    # 2. decode straight to grayscale
+    i = 0
+    while i < len(steps) - 1:
+        t, u = steps[i], steps[i + 1]
+        if isinstance(t, ToPILImage) and t.target_mode in ('RGB', 'RGBA', 'RGBX', 'L') and \
+                isinstance(u, Grayscale) and u.num_output_channels == 1:
+            steps[i:i + 2] = [ToPILImage('L', t.mode, t.draft_size, t.max_pixels, t.max_bytes)]
+        i += 1
+
+    # 3. decode JPEG images at a reduced resolution when they are resized before anything depends on their size
+    # (only to explicit sizes: the size of a resize of the shorter edge may round differently on a reduced image)
+    for i, t in enumerate(steps):
+        if isinstance(t, ToPILImage) and t.draft_size is None:
+            for u in steps[i + 1:]:
+                if isinstance(u, Resize) and not isinstance(u.size, int):
+                    steps[i] = ToPILImage(t.target_mode, t.mode, u.size, t.max_pixels, t.max_bytes)
+                if not isinstance(u, (Rotate, Grayscale)):
+                    break
+
+    # 4. only the last of several resizes matters when it has an explicit output size
+    i = 0
+    while i < len(steps) - 1:
+        if isinstance(steps[i], Resize) and isinstance(steps[i + 1], Resize) and \
+                not isinstance(steps[i + 1].size, int):
+            del steps[i]
+        else:
+            i += 1
+
+    # 5. merge resizes and a single rotation into one affine resampling
+    i = 0
+    while i < len(steps):
+        j = i
+        rotations = 0
+        while j < len(steps) and _is_geometric(steps[j]) and \
+                (not isinstance(steps[j], Rotate) or rotations == 0) and \
+                (not isinstance(steps[j], Resize) or steps[j].interpolation in _AffineResample.filters):
+            rotations += isinstance(steps[j], Rotate)
+            j += 1
+        if j - i >= 2 and rotations == 1:
+            steps[i:j] = [_AffineResample(steps[i:j])]
+        i += 1
+
+    # 6. merge consecutive brightness, contrast and gamma adjustments into a single lookup table
+    i = 0
+    while i < len(steps):
+        j = i
+        while j < len(steps) and isinstance(steps[j], (AdjustBrightness, AdjustContrast, AdjustGamma)):
+            j += 1
+        if j - i >= 2:
+            steps[i:j] = [_PointAdjust(steps[i:j])]
+        i += 1
+
+    # 7. resize before the adjustments that commute with it when the resize shrinks the image, so that they run
+    # on fewer pixels (Grayscale is left in front of the resize, see 1., where it saves more by resampling a single
+    # channel)
+    i = 0
+    while i < len(steps):
+        j = i
+        while j < len(steps) and _commutes_with_resize(steps[j]):
+            j += 1
+        if j > i and j < len(steps) and isinstance(steps[j], Resize) and steps[j].interpolation in _ResizeFirst.filters:
+            steps[i:j + 1] = [_ResizeFirst(steps[i:j], steps[j])]
+        i += 1
+
+    # 8. the terminal transforms convert PIL images to arrays themselves
+    steps = [t for t, u in zip(steps, steps[1:] + [None])
+             if not (isinstance(t, PILtoarray) and getattr(u, 'terminal', False))]
+    return steps
+
+
+class _AffineResample(object):
+    """A sequence of resizes and rotations, applied as a single affine transformation of the input image.
+
+    Args:
+        transforms (list of ``Resize`` and ``Rotate`` objects): the transforms to apply.
+    """
+    filters = (Image.NEAREST, Image.BILINEAR, Image.BICUBIC)
+
+    def __init__(self, transforms):
+        self.transforms = transforms
+
+    def __repr__(self):
+        return '{}({})'.format(type(self).__name__, ', '.join(type(t).__name__ for t in self.transforms))
+
+    def __call__(self, img):
+        if not F._is_pil_image(img):
+            raise TypeError('img should be PIL Image. Got {}'.format(type(img)))
+
+        # compose the mappings from output to input coordinates of all the transforms
+        w, h = img.size
+        matrix = (1., 0., 0., 0., 1., 0.)
+        resample = Image.NEAREST
+        for t in self.transforms:
+            if isinstance(t, Resize):
+                ow, oh = F.resize_output_size((w, h), t.size)
+                step = (w / ow, 0., 0., 0., h / oh, 0.)
+                resample = t.interpolation
+                w, h = ow, oh
+            else:
+                step = F.rotation_matrix((w, h), t.angle)
+            matrix = _compose(matrix, step)
+
+        # the affine resampling does not antialias, so it is only used when the image can first be reduced by
+        # an integer factor; without a significant downscale the separate transforms are just as fast
+        a, b, c, d, e, f = matrix
+        factor = int(min((a * a + d * d) ** .5, (b * b + e * e) ** .5))
+        if factor < 2 or img.mode in ('1', 'P'):
+            for t in self.transforms:
+                img = t(img)
+            return img
+
+        img = img.reduce(factor)
+        matrix = _compose((1. / factor, 0., 0., 0., 1. / factor, 0.), matrix)
+        return img.transform((w, h), Image.AFFINE, matrix, resample)
+
+
+class _ResizeFirst(object):
+    """A sequence of adjustments followed by a resize, which is applied first when it shrinks the image.
+
+    The adjustments are brightness and contrast adjustments by factors up to 1, which blend every pixel with black
+    or with the mean intensity of the image without clipping. The resize blends neighbouring pixels with a filter
+    without negative lobes, which preserves the mean intensity and does not clip either, so the results only
+    differ by rounding.
+
+    Args:
+        transforms (list of ``AdjustBrightness``, ``AdjustContrast`` and ``_PointAdjust`` objects): the adjustments.
+        resize (``Resize`` object): the resize that follows them.
+    """
+    filters = (Image.BOX, Image.BILINEAR)
+
+    def __init__(self, transforms, resize):
+        self.transforms = transforms
+        self.resize = resize
+
+    def __repr__(self):
+        return '{}({}, Resize)'.format(type(self).__name__, ', '.join(type(t).__name__ for t in self.transforms))
+
+    def __call__(self, img):
+        if not F._is_pil_image(img):
+            raise TypeError('img should be PIL Image. Got {}'.format(type(img)))
+
+        w, h = img.size
+        ow, oh = F.resize_output_size((w, h), self.resize.size)
+        if ow * oh < w * h and img.mode not in ('1', 'P'):
+            img = self.resize(img)
+            for t in self.transforms:
+                img = t(img)
+            return img
+
         for t in self.transforms:
             img = t(img)
-        return img
+        return self.resize(img)
+
+
+def _compose(p, q):
+    """Compose the affine mappings `p` and `q` (given as 6-tuples) into the mapping `p(q(x))`."""
+    pa, pb, pc, pd, pe, pf = p
+    qa, qb, qc, qd, qe, qf = q
+    return (pa * qa + pb * qd, pa * qb + pb * qe, pa * qc + pb * qf + pc,
+            pd * qa + pe * qd, pd * qb + pe * qe, pd * qc + pe * qf + pf)
 
 
 class ToPILImage(object):
@@ -73,6 +471,7 @@ class ToPILImage(object):
 
     Converts a byte stream or a numpy ndarray of shape
     H x W x C to a PIL Image while preserving the value range.
+    PIL Images are only converted to the target mode.
 
     Args:
         mode (`PIL.Image mode`_): color space and pixel depth of input data (optional).
@@ -82,23 +481,35 @@ class ToPILImage(object):
              - If the input has 2 channels, the ``mode`` is assumed to be ``LA``.
              - If the input has 1 channel, the ``mode`` is determined by the data type (i.e ``int``, ``float``,
               ``short``).
+        draft_size (sequence or int): the size the image is resized to later in the pipeline (optional), with the
+            same meaning as the size of ``Resize``. JPEG images are then decoded at a reduced resolution that is
+            still at least this large, which is several times faster for large images.
+        max_pixels (int): reject byte streams that decode to images with more pixels than this (optional).
+            The size is read from the image header, before anything is decoded.
+        max_bytes (int): reject byte streams larger than this (optional).
+
+    Images that exceed a limit raise an ``ImageTooLargeError``, which ``MAXImageProcessor`` turns into a
+    413 response.
 
     .. _PIL.Image mode: https://pillow.readthedocs.io/en/latest/handbook/concepts.html#concept-modes
     """
-    def __init__(self, target_mode, mode=None):
+    def __init__(self, target_mode, mode=None, draft_size=None, max_pixels=None, max_bytes=None):
         self.mode = mode
         self.target_mode = target_mode
+        self.draft_size = draft_size
+        self.max_pixels = max_pixels
+        self.max_bytes = max_bytes
 
     def __call__(self, pic):
         """
         Args:
-            pic (bytestream or numpy.ndarray): Image to be converted to PIL Image.
+            pic (bytestream, numpy.ndarray or PIL Image): Image to be converted to PIL Image.
 
         Returns:
             PIL Image: Image converted to PIL Image.
 
         """
-        return F.to_pil_image(pic, self.target_mode, self.mode)
+        return F.to_pil_image(pic, self.target_mode, self.mode, self.draft_size, self.max_pixels, self.max_bytes)
 
 
 class PILtoarray(object):
@@ -120,17 +531,28 @@ class PILtoarray(object):
 class Normalize(object):
     """
     Normalize the image to a range between [0, 1].
+
+    Args:
+        pool (BufferPool, optional): a pool to take the output arrays from.
     """
+    terminal = True
 
-    def __call__(self, img):
+    def __init__(self, pool=None):
+        self.pool = pool
+
+    def __call__(self, img, out=None):
         """
         Args:
         img (PIL image or numpy.ndarray): Image to be normalized.
+        out (numpy.ndarray, optional): an array of the image's shape to write the normalized image into.
 
         Returns:
         numpy.ndarray: Normalized image.
         """
-        return F.normalize(img)
+        if out is None and self.pool is not None:
+            img = np.asarray(img)
+            out = self.pool.acquire(img.shape, img.dtype if img.dtype.kind == 'f' else np.float64)
+        return F.normalize(img, out=out)
 
 
 class Standardize(object):
@@ -140,24 +562,146 @@ class Standardize(object):
     Args:
         mean (optional): a single number or an n-dimensional sequence with n equal to the number of image channels
         std (optional): a single number or an n-dimensional sequence with n equal to the number of image channels
+        dtype (optional): the data type of the standardized image, e.g. ``np.float32`` or ``np.float16``.
+            Defaults to ``np.float64``.
+        inplace (bool, optional): overwrite input arrays that already have the requested `dtype` instead of
+            allocating a new array.
+        pool (BufferPool, optional): a pool to take the output arrays from.
     Returns:
         numpy.ndarray: standardized image
 
     If `mean` or `std` are not provided, the channel-wise values will be calculated for the input image.
+    Otherwise the scale and offset that implement the standardization are computed once per number of channels
+    and reused for every image.
     """
-    def __init__(self, mean=None, std=None):
+    terminal = True
+
+    def __init__(self, mean=None, std=None, dtype=np.float64, inplace=False, pool=None):
         self.mean = mean
         self.std = std
+        self.dtype = np.dtype(dtype)
+        self.inplace = inplace
+        self.pool = pool
+        self._params = {}
 
-    def __call__(self, img):
+    def __call__(self, img, out=None):
         """
         Args:
         img (PIL image or numpy.ndarray): Image to be standardized.
+        out (numpy.ndarray, optional): an array of the image's shape to write the standardized image into.
 
         Returns:
         numpy.ndarray: Standardized image.
         """
-        return F.standardize(img, self.mean, self.std)
+        img = np.asarray(img)
+        if self.mean is None or self.std is None:
+            # the parameters depend on the image itself
+            scale, offset = F.standardize_params(img, self.mean, self.std)
+        else:
+            key = img.shape[-1] if img.ndim == 3 else None
+            params = self._params.get(key)
+            if params is None:
+                params = self._params[key] = F.standardize_params(img, self.mean, self.std)
+            scale, offset = params
+
+        if out is None and self.inplace and img.dtype == self.dtype and img.flags.writeable:
+            out = img
+        elif out is None and self.pool is not None:
+            out = self.pool.acquire(img.shape, self.dtype)
+        return F.scale_offset(img, scale, offset, dtype=self.dtype, out=out)
+
+
+class ToTensor(object):
+    """
+    Convert the image to a model-ready tensor in a single pass.
+
+    The tensor is ``(img * scale - mean) / std``, computed channel-wise in the requested data type and written in
+    the requested layout, without intermediate copies of the image.
+
+    Args:
+        layout (str, optional): ``'HWC'`` (channels last, default) or ``'CHW'`` (channels first).
+            Single-channel images get a channel axis of size 1.
+        dtype (optional): the data type of the tensor. Defaults to ``np.float32``.
+        mean (optional): a single number or an n-dimensional sequence with n equal to the number of image channels,
+            subtracted after scaling. Defaults to 0.
+        std (optional): a single number or an n-dimensional sequence with n equal to the number of image channels,
+            dividing the result after subtracting the mean. Defaults to 1.
+        scale (number, optional): a factor applied to the pixel values first, e.g. ``1 / 255``. Defaults to 1.
+        batch_axis (bool, optional): prepend a batch axis of size 1 to the tensor.
+        pool (BufferPool, optional): a pool to take the output arrays from.
+    Returns:
+        numpy.ndarray: the tensor
+
+    Example:
+        >>> ToTensor(layout='CHW', mean=[0.485, 0.456, 0.406], std=[0.229, 0.224, 0.225], scale=1 / 255)
+    """
+    terminal = True
+
+    def __init__(self, layout='HWC', dtype=np.float32, mean=0, std=1, scale=1, batch_axis=False, pool=None):
+        if layout not in ('HWC', 'CHW'):
+            raise ValueError("layout should be 'HWC' or 'CHW'. Got {}.".format(layout))
+        self.layout = layout
+        self.dtype = np.dtype(dtype)
+        self.mean = mean
+        self.std = std
+        self.scale = scale
+        self.batch_axis = batch_axis
+        self.pool = pool
+
+        # fold the scale, mean and std into a single scale and offset per channel
+        mean = np.atleast_1d(np.asarray(mean, dtype=np.float64))
+        std = np.atleast_1d(np.asarray(std, dtype=np.float64))
+        if mean.ndim != 1 or std.ndim != 1:
+            raise ValueError('`mean` and `std` should be numbers or sequences of numbers.')
+        if np.any(std == 0):
+            raise ValueError('`std` cannot be 0.')
+        self._scale = scale / std
+        self._offset = -mean / std
+
+    def __call__(self, img, out=None):
+        """
+        Args:
+        img (PIL image or numpy.ndarray): Image to be converted, with the channels last.
+        out (numpy.ndarray, optional): an array of the tensor's shape to write the tensor into.
+
+        Returns:
+        numpy.ndarray: the tensor.
+        """
+        img = self._as_array(img)
+        shape = self._shape(img)
+        if self.batch_axis:
+            shape = (1,) + shape
+        if out is None:
+            out = np.empty(shape, dtype=self.dtype) if self.pool is None else self.pool.acquire(shape, self.dtype)
+        elif out.shape != shape:
+            raise ValueError('The output array should have the shape of the tensor {}. Got {}.'.format(shape, out.shape))
+        self._write(img, out[0] if self.batch_axis else out)
+        return out
+
+    def _as_array(self, img):
+        """Return the image as an array with a channel axis, and check it against the mean and std."""
+        img = np.asarray(img)
+        if img.ndim == 2:
+            img = img[:, :, np.newaxis]
+        if img.ndim != 3:
+            raise ValueError('img should be 2 or 3 dimensional. Got {} dimensions.'.format(img.ndim))
+        for name, values in (('mean', self._offset), ('std', self._scale)):
+            if len(values) not in (1, img.shape[2]):
+                raise ValueError('The size of the `{}` array must correspond to the number of channels in the image.'
+                                 .format(name))
+        return img
+
+    def _shape(self, img):
+        """The shape of the tensor for an image returned by `_as_array`, without the batch axis."""
+        h, w, c = img.shape
+        return (h, w, c) if self.layout == 'HWC' else (c, h, w)
+
+    def _write(self, img, out):
+        """Write the tensor for an image returned by `_as_array` into `out`, an array without the batch axis."""
+        if self.layout == 'CHW':
+            # write through a channels-last view, so the transposition happens in the same pass
+            out = out.transpose(1, 2, 0)
+        F.scale_offset(img, self._scale, self._offset, out=out)
 
 
 class Resize(object):
@@ -237,3 +781,126 @@ class Grayscale(object):
             PIL Image: Randomly grayscaled image.
         """
         return F.to_grayscale(img, num_output_channels=self.num_output_channels)
+
+
+class AdjustBrightness(object):
+    """Adjust the brightness of the input PIL Image.
+
+    Args:
+        brightness_factor (float): How much to adjust the brightness. 0 gives a black image, 1 gives the original
+            image while 2 increases the brightness by a factor of 2.
+    """
+
+    def __init__(self, brightness_factor):
+        self.brightness_factor = brightness_factor
+
+    @property
+    def adjustment(self):
+        return ('brightness', self.brightness_factor)
+
+    def __call__(self, img):
+        """
+        Args:
+            img (PIL Image): Image to be adjusted.
+
+        Returns:
+            PIL Image: Brightness adjusted image.
+        """
+        return F.adjust_brightness(img, self.brightness_factor)
+
+
+class AdjustContrast(object):
+    """Adjust the contrast of the input PIL Image.
+
+    Args:
+        contrast_factor (float): How much to adjust the contrast. 0 gives a solid gray image, 1 gives the original
+            image while 2 increases the contrast by a factor of 2.
+    """
+
+    def __init__(self, contrast_factor):
+        self.contrast_factor = contrast_factor
+
+    @property
+    def adjustment(self):
+        return ('contrast', self.contrast_factor)
+
+    def __call__(self, img):
+        """
+        Args:
+            img (PIL Image): Image to be adjusted.
+
+        Returns:
+            PIL Image: Contrast adjusted image.
+        """
+        return F.adjust_contrast(img, self.contrast_factor)
+
+
+class AdjustGamma(object):
+    """Perform gamma correction on the input PIL Image.
+
+    Args:
+        gamma (float): Non negative real number. Gamma larger than 1 makes the shadows darker, while gamma smaller
+            than 1 makes dark regions lighter.
+        gain (float): The constant multiplier.
+    """
+
+    def __init__(self, gamma, gain=1):
+        self.gamma = gamma
+        self.gain = gain
+
+    @property
+    def adjustment(self):
+        return ('gamma', self.gamma, self.gain)
+
+    def __call__(self, img):
+        """
+        Args:
+            img (PIL Image): Image to be adjusted.
+
+        Returns:
+            PIL Image: Gamma corrected image.
+        """
+        return F.adjust_gamma(img, self.gamma, self.gain)
+
+
+class AdjustHue(object):
+    """Shift the hue of the input PIL Image.
+
+    Args:
+        hue_factor (float): How much to shift the hue channel, in [-0.5, 0.5]. 0 gives the original image, while
+            both -0.5 and 0.5 give an image with complementary colors.
+        approximate (bool): use a precomputed 3D lookup table, which is faster but not exact (see ``adjust_hue``).
+    """
+
+    def __init__(self, hue_factor, approximate=False):
+        self.hue_factor = hue_factor
+        self.approximate = approximate
+
+    def __call__(self, img):
+        """
+        Args:
+            img (PIL Image): Image to be adjusted.
+
+        Returns:
+            PIL Image: Hue adjusted image.
+        """
+        return F.adjust_hue(img, self.hue_factor, self.approximate)
+
+
+class _PointAdjust(object):
+    """A sequence of point-wise adjustments (brightness, contrast and gamma), applied with a single lookup table.
+
+    Args:
+        transforms (list of ``AdjustBrightness``, ``AdjustContrast`` and ``AdjustGamma`` objects): the transforms
+            to apply.
+    """
+
+    def __init__(self, transforms):
+        self.transforms = transforms
+        self.adjustments = [t.adjustment for t in transforms]
+
+    def __repr__(self):
+        return '{}({})'.format(type(self).__name__, ', '.join(type(t).__name__ for t in self.transforms))
+
+    def __call__(self, img):
+        return F.adjust_points(img, self.adjustments)
@@ -0,0 +1,292 @@
+#
+# Copyright 2018-2019 IBM Corp. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+"""Lightweight, thread-safe metrics with Prometheus text exposition.
+
+Example:
+    >>> LATENCY = Histogram('my_latency_seconds', 'Latency of my code', ['step'])
+    >>> with LATENCY.labels('load').time():
+    >>>     load()
+    >>> print(REGISTRY.exposition())
+"""
+import bisect
+import threading
+import time
+
+DEFAULT_BUCKETS = (.001, .0025, .005, .01, .025, .05, .1, .25, .5, 1., 2.5, 5., 10., 30.)
+
+
+class Registry(object):
+    """A collection of metrics that are exposed together.
+
+    Args:
+        const_labels (sequence of (name, value) pairs): labels added to all the samples (optional), e.g. to tell
+            apart the metrics of the worker processes of a server, which each have their own.
+    """
+
+    def __init__(self, const_labels=()):
+        self.const_labels = tuple(const_labels)
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        with self._lock:
+            if metric.name in self._metrics:
+                raise ValueError('A metric with the name {} is already registered.'.format(metric.name))
+            self._metrics[metric.name] = metric
+
+    def get(self, name):
+        return self._metrics.get(name)
+
+    def exposition(self):
+        """Return all the metrics in the Prometheus text exposition format."""
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.append('# HELP {} {}'.format(metric.name, metric.documentation.replace('\n', ' ')))
+            lines.append('# TYPE {} {}'.format(metric.name, metric.type))
+            lines.extend(metric.samples(self.const_labels))
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join('{}="{}"'.format(name, _escape(value)) for name, value in pairs) + '}'
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value))
+
+
+class _Metric(object):
+    type = None
+
+    def __init__(self, name, documentation, labelnames=(), registry=REGISTRY):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children = {}
+        self._lock = threading.Lock()
+        if registry is not None:
+            registry.register(self)
+
+    def labels(self, *values):
+        """Return the metric for the given label values."""
+        if len(values) != len(self.labelnames):
+            raise ValueError('Expected {} label values, got {}.'.format(len(self.labelnames), len(values)))
+        child = self._children.get(values)
+        if child is None:
+            with self._lock:
+                child = self._children.setdefault(values, self._new_child())
+        return child
+
+    def samples(self, extra=()):
+        with self._lock:
+            children = list(self._children.items())
+        if not children and not self.labelnames:
+            children = [((), self.labels())]
+        lines = []
+        for values, child in sorted(children, key=lambda item: tuple(str(v) for v in item[0])):
+            lines.extend(child.samples(self.name, self.labelnames, values, extra))
+        return lines
+
+    def _new_child(self):
+        raise NotImplementedError()
+
+    def __getattr__(self, attr):
+        # metrics without labels can be used directly
+        if not attr.startswith('_') and self.__dict__.get('labelnames') == ():
+            return getattr(self.labels(), attr)
+        raise AttributeError(attr)
+
+
+class _Timer(object):
+
+    def __init__(self, observe):
+        self._observe = observe
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._observe(time.perf_counter() - self._start)
+
+
+class _CounterChild(object):
+
+    def __init__(self):
+        self._value = 0.0
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1):
+        if amount < 0:
+            raise ValueError('Counters can only be incremented.')
+        with self._lock:
+            self._value += amount
+
+    def get(self):
+        return self._value
+
+    def samples(self, name, labelnames, values, extra=()):
+        return ['{}{} {}'.format(name, _format_labels(labelnames, values, extra), _format_value(self._value))]
+
+
+class Counter(_Metric):
+    """A monotonically increasing value, e.g. the number of requests."""
+    type = 'counter'
+
+    def _new_child(self):
+        return _CounterChild()
+
+
+class _GaugeChild(object):
+
+    def __init__(self):
+        self._value = 0.0
+        self._function = None
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1):
+        with self._lock:
+            self._value += amount
+
+    def dec(self, amount=1):
+        with self._lock:
+            self._value -= amount
+
+    def set(self, value):
+        with self._lock:
+            self._value = value
+
+    def set_function(self, function):
+        """Report the return value of `function` instead of a stored value."""
+        self._function = function
+
+    def get(self):
+        return self._function() if self._function is not None else self._value
+
+    def samples(self, name, labelnames, values, extra=()):
+        return ['{}{} {}'.format(name, _format_labels(labelnames, values, extra), _format_value(self.get()))]
+
+
+class Gauge(_Metric):
+    """A value that can go up and down, e.g. the number of requests in progress."""
+    type = 'gauge'
+
+    def _new_child(self):
+        return _GaugeChild()
+
+
+class _HistogramChild(object):
+
+    def __init__(self, buckets):
+        self._buckets = buckets
+        self._counts = [0] * (len(buckets) + 1)
+        self._sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        i = bisect.bisect_left(self._buckets, value)
+        with self._lock:
+            self._counts[i] += 1
+            self._sum += value
+
+    def time(self):
+        """Return a context manager that observes the duration of its block in seconds."""
+        return _Timer(self.observe)
+
+    def get(self):
+        """Return the number and the sum of the observed values."""
+        with self._lock:
+            return sum(self._counts), self._sum
+
+    def samples(self, name, labelnames, values, extra=()):
+        with self._lock:
+            counts = list(self._counts)
+            total = self._sum
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self._buckets + (float('inf'),), counts):
+            cumulative += count
+            bucket_labels = _format_labels(labelnames, values, list(extra) + [('le', _format_value(bound))])
+            lines.append('{}_bucket{} {}'.format(name, bucket_labels, cumulative))
+        lines.append('{}_sum{} {}'.format(name, _format_labels(labelnames, values, extra), _format_value(total)))
+        lines.append('{}_count{} {}'.format(name, _format_labels(labelnames, values, extra), cumulative))
+        return lines
+
+
+class Histogram(_Metric):
+    """The distribution of observed values (e.g. latencies) over a fixed set of buckets."""
+    type = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), registry=REGISTRY, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(sorted(float(b) for b in buckets if b != float('inf')))
+        super().__init__(name, documentation, labelnames, registry)
+
+    def _new_child(self):
+        return _HistogramChild(self.buckets)
+
+
+# The metrics collected by the framework
+STAGE_SECONDS = Histogram('maxfw_stage_seconds',
+                          'Time spent in each stage of the inference pipeline', ['stage'])
+STAGE_ERRORS = Counter('maxfw_stage_errors_total',
+                       'Number of errors raised in each stage of the inference pipeline', ['stage'])
+PREDICTIONS = Counter('maxfw_predictions_total', 'Number of predictions made by the model')
+PREDICTIONS_IN_PROGRESS = Gauge('maxfw_predictions_in_progress', 'Number of predictions in progress')
+REQUEST_SECONDS = Histogram('maxfw_request_seconds', 'Time spent handling HTTP requests', ['method', 'endpoint'])
+REQUESTS = Counter('maxfw_requests_total', 'Number of HTTP requests handled', ['method', 'endpoint', 'status'])
+REQUEST_ERRORS = Counter('maxfw_request_errors_total',
+                         'Number of HTTP requests that failed with a server error', ['method', 'endpoint'])
+REQUESTS_IN_PROGRESS = Gauge('maxfw_requests_in_progress', 'Number of HTTP requests in progress')
+READY = Gauge('maxfw_ready', 'Whether the app has completed its warm-up and is ready to serve predictions')
+ADMISSION_IN_FLIGHT = Gauge('maxfw_admission_in_flight', 'Number of requests admitted by the admission controllers')
+ADMISSION_QUEUE_DEPTH = Gauge('maxfw_admission_queue_depth', 'Number of requests waiting in the admission queues')
+ADMISSION_REJECTED = Counter('maxfw_admission_rejected_total',
+                             'Number of requests rejected by the admission controllers', ['reason'])
+ADMISSION_WAIT_SECONDS = Histogram('maxfw_admission_wait_seconds', 'Time spent by requests in the admission queues')
+WARM_UP_SECONDS = Gauge('maxfw_warm_up_seconds', 'Duration of the last warm-up of the app')
+
+
+class stage_timer(object):
+    """Context manager recording the duration, and any error, of a pipeline stage."""
+
+    __slots__ = ('_histogram', '_errors', '_start')
+
+    def __init__(self, stage):
+        self._histogram = STAGE_SECONDS.labels(stage)
+        self._errors = STAGE_ERRORS.labels(stage)
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self._histogram.observe(time.perf_counter() - self._start)
+        if exc_type is not None:
+            self._errors.inc()
@@ -0,0 +1,180 @@
+#
+# Copyright 2018-2019 IBM Corp. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+"""Per-transformation profiles of ``ImageProcessor`` pipelines.
+
+Profiling is enabled per processor with ``ImageProcessor(..., profile=True)``, or for all the processors with the
+`MAX_PROFILE_TRANSFORMS` environment variable set to `true`. The profiles are read with
+``ImageProcessor.profile_summary()``, with ``summaries()`` for all the profiled processors, or on the
+`/admin/profile` endpoint of a `MAXApp`, when it is enabled by the `MAX_PROFILE_ENDPOINT` setting.
+"""
+import threading
+import time
+import weakref
+
+import numpy as np
+from PIL import Image
+
+# the number of distinct input and output signatures kept per transformation
+MAX_SIGNATURES = 8
+
+# the size in bytes of a band of the PIL image modes that do not use one byte per band
+_MODE_BAND_BYTES = {'I': 4, 'F': 4, 'I;16': 2, 'I;16B': 2, 'I;16L': 2}
+
+_profilers = weakref.WeakSet()
+_profilers_lock = threading.Lock()
+
+
+def _signature(img):
+    """Return the shape and data type of an image, array or encoded image."""
+    if isinstance(img, np.ndarray):
+        return tuple(img.shape), img.dtype.str
+    elif isinstance(img, Image.Image):
+        bands = len(img.getbands())
+        return (img.height, img.width) + ((bands,) if bands > 1 else ()), 'PIL:' + img.mode
+    elif isinstance(img, (bytes, bytearray)):
+        return (len(img),), 'bytes'
+    return None, type(img).__name__
+
+
+def _allocated(img, result):
+    """Return the size of the output of a transformation, unless it shares the memory of its input."""
+    if result is img:
+        return 0
+    if isinstance(result, np.ndarray):
+        if isinstance(img, np.ndarray) and np.may_share_memory(img, result):
+            return 0
+        return result.nbytes
+    if isinstance(result, Image.Image):
+        if result.readonly:
+            # wraps the buffer of an array
+            return 0
+        return result.width * result.height * len(result.getbands()) * _MODE_BAND_BYTES.get(result.mode, 1)
+    return 0
+
+
+class _StepProfile(object):
+
+    def __init__(self, name):
+        self.name = name
+        self.calls = 0
+        self.errors = 0
+        self.seconds = 0.0
+        self.max_seconds = 0.0
+        self.allocated = 0
+        self.inputs = {}
+        self.outputs = {}
+
+    def record(self, img, result, seconds, error):
+        self.calls += 1
+        self.seconds += seconds
+        self.max_seconds = max(self.max_seconds, seconds)
+        _count(self.inputs, _signature(img))
+        if error:
+            self.errors += 1
+        else:
+            self.allocated += _allocated(img, result)
+            _count(self.outputs, _signature(result))
+
+    def summary(self):
+        return {
+            'transform': self.name,
+            'calls': self.calls,
+            'errors': self.errors,
+            'total_seconds': self.seconds,
+            'mean_seconds': self.seconds / self.calls if self.calls else 0.0,
+            'max_seconds': self.max_seconds,
+            'bytes_allocated': self.allocated,
+            'mean_bytes_allocated': self.allocated // self.calls if self.calls else 0,
+            'inputs': _signatures(self.inputs),
+            'outputs': _signatures(self.outputs),
+        }
+
+
+def _count(counts, signature):
+    if signature in counts or len(counts) < MAX_SIGNATURES:
+        counts[signature] = counts.get(signature, 0) + 1
+
+
+def _signatures(counts):
+    return [{'shape': list(shape) if shape is not None else None, 'dtype': dtype, 'count': count}
+            for (shape, dtype), count in sorted(counts.items(), key=lambda item: -item[1])]
+
+
+class TransformProfiler(object):
+    """Collects the wall time, the input and output shapes and data types, and the bytes allocated by each
+    transformation of a pipeline over the calls of ``ImageProcessor.apply_transforms``.
+
+    The bytes allocated by a transformation are the size of its output, unless the output shares the memory of
+    its input. The profiled transformations are those actually run, i.e. those of the compiled pipeline of a
+    processor created with `compile=True`.
+
+    Args:
+        name (str): the name of the profile. Defaults to the names of the transformations.
+    """
+
+    def __init__(self, name=None):
+        self.name = name
+        self._steps = {}
+        self._lock = threading.Lock()
+        with _profilers_lock:
+            _profilers.add(self)
+
+    def call(self, index, transform, img):
+        """Apply the transformation at position `index` of the pipeline to `img`, and record the call."""
+        start = time.perf_counter()
+        try:
+            result = transform(img)
+        except BaseException:
+            self._record(index, transform, img, None, time.perf_counter() - start, True)
+            raise
+        self._record(index, transform, img, result, time.perf_counter() - start, False)
+        return result
+
+    def _record(self, index, transform, img, result, seconds, error):
+        key = (index, type(transform).__name__)
+        with self._lock:
+            step = self._steps.get(key)
+            if step is None:
+                step = self._steps[key] = _StepProfile(key[1])
+            step.record(img, result, seconds, error)
+
+    def summary(self):
+        """Return the profile as a dictionary with the `name` of the profile and a list of `steps`, in the order
+        of the pipeline."""
+        with self._lock:
+            steps = [step.summary() for _, step in sorted(self._steps.items())]
+        name = self.name or ' > '.join(step['transform'] for step in steps)
+        return {'name': name, 'steps': steps}
+
+    def reset(self):
+        """Forget the recorded calls."""
+        with self._lock:
+            self._steps.clear()
+
+
+def summaries():
+    """Return the summaries of all the profilers that have recorded at least one call."""
+    with _profilers_lock:
+        profilers = list(_profilers)
+    return [s for s in (p.summary() for p in profilers) if s['steps']]
+
+
+def reset():
+    """Reset all the profilers."""
+    with _profilers_lock:
+        profilers = list(_profilers)
+    for p in profilers:
+        p.reset()
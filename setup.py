@@ -35,6 +35,10 @@ setup(name='maxfw',
         'Pillow>=8.1.1',
         'numpy>=1.18.4',
         ],
+      extras_require={
+        'server': ['gunicorn>=20.0'],
+        'async': ['uvicorn>=0.11'],
+        },
       test_suite='nose.collector',
       tests_require=['nose']
       )